@@ -0,0 +1,177 @@
+"""
+Stale-while-revalidate cache for expensive computations.
+
+Entries are stored with the time they were computed and the generation of
+their namespace. An entry older than its fresh period, or of an older
+generation, is still served while at most one background recomputation
+per key is triggered. Invalidating a namespace only bumps its generation,
+so the last computed payload stays available until it is replaced.
+"""
+
+import json
+import time
+import hashlib
+import threading
+
+from sentry_sdk import capture_exception
+
+from django.core.cache import cache
+from django.db import connection
+
+
+# Seconds an entry is served without recomputation.
+FRESH_FOR = 60
+# Seconds an entry is kept to be served while it is recomputed.
+KEEP_FOR = 24 * 60 * 60
+# Seconds after which a recomputation lock is released.
+LOCK_TIMEOUT = 5 * 60
+# Seconds a request waits for a recomputation of a missing entry.
+MISS_WAIT = 10
+
+STATS = ("hit", "stale", "miss", "recompute")
+
+
+def get_cache_key(namespace, params=None):
+    """
+    Function to get the cache key of the params in a namespace.
+
+    Input Params:
+        namespace(str): namespace of the cached values.
+        params(dict): JSON serializable params of the computation.
+    Returns:
+        (str): cache key.
+    """
+    digest = hashlib.md5(
+        json.dumps(params or {}, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return "%s:%s" % (namespace, digest)
+
+
+def increment(key):
+    """Function to increment a counter in the cache."""
+    if cache.add(key, 1, timeout=None):
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def get_generation(namespace):
+    """Function to get the current generation of a namespace."""
+    return cache.get("%s:generation" % namespace, 0)
+
+
+def invalidate(namespace):
+    """
+    Function to invalidate all the entries of a namespace.
+
+    The entries are marked stale by moving to the next generation, they
+    are served until their recomputation replaces them.
+    """
+    increment("%s:generation" % namespace)
+
+
+def increment_stat(namespace, stat):
+    """Function to count a cache event of a namespace."""
+    increment("%s:stats:%s" % (namespace, stat))
+
+
+def get_stats(namespace):
+    """
+    Function to get the hit/miss/recompute counters of a namespace.
+
+    Input Params:
+        namespace(str): namespace of the cached values.
+    Returns:
+        (dict): count of each cache event.
+    """
+    keys = {"%s:stats:%s" % (namespace, stat): stat for stat in STATS}
+    values = cache.get_many(list(keys))
+    stats = {stat: values.get(key, 0) for key, stat in keys.items()}
+    stats["generation"] = get_generation(namespace)
+    return stats
+
+
+def recompute(namespace, key, compute, generation, keep_for):
+    """
+    Function to compute and store an entry.
+
+    The lock of the key should be acquired by the caller, it is released
+    once the entry is stored.
+    """
+    try:
+        data = compute()
+        cache.set(key, {
+            "data": data,
+            "generation": generation,
+            "computed_on": time.time(),
+        }, timeout=keep_for)
+        increment_stat(namespace, "recompute")
+        return data
+    finally:
+        cache.delete("%s:lock" % key)
+
+
+def recompute_in_background(namespace, key, compute, generation, keep_for):
+    """Function to recompute an entry in a separate thread."""
+
+    def run():
+        try:
+            recompute(namespace, key, compute, generation, keep_for)
+        except Exception as e:
+            capture_exception(e)
+        finally:
+            # Threads get their own connection, that is not closed by
+            # the request cycle.
+            connection.close()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def get_or_compute(
+        namespace, params, compute, fresh_for=FRESH_FOR, keep_for=KEEP_FOR):
+    """
+    Function to get a cached value, computing it when required.
+
+    A fresh entry is returned as it is. A stale entry is returned and
+    recomputed in the background by the first request that acquires the
+    lock of the key. A missing entry is computed by the first request,
+    while the concurrent requests wait for it.
+
+    Input Params:
+        namespace(str): namespace of the cached values.
+        params(dict): JSON serializable params of the computation.
+        compute(callable): function without arguments to compute the value.
+        fresh_for(int): seconds the value is served without recomputing.
+        keep_for(int): seconds the value is kept to be served when stale.
+    Returns:
+        value from compute.
+    """
+    key = get_cache_key(namespace, params)
+    lock_key = "%s:lock" % key
+    generation = get_generation(namespace)
+    entry = cache.get(key)
+
+    if entry is not None:
+        if (entry["generation"] == generation
+                and entry["computed_on"] + fresh_for > time.time()):
+            increment_stat(namespace, "hit")
+            return entry["data"]
+        increment_stat(namespace, "stale")
+        if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+            recompute_in_background(
+                namespace, key, compute, generation, keep_for)
+        return entry["data"]
+
+    increment_stat(namespace, "miss")
+    if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        return recompute(namespace, key, compute, generation, keep_for)
+    waited = 0
+    while waited < MISS_WAIT:
+        time.sleep(0.1)
+        waited += 0.1
+        entry = cache.get(key)
+        if entry is not None:
+            return entry["data"]
+    return compute()
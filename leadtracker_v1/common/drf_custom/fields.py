@@ -160,6 +160,23 @@ class IdencodeField(serializers.CharField):
         self.related_model = related_model
         super(IdencodeField, self).__init__(*args, **kwargs)
 
+    def get_attribute(self, instance):
+        """
+        Override the attribute lookup of foreign keys.
+
+        Without a serializer only the id of the related object is
+        returned, so it is read from the foreign key column instead of
+        loading the object.
+        """
+        if not self.serializer and len(self.source_attrs) == 1:
+            try:
+                field = instance._meta.get_field(self.source_attrs[0])
+            except Exception:
+                field = None
+            if field and field.many_to_one:
+                return getattr(instance, field.attname)
+        return super(IdencodeField, self).get_attribute(instance)
+
     def to_representation(self, value):
         """
         Override the returning method.
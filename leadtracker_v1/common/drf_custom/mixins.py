@@ -1,5 +1,13 @@
 """Custom mixing."""
 
+import sys
+
+from django.db.models import Prefetch
+from django.core.exceptions import FieldDoesNotExist
+
+from rest_framework.permissions import SAFE_METHODS
+
+from common.exceptions import BadRequest
 from common.library import pop_out_from_dictionary
 
 
@@ -60,3 +68,196 @@ class WriteOnceMixin:
         if made_mutable:
             self._kwargs["data"]._mutable = _mutable
         return extra_kwargs
+
+
+class SparseFieldsMixin:
+    """
+    Adds support for sparse fieldsets to Serializers.
+
+    On read requests, the fields of the serializer can be selected with
+    `?fields=idencode,name` or dropped with `?omit=revenue`, comma
+    separated. The fields are kept as they are for writes, so that
+    validation is not skipped, and for serializers without a request in
+    the context, like nested ones.
+    """
+
+    fields_query_param = "fields"
+    omit_query_param = "omit"
+
+    def __init__(self, *args, **kwargs):
+        """Drop the fields that are not requested."""
+        super().__init__(*args, **kwargs)
+        request = self._context.get("request", None)
+        if not request or request.method not in SAFE_METHODS:
+            return
+        selected = self._get_field_names(request, self.fields_query_param)
+        omitted = self._get_field_names(request, self.omit_query_param)
+        for field_name in list(self.fields):
+            if selected and field_name not in selected:
+                self.fields.pop(field_name)
+            elif field_name in omitted:
+                self.fields.pop(field_name)
+
+    @staticmethod
+    def _get_field_names(request, param):
+        """Field names in the comma separated query param."""
+        value = request.query_params.get(param, "")
+        return {name.strip() for name in value.split(",") if name.strip()}
+
+    def get_only_fields(self):
+        """
+        Function to get the model fields used by the readable fields.
+
+        Concrete fields are used by their name and idencode by the primary
+        key, reverse relations are loaded separately and need no column.
+        Returns:
+            (list): field names for queryset.only(), None when a field
+                reads something that cannot be resolved to columns, like
+                a method field or a nested source.
+        """
+        opts = self.Meta.model._meta
+        only = [opts.pk.name]
+        for field in self.fields.values():
+            if field.write_only:
+                continue
+            if field.source == "*" or len(field.source_attrs) != 1:
+                return None
+            source = field.source_attrs[0]
+            if source == "idencode":
+                continue
+            try:
+                model_field = opts.get_field(source)
+            except FieldDoesNotExist:
+                return None
+            if model_field.concrete and not model_field.many_to_many:
+                only.append(model_field.name)
+        return only
+
+
+class IncludeFieldsMixin:
+    """
+    Adds support for embedding related objects to Serializers.
+
+    The relations that can be embedded are declared on the serializer's
+    Meta as `include_fields`, with the serializer of the related object,
+    or its name in the module of the serializer, and if it is a to-many
+    relation:
+    ```
+    class Meta:
+        model = SomeModel
+        fields = ('idencode', 'collection')
+        include_fields = {
+            'collection': ('CollectionSerializer', False),
+            'items': ('ItemSerializer', True),
+        }
+    ```
+
+    On read requests, `?include=collection,items.product` replaces the
+    fields by the serializers of the related objects, the dotted paths
+    are embedded by the included serializers. The queryset is planned for
+    the included paths with plan_queryset().
+    """
+
+    include_query_param = "include"
+
+    def __init__(self, *args, include=None, **kwargs):
+        """Replace the included fields by their serializers."""
+        super().__init__(*args, **kwargs)
+        if include is None:
+            include = self._get_include_tree()
+        self.include = include
+        for field_name, nested in include.items():
+            serializer_class, many = self.get_include_field(field_name)
+            nested_kwargs = {"include": nested} if nested else {}
+            self.fields[field_name] = serializer_class(
+                many=many, read_only=True, **nested_kwargs)
+
+    def _get_include_tree(self):
+        """Nested dict of the dotted paths in the include query param."""
+        request = self._context.get("request", None)
+        if not request or request.method not in SAFE_METHODS:
+            return {}
+        tree = {}
+        value = request.query_params.get(self.include_query_param, "")
+        for path in value.split(","):
+            node = tree
+            for field_name in path.strip().split("."):
+                if field_name:
+                    node = node.setdefault(field_name, {})
+        return tree
+
+    @classmethod
+    def get_include_field(cls, field_name):
+        """
+        Function to get the serializer of an included field.
+
+        Input Params:
+            field_name(str): name of the field in include_fields.
+        Returns:
+            (tuple): serializer class and if the relation is to-many.
+        """
+        include_fields = getattr(cls.Meta, "include_fields", {})
+        if field_name not in include_fields:
+            raise BadRequest("'%s' can not be included." % field_name)
+        serializer_class, many = include_fields[field_name]
+        if isinstance(serializer_class, str):
+            serializer_class = getattr(
+                sys.modules[cls.__module__], serializer_class)
+        return serializer_class, many
+
+    @classmethod
+    def get_include_plan(cls, include, prefix=""):
+        """
+        Function to get the related lookups of the included paths.
+
+        To-one relations are joined, as long as they are reached through
+        to-one relations. To-many relations are prefetched with a
+        queryset planned for their own included paths, so the number of
+        queries depends only on the number of to-many paths.
+
+        Input Params:
+            include(dict): nested dict of the included paths.
+            prefix(str): lookup of the serializer from the planned model.
+        Returns:
+            (tuple): select_related lookups and Prefetch objects.
+        """
+        opts = cls.Meta.model._meta
+        select_related = []
+        prefetch = []
+        for field_name, nested in include.items():
+            serializer_class, many = cls.get_include_field(field_name)
+            lookup = prefix + field_name
+            if many:
+                queryset = serializer_class.Meta.model.objects.all()
+                if nested:
+                    queryset = serializer_class.plan_queryset(
+                        queryset, nested)
+                prefetch.append(Prefetch(lookup, queryset=queryset))
+                continue
+            if not opts.get_field(field_name).is_relation:
+                continue
+            select_related.append(lookup)
+            if nested:
+                nested_select, nested_prefetch = (
+                    serializer_class.get_include_plan(nested, lookup + "__"))
+                select_related += nested_select
+                prefetch += nested_prefetch
+        return select_related, prefetch
+
+    @classmethod
+    def plan_queryset(cls, queryset, include):
+        """
+        Function to load the included objects along with the queryset.
+
+        Input Params:
+            queryset(obj): queryset of the model of the serializer.
+            include(dict): nested dict of the included paths.
+        Returns:
+            (obj): queryset with the related lookups.
+        """
+        select_related, prefetch = cls.get_include_plan(include)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
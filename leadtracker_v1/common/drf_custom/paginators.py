@@ -3,3 +3,56 @@ from rest_framework import pagination
 
 class LargePaginator(pagination.PageNumberPagination):
     page_size = 999
+
+
+class CreatedOnCursorPagination(pagination.CursorPagination):
+    """
+    Cursor pagination on the default ordering of AbstractBaseModel.
+
+    The cursor position is the created_on of the last row, pages are
+    filtered on it and read from the (-created_on, -id) index of the
+    paginated models, with no count. DRF positions on the first ordering
+    field only: id just orders the rows of a created_on, and the rows of
+    the position already returned are skipped by an offset kept in the
+    cursor. Pages cost the same whatever their depth, unless many rows
+    share a created_on.
+    """
+
+    ordering = ("-created_on", "-id")
+    page_size_query_param = "limit"
+    max_page_size = 100
+
+
+class OptionalCursorPagination(pagination.LimitOffsetPagination):
+    """
+    Limit/offset pagination with opt-in cursor pagination.
+
+    Requests with a `cursor`, or with `pagination=cursor` for the first
+    page, are paginated by CreatedOnCursorPagination and get opaque
+    next/previous cursors instead of the count. The cursor pages always
+    follow the created_on ordering.
+    """
+
+    cursor_query_param = "cursor"
+    cursor_paginator_class = CreatedOnCursorPagination
+
+    def use_cursor(self, request):
+        """Function to check if the request asks for cursor pagination."""
+        return (
+            self.cursor_query_param in request.query_params
+            or request.query_params.get("pagination") == "cursor")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Paginate by cursor or by limit/offset as requested."""
+        self.cursor_paginator = None
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_paginator_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        """Response of the paginator used for the page."""
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,74 @@
+"""
+Streaming readers of Excel workbooks.
+
+Workbooks are opened in the read-only mode of openpyxl, the rows are
+parsed from the sheet as they are iterated instead of loading all the
+cells, so the memory used does not depend on the number of rows.
+"""
+
+from openpyxl import load_workbook
+
+
+def get_header_name(value):
+    """Function to normalize a header cell into a field name."""
+    if value is None:
+        return ""
+    return "_".join(str(value).strip().lower().split())
+
+
+def read_header(file, header_row=1):
+    """
+    Function to read the header of the first sheet of a workbook.
+
+    Input Params:
+        file(obj): path or file object of the workbook.
+        header_row(int): number of the header row.
+    Returns:
+        (list): normalized names of the columns.
+    """
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        for row in sheet.iter_rows(
+                min_row=header_row, max_row=header_row, values_only=True):
+            return [get_header_name(value) for value in row]
+        return []
+    finally:
+        workbook.close()
+
+
+def iter_row_chunks(file, chunk_size, header_row=1):
+    """
+    Function to stream the rows of the first sheet of a workbook.
+
+    The rows are returned as dicts by the normalized header, without the
+    empty cells, and the empty rows are skipped.
+
+    Input Params:
+        file(obj): path or file object of the workbook.
+        chunk_size(int): number of rows of the chunks.
+        header_row(int): number of the header row.
+    Returns:
+        (generator): lists of the row numbers and rows, of chunk_size rows
+            at most.
+    """
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows = sheet.iter_rows(min_row=header_row, values_only=True)
+        header = [get_header_name(value) for value in next(rows, ())]
+        chunk = []
+        for number, values in enumerate(rows, start=header_row + 1):
+            row = {
+                name: value for name, value in zip(header, values)
+                if name and value is not None and value != ""}
+            if not row:
+                continue
+            chunk.append((number, row))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        workbook.close()
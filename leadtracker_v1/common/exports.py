@@ -0,0 +1,109 @@
+"""
+Streaming exports of tabular rows as CSV or Excel files.
+
+The rows are consumed as they are written, so they can be read from a
+server side cursor without holding them all in memory.
+"""
+
+import csv
+import datetime
+import tempfile
+
+from openpyxl import Workbook
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+
+EXPORT_TYPES = {
+    "csv": "text/csv",
+    "xlsx": (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+# Bytes of the file sent at once.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class Echo:
+    """File-like object returning what is written, for csv.writer."""
+
+    def write(self, value):
+        """Return the value instead of buffering it."""
+        return value
+
+
+def stream_csv(header, rows):
+    """
+    Function to stream rows as CSV lines, each row is sent as it is read.
+
+    Input Params:
+        header(list): names of the columns.
+        rows(iterable): lists of the values of the rows.
+    Returns:
+        (generator): lines of the CSV file.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def get_xlsx_value(value):
+    """Function to convert a value to one supported by openpyxl."""
+    if isinstance(value, datetime.datetime) and timezone.is_aware(value):
+        return timezone.make_naive(value, datetime.timezone.utc)
+    return value
+
+
+def stream_xlsx(header, rows, title="Sheet"):
+    """
+    Function to stream rows as an Excel workbook.
+
+    The rows are written to a write-only workbook, which keeps them in a
+    temporary file instead of in memory. A workbook is a zip archive, so
+    it is sent once all the rows are written.
+
+    Input Params:
+        header(list): names of the columns.
+        rows(iterable): lists of the values of the rows.
+        title(str): title of the sheet.
+    Returns:
+        (generator): chunks of the workbook file.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.append(header)
+    for row in rows:
+        sheet.append([get_xlsx_value(value) for value in row])
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        file.seek(0)
+        while True:
+            data = file.read(STREAM_CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
+
+def get_export_response(file_type, filename, header, rows):
+    """
+    Function to get the streaming response of an export.
+
+    Input Params:
+        file_type(str): csv or xlsx.
+        filename(str): name of the file, without extension.
+        header(list): names of the columns.
+        rows(iterable): lists of the values of the rows.
+    Returns:
+        (obj): StreamingHttpResponse sending the file as an attachment.
+    """
+    if file_type == "xlsx":
+        content = stream_xlsx(header, rows, filename)
+    else:
+        content = stream_csv(header, rows)
+    response = StreamingHttpResponse(
+        content, content_type=EXPORT_TYPES[file_type])
+    response["Content-Disposition"] = 'attachment; filename="%s.%s"' % (
+        filename, file_type)
+    return response
@@ -0,0 +1,119 @@
+"""
+Background jobs with results stored in the cache.
+
+A job is identified by its namespace, params and the cache generation of
+the namespace, so identical requests share the same job until the data
+they are computed from changes.
+"""
+
+import time
+
+from sentry_sdk import capture_exception
+
+from django.core.cache import cache
+
+from common import cache as cache_lib
+
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# Seconds a job and its result are kept.
+JOB_TTL = 60 * 60
+# Seconds after which a running job is taken for dead, like when its
+# worker crashed, and is started again by an identical request.
+JOB_RUNNING_TIMEOUT = 30 * 60
+
+
+def get_job_key(job_id):
+    """Function to get the cache key of a job."""
+    return "job:%s" % job_id
+
+
+def get_job(job_id):
+    """
+    Function to get a job.
+
+    Input Params:
+        job_id(str): id of the job.
+    Returns:
+        (dict): job with id, status, result, error and start time, None
+            if expired.
+    """
+    return cache.get(get_job_key(job_id))
+
+
+def set_job(job_id, status, result=None, error=None, started_on=None):
+    """
+    Function to store the status of a job.
+
+    The start time of a running job is kept by its progress updates.
+    """
+    if status == JOB_RUNNING and started_on is None:
+        job = get_job(job_id) or {}
+        started_on = job.get("started_on")
+    cache.set(get_job_key(job_id), {
+        "id": job_id,
+        "status": status,
+        "result": result,
+        "error": error,
+        "started_on": started_on,
+    }, timeout=JOB_TTL)
+
+
+def is_dead(job):
+    """Function to check if a job is running for too long to be alive."""
+    return (
+        job["status"] == JOB_RUNNING
+        and time.time() - (job.get("started_on") or 0) > JOB_RUNNING_TIMEOUT)
+
+
+def start_job(namespace, params, task):
+    """
+    Function to start a job, unless an identical one exists.
+
+    A failed job, or one running for more than JOB_RUNNING_TIMEOUT, is
+    started again.
+
+    Input Params:
+        namespace(str): namespace of the job, also its cache namespace.
+        params(dict): JSON serializable params of the job.
+        task(obj): celery task called with the job id and params.
+    Returns:
+        (dict): the new or existing job.
+    """
+    key_params = {
+        "params": params, "generation": cache_lib.get_generation(namespace)}
+    job_id = cache_lib.get_cache_key(namespace, key_params).replace(":", "-")
+    job = {
+        "id": job_id, "status": JOB_PENDING, "result": None, "error": None,
+        "started_on": None}
+    if not cache.add(get_job_key(job_id), job, timeout=JOB_TTL):
+        existing = get_job(job_id)
+        if (existing and existing["status"] != JOB_FAILED
+                and not is_dead(existing)):
+            return existing
+        set_job(job_id, JOB_PENDING)
+    task.delay(job_id, params)
+    return job
+
+
+def run_job(job_id, compute):
+    """
+    Function to run a job and store its result.
+
+    Input Params:
+        job_id(str): id of the job.
+        compute(callable): function without arguments returning the result.
+    """
+    set_job(job_id, JOB_RUNNING, started_on=time.time())
+    try:
+        result = compute()
+    except Exception as e:
+        capture_exception(e)
+        set_job(job_id, JOB_FAILED, error=str(e))
+        raise
+    set_job(job_id, JOB_DONE, result=result)
+    return result
@@ -1,7 +1,26 @@
 """ Comming Base Views"""
 
+import json
+import hashlib
+
+from django.db import transaction
+from django.db.models import Max
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.cache import get_conditional_response
+
+from rest_framework import status
 from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.decorators import action
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.validators import UniqueValidator
+from rest_framework.exceptions import ValidationError
+from common import exports
 from common.exceptions import BadRequest
+from common.library import decode
+from common.drf_custom.fields import IdencodeField
 
 
 class MultiPermissionView(APIView):
@@ -18,3 +37,452 @@ class MultiPermissionView(APIView):
         except KeyError:
             raise BadRequest("Method not allowed")
         return super(MultiPermissionView, self).get_permissions()
+
+
+class SparseQuerysetMixin:
+    """
+    Prunes the queryset of read requests to the serialized fields.
+
+    To be used with serializers having the SparseFieldsMixin. The columns
+    used by the ordering are kept, so that paginators and ordering do not
+    load the deferred fields of each row.
+    """
+
+    def get_queryset(self):
+        """Function to load only the fields the serializer reads."""
+        queryset = super().get_queryset()
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        get_only_fields = getattr(
+            self.get_serializer(), "get_only_fields", None)
+        only = get_only_fields() if get_only_fields else None
+        if not only:
+            return queryset
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        for field_name in ordering:
+            if isinstance(field_name, str) and "__" not in field_name:
+                only.append(field_name.lstrip("-"))
+        return queryset.only(*only)
+
+
+class IncludeQuerysetMixin:
+    """
+    Plans the queryset of read requests for the included relations.
+
+    To be used with serializers having the IncludeFieldsMixin, the
+    included objects are joined or prefetched instead of being loaded for
+    each row.
+    """
+
+    def get_queryset(self):
+        """Function to load the included objects with the queryset."""
+        queryset = super().get_queryset()
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        serializer = self.get_serializer()
+        include = getattr(serializer, "include", None)
+        if not include:
+            return queryset
+        return serializer.plan_queryset(queryset, include)
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag and Last-Modified validators to the list and retrieve of a
+    viewset, from the updated_on of the objects.
+
+    The validators are computed with one aggregate query before the
+    objects are loaded, and requests with a matching If-None-Match or
+    If-Modified-Since are answered with 304 without serializing. The
+    number of objects is part of the ETag so that deletes change it, and
+    the query params so that each filter, page and field set has its own.
+
+    Included related objects are not covered by the updated_on of the
+    objects, so requests with ?include= are not conditional, nor are the
+    views with no conditional_field. retrieve looks the object up by its
+    encoded id.
+    """
+
+    conditional_field = "updated_on"
+
+    def get_validators(self, queryset):
+        """
+        Function to get the validators of the objects of a queryset.
+
+        Input Params:
+            queryset(obj): objects of the response.
+        Returns:
+            (tuple): ETag, last modified unix time or None if there are no
+                objects, and number of objects.
+        """
+        data = queryset.order_by().values(self.conditional_field).aggregate(
+            last_modified=Max(self.conditional_field), count=Count("pk"))
+        last_modified = data["last_modified"]
+        digest = hashlib.md5(json.dumps([
+            last_modified.isoformat() if last_modified else None,
+            data["count"], self.request.get_full_path(),
+        ]).encode()).hexdigest()
+        if last_modified:
+            last_modified = int(last_modified.timestamp())
+        return 'W/"%s"' % digest, last_modified, data["count"]
+
+    def get_conditional_response(self, queryset):
+        """
+        Function to answer a conditional request before serializing.
+
+        Input Params:
+            queryset(obj): objects of the response.
+        Returns:
+            (obj): 304 response if the client has the objects, else None.
+        """
+        self.validators = {}
+        if not self.conditional_field:
+            return None
+        if self.request.method not in ("GET", "HEAD"):
+            return None
+        if self.request.query_params.get("include"):
+            return None
+        etag, last_modified, count = self.get_validators(queryset)
+        if getattr(self, "action", None) == "retrieve" and not count:
+            return None
+        self.validators["ETag"] = etag
+        if last_modified:
+            self.validators["Last-Modified"] = http_date(last_modified)
+        return get_conditional_response(
+            self.request, etag=etag, last_modified=last_modified)
+
+    def list(self, request, *args, **kwargs):
+        """List the objects, unless the client has them already."""
+        response = self.get_conditional_response(
+            self.filter_queryset(self.get_queryset()))
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        return self.set_validators(response)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Return the object, unless the client has it already."""
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        response = self.get_conditional_response(
+            self.get_queryset().filter(
+                pk=decode(self.kwargs[lookup_url_kwarg])))
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        return self.set_validators(response)
+
+    def set_validators(self, response):
+        """Function to add the validators to a successful response."""
+        if response.status_code in (
+                status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            for header, value in self.validators.items():
+                response[header] = value
+        return response
+
+
+class ExportMixin:
+    """
+    Adds a streaming CSV or Excel export of the list of a viewset.
+
+    The columns are declared as export_columns, with the header, the
+    lookup of the value in the queryset and an optional function
+    formatting the value:
+    ```
+    export_columns = (
+        ("id", "id", encode),
+        ("name", "name", None),
+        ("organization", "organization__name", None),
+    )
+    ```
+    export/?type=csv|xlsx accepts the filters of the list. The values are
+    read with a server side cursor, export_chunk_size rows at a time,
+    without creating the objects, so the memory used does not depend on
+    the number of rows and the first CSV lines are sent immediately.
+    """
+
+    export_columns = ()
+    export_chunk_size = 2000
+    export_filename = "export"
+
+    def get_export_queryset(self):
+        """Function to get the queryset to export, filtered as the list."""
+        return self.filter_queryset(self.get_queryset())
+
+    def get_export_rows(self, queryset):
+        """
+        Function to read the formatted rows of the export.
+
+        Input Params:
+            queryset(obj): queryset from get_export_queryset.
+        Returns:
+            (generator): lists of the values of the columns.
+        """
+        lookups = [lookup for _, lookup, _ in self.export_columns]
+        formatters = [formatter for _, _, formatter in self.export_columns]
+        rows = queryset.values_list(*lookups).iterator(
+            chunk_size=self.export_chunk_size)
+        for row in rows:
+            yield [
+                formatter(value) if formatter and value is not None
+                else value
+                for formatter, value in zip(formatters, row)]
+
+    @action(detail=False, methods=["get"], url_path="export")
+    def export(self, request, *args, **kwargs):
+        """Stream the filtered list as a file."""
+        file_type = request.query_params.get("type", "csv")
+        if file_type not in exports.EXPORT_TYPES:
+            raise BadRequest(
+                "type should be one of %s." % ", ".join(exports.EXPORT_TYPES))
+        header = [header for header, _, _ in self.export_columns]
+        rows = self.get_export_rows(self.get_export_queryset())
+        return exports.get_export_response(
+            file_type, self.export_filename, header, rows)
+
+
+class BulkModelMixin:
+    """
+    Adds bulk create, update and delete to a model viewset.
+
+    The rows are sent as a list to the bulk/ route of the viewset,
+        POST: rows to create, in the format of the serializer.
+        PATCH: rows to update, with the encoded id of the object as id.
+        DELETE: encoded ids of the objects to delete.
+    All the rows are validated before anything is written. The encoded
+    ids in the rows and the unique fields are checked with one query per
+    field, and the rows are written with bulk_create/bulk_update in a
+    single transaction. If any row is invalid, nothing is written and the
+    errors are returned as a list in the order of the rows.
+
+    bulk_create and bulk_update do not call save() nor send the model
+    signals, viewsets of models maintaining other data on save should
+    override the perform_bulk_* methods to maintain it.
+    """
+
+    bulk_max_rows = 10000
+    bulk_batch_size = 1000
+
+    @action(detail=False, methods=["post", "patch", "delete"], url_path="bulk")
+    def bulk(self, request, *args, **kwargs):
+        """Create, update or delete the rows in the request."""
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            raise BadRequest("A list of rows is required.")
+        if len(rows) > self.bulk_max_rows:
+            raise BadRequest(
+                "Maximum %d rows are allowed." % self.bulk_max_rows)
+        if request.method == "POST":
+            return self.bulk_create(rows)
+        if request.method == "PATCH":
+            return self.bulk_update(rows)
+        return self.bulk_destroy(rows)
+
+    def get_bulk_serializer(self, **kwargs):
+        """
+        Function to get the serializer to validate single rows.
+
+        The unique validators of the fields are removed, they are checked
+        for all the rows at once by validate_bulk_unique().
+        Returns:
+            (tuple): serializer and the removed unique validators by field.
+        """
+        serializer = self.get_serializer(**kwargs)
+        unique_fields = []
+        for field in serializer.fields.values():
+            validators = [
+                validator for validator in field.validators
+                if isinstance(validator, UniqueValidator)]
+            if validators:
+                field.validators = [
+                    validator for validator in field.validators
+                    if validator not in validators]
+                unique_fields.append((field, validators[0]))
+        return serializer, unique_fields
+
+    @staticmethod
+    def get_bulk_ids(values):
+        """Function to get the ids of encoded or plain ids, by value."""
+        ids = {}
+        for value in values:
+            if not isinstance(value, (str, int)) or value in ids:
+                continue
+            try:
+                ids[value] = int(value)
+            except ValueError:
+                ids[value] = decode(value)
+        return ids
+
+    def resolve_bulk_idencodes(self, serializer, rows):
+        """
+        Function to replace the encoded ids in the rows by the objects.
+
+        The objects of each related model are loaded with one query, the
+        IdencodeField accepts them as they are. The ids that are not
+        found are left in the rows, to be reported by the field.
+        """
+        for field_name, field in serializer.fields.items():
+            if (field.read_only or not isinstance(field, IdencodeField)
+                    or not field.related_model):
+                continue
+            ids = self.get_bulk_ids(
+                row[field_name] for row in rows
+                if isinstance(row, dict) and row.get(field_name))
+            objects = field.related_model.objects.in_bulk(
+                [pk for pk in ids.values() if pk])
+            for row in rows:
+                if not isinstance(row, dict):
+                    continue
+                value = row.get(field_name)
+                if isinstance(value, (str, int)) and ids.get(value) in objects:
+                    row[field_name] = objects[ids[value]]
+
+    def validate_bulk_rows(self, serializer, rows, instances=None):
+        """
+        Function to validate the rows with the serializer.
+
+        Input Params:
+            serializer(obj): serializer from get_bulk_serializer.
+            rows(list): rows from the request.
+            instances(list): objects updated by the rows, for updates.
+        Returns:
+            (tuple): validated data and errors, in the order of the rows.
+        """
+        validated = []
+        errors = []
+        for index, row in enumerate(rows):
+            serializer.instance = instances[index] if instances else None
+            try:
+                validated.append(serializer.run_validation(row))
+                errors.append({})
+            except ValidationError as e:
+                validated.append(None)
+                errors.append(e.detail)
+        serializer.instance = None
+        return validated, errors
+
+    def validate_bulk_unique(self, unique_fields, validated, errors,
+                             instances=None):
+        """
+        Function to check the unique fields of all the rows at once.
+
+        A value is invalid if it is repeated in the rows, or if it
+        belongs to an existing object other than the one updated by the
+        row.
+        """
+        model = self.get_queryset().model
+        for field, validator in unique_fields:
+            rows = {}
+            for index, data in enumerate(validated):
+                if data is None or field.source not in data:
+                    continue
+                value = data[field.source]
+                if value in rows:
+                    errors[index][field.field_name] = [validator.message]
+                    continue
+                rows[value] = index
+            existing = model._default_manager.filter(
+                **{field.source + "__in": list(rows)}
+            ).values_list(field.source, "pk")
+            for value, pk in existing:
+                index = rows[value]
+                if instances and instances[index].pk == pk:
+                    continue
+                errors[index][field.field_name] = [validator.message]
+
+    def get_bulk_user(self):
+        """Function to get the user to set as creator and updater."""
+        user = self.request.user
+        return user if user and user.is_authenticated else None
+
+    def get_bulk_response(self, objects, status_code=status.HTTP_200_OK):
+        """Response with the written objects, in the order of the rows."""
+        serializer = self.get_serializer(objects, many=True)
+        return Response(serializer.data, status=status_code)
+
+    def bulk_create(self, rows):
+        """Function to validate and create the rows."""
+        rows = [dict(row) if isinstance(row, dict) else row for row in rows]
+        serializer, unique_fields = self.get_bulk_serializer()
+        self.resolve_bulk_idencodes(serializer, rows)
+        validated, errors = self.validate_bulk_rows(serializer, rows)
+        self.validate_bulk_unique(unique_fields, validated, errors)
+        if any(errors):
+            raise ValidationError(errors)
+
+        model = self.get_queryset().model
+        user = self.get_bulk_user()
+        objects = [
+            model(**data, creator=user, updater=user) for data in validated]
+        with transaction.atomic():
+            self.perform_bulk_create(objects)
+        return self.get_bulk_response(objects, status.HTTP_201_CREATED)
+
+    def bulk_update(self, rows):
+        """Function to validate and update the rows."""
+        rows = [dict(row) if isinstance(row, dict) else row for row in rows]
+        ids = self.get_bulk_ids(
+            row.get("id") for row in rows if isinstance(row, dict))
+        objects = self.get_queryset().in_bulk(
+            [pk for pk in ids.values() if pk])
+        instances = []
+        id_errors = []
+        for row in rows:
+            value = row.get("id") if isinstance(row, dict) else None
+            instance = None
+            if isinstance(value, (str, int)):
+                instance = objects.get(ids.get(value))
+            instances.append(instance)
+            id_errors.append(
+                {} if instance else {"id": ["Invalid id/pk format"]})
+        if any(id_errors):
+            raise ValidationError(id_errors)
+
+        serializer, unique_fields = self.get_bulk_serializer(partial=True)
+        self.resolve_bulk_idencodes(serializer, rows)
+        validated, errors = self.validate_bulk_rows(
+            serializer, rows, instances)
+        self.validate_bulk_unique(
+            unique_fields, validated, errors, instances)
+        if any(errors):
+            raise ValidationError(errors)
+
+        now = timezone.now()
+        user = self.get_bulk_user()
+        fields = {"updater", "updated_on"}
+        for instance, data in zip(instances, validated):
+            for attr, value in data.items():
+                setattr(instance, attr, value)
+            instance.updater = user
+            instance.updated_on = now
+            fields.update(data)
+        with transaction.atomic():
+            self.perform_bulk_update(list(objects.values()), list(fields))
+        return self.get_bulk_response(instances)
+
+    def bulk_destroy(self, rows):
+        """Function to delete the objects of the encoded ids."""
+        ids = self.get_bulk_ids(rows)
+        queryset = self.get_queryset().filter(
+            pk__in=[pk for pk in ids.values() if pk])
+        existing = set(queryset.values_list("pk", flat=True))
+        errors = [
+            {} if isinstance(row, (str, int)) and ids.get(row) in existing
+            else {"id": ["Invalid pk - object does not exist."]}
+            for row in rows]
+        if any(errors):
+            raise ValidationError(errors)
+        with transaction.atomic():
+            self.perform_bulk_destroy(queryset)
+        return Response(rows)
+
+    def perform_bulk_create(self, objects):
+        """Function to insert the objects."""
+        self.get_queryset().model.objects.bulk_create(
+            objects, batch_size=self.bulk_batch_size)
+
+    def perform_bulk_update(self, objects, fields):
+        """Function to update the fields of the objects."""
+        self.get_queryset().model.objects.bulk_update(
+            objects, fields, batch_size=self.bulk_batch_size)
+
+    def perform_bulk_destroy(self, queryset):
+        """Function to delete the objects of the queryset."""
+        queryset.delete()
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     # Requirements
     "rest_framework",
     "corsheaders",
@@ -168,6 +169,42 @@ DATABASES = {
 #     }
 # }
 
+# Cache, redis is used when configured, else the local memory cache is
+# used (e.g. while running tests).
+REDIS_CACHE_URL = config.get("cache", "REDIS_URL", fallback="")
+if REDIS_CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_CACHE_URL,
+            "OPTIONS": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            },
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "leadtracker_v1",
+        }
+    }
+
+# Celery beat
+CELERY_BEAT_SCHEDULE = {
+    "refresh-lead-rollups": {
+        "task": "refresh_lead_rollups",
+        "schedule": 15 * 60,
+    },
+    "write-snapshot": {
+        "task": "write_snapshot",
+        "schedule": 24 * 60 * 60,
+    },
+}
+
+# Folder of the columnar snapshots for analytics.
+SNAPSHOT_ROOT = os.path.join(BASE_DIR, "snapshots")
+
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
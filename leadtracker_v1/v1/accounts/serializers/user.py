@@ -8,6 +8,7 @@ from common.exceptions import AccessForbidden
 
 from common.drf_custom import fields as custom_fields
 from common.drf_custom.mixins import WriteOnceMixin
+from common.drf_custom.mixins import SparseFieldsMixin
 
 from common.library import validate_password, decode
 from common.library import pop_out_from_dictionary
@@ -21,7 +22,8 @@ from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 
-class UserSerializer(WriteOnceMixin, serializers.ModelSerializer):
+class UserSerializer(
+        SparseFieldsMixin, WriteOnceMixin, serializers.ModelSerializer):
     """Serializer for user."""
 
     id = custom_fields.IdencodeField(read_only=True)
@@ -120,7 +122,7 @@ class UserSerializer(WriteOnceMixin, serializers.ModelSerializer):
         return user
 
 
-class UserListSerializer(serializers.ModelSerializer):
+class UserListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for user."""
 
     # TODO: combine to user details serializer using min mode
@@ -135,7 +137,7 @@ class UserListSerializer(serializers.ModelSerializer):
         """Meta info."""
 
         model = ProjectUser
-        fields = ["id", "first_name", "email"]
+        fields = ["id", "first_name", "last_name", "email", "phone", "image"]
 
 
 class UserDeviceSerializer(WriteOnceMixin, serializers.ModelSerializer):
@@ -7,6 +7,7 @@ from rest_framework import generics
 
 from common.exceptions import BadRequest
 from common.views import MultiPermissionView
+from common.views import SparseQuerysetMixin
 
 from v1.accounts import permissions as user_permissions
 
@@ -20,6 +21,7 @@ from v1.accounts.serializers import user as user_serializers
 
 # accounts/user/<id:optional>/
 class UserDetails(
+    SparseQuerysetMixin,
     generics.RetrieveUpdateAPIView, 
     generics.ListAPIView, 
     MultiPermissionView
@@ -40,7 +42,7 @@ class UserDetails(
     queryset = ProjectUser.objects.all()
 
 
-class UserList(generics.ListAPIView):
+class UserList(SparseQuerysetMixin, generics.ListAPIView):
     """List users"""
 
     # TODO: change url
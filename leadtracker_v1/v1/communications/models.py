@@ -65,6 +65,12 @@ class Notification(AbstractBaseModel):
         """Meta class for the above model."""
 
         ordering = ("-created_on",)
+        indexes = [
+            models.Index(
+                fields=["user", "-created_on", "-id"],
+                name="notification_user_created_idx",
+            ),
+        ]
 
     def __str__(self):
         """Function to return value in django admin."""
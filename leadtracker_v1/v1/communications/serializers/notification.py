@@ -4,14 +4,15 @@
 from rest_framework import serializers
 
 from common.drf_custom import fields as custom_fields
+from common.drf_custom.mixins import SparseFieldsMixin
 
 from v1.communications.models import Notification
 
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer to manage notification."""
 
-    id = serializers.SerializerMethodField()
+    id = custom_fields.IdencodeField(read_only=True)
 
     class Meta:
         """Meta info."""
@@ -27,7 +28,3 @@ class NotificationSerializer(serializers.ModelSerializer):
             "action_url": {"write_only": True},
             "user": {"write_only": True},
         }
-
-    def get_id(self, obj):
-        """Get encoded  id."""
-        return obj.idencode
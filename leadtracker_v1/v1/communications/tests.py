@@ -1,3 +1,39 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-# Create your tests here.
+from rest_framework.test import APIClient
+
+from v1.accounts import models as user_models
+from v1.communications.models import Notification
+
+
+class NotificationListTest(TestCase):
+    """Tests of the notification list."""
+
+    def setUp(self):
+        self.user = user_models.ProjectUser.objects.create(
+            username="notified@example.com", email="notified@example.com",
+            email_verified=True)
+        token = user_models.AccessToken.objects.create(user=self.user)
+        Notification.objects.create(
+            user=self.user, title_en="Lead won", body_en="Acme was won.")
+        self.client = APIClient(
+            HTTP_BEARER=token.key, HTTP_USER_ID=self.user.idencode)
+
+    def test_sparse_fields_defer_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                "/v1/communications/notifications/", {"fields": "title_en"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [row["title_en"] for row in response.data["results"]],
+            ["Lead won"])
+        select = [
+            query["sql"] for query in queries.captured_queries
+            if 'FROM "communications_notification"' in query["sql"]
+            and "COUNT(" not in query["sql"]]
+        self.assertEqual(len(select), 1)
+        self.assertIn('"title_en"', select[0])
+        self.assertNotIn('"body_en"', select[0])
+        self.assertNotIn('"context"', select[0])
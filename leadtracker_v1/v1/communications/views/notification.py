@@ -10,6 +10,8 @@ from common.library import decode_list
 from common.library import success_response
 
 from common.exceptions import BadRequest
+from common.drf_custom.paginators import OptionalCursorPagination
+from common.views import SparseQuerysetMixin
 
 from v1.accounts import permissions as user_permissions
 
@@ -21,17 +23,19 @@ from v1.communications.filters import NotificationFilter
 
 
 # /communications/notifications/
-class NotificationList(generics.ListAPIView):
+class NotificationList(SparseQuerysetMixin, generics.ListAPIView):
     """View to list notification list."""
 
     http_method_names = ["get"]
     serializer_class = NotificationSerializer
     permission_classes = (user_permissions.IsAuthenticatedWithVerifiedEmail,)
     filterset_class = NotificationFilter
+    pagination_class = OptionalCursorPagination
+    queryset = Notification.objects.all()
 
     def get_queryset(self):
         """Function to override get query set."""
-        queryset = Notification.objects.filter(
+        queryset = super().get_queryset().filter(
             user=self.kwargs["user"], visibility=True
         )
         return queryset
@@ -1,6 +1,9 @@
 from django.contrib import admin
+from django.db import transaction
 from common.admin import BaseAdmin
 from v1.leadtracker import models as lead_models
+from v1.leadtracker import tasks as lead_tasks
+from v1.leadtracker import search as lead_search
 
 # Register your models here.
 """leadtracker model registerd to admin panel"""
@@ -21,6 +24,12 @@ class LeadAdmin(BaseAdmin):
         )
     search_fields = ["name"]
 
+    def get_search_results(self, request, queryset, search_term):
+        """Search with the full text search of the leads."""
+        if not search_term:
+            return queryset, False
+        return lead_search.search_leads(search_term, queryset), False
+
 
 class OrganizationAdmin(BaseAdmin):
     list_display = ("name", "email", "website", "country", )
@@ -36,11 +45,25 @@ class QuestionAdmin(BaseAdmin):
     list_display = ("question", "type", "weightage", "credit", )
     search_fields = ["question"]
 
+    def save_model(self, request, obj, form, change):
+        """Rescore the answers of the question when its credit changes."""
+        super().save_model(request, obj, form, change)
+        if change and "credit" in form.changed_data:
+            transaction.on_commit(lambda: lead_tasks.rescore_answers.delay(
+                question_ids=[obj.id]))
+
 
 class OptionAdmin(BaseAdmin):
     list_display = ("id", "question_id", "option", "points", "is_active", )
     search_fields = ["option"]
 
+    def save_model(self, request, obj, form, change):
+        """Rescore the answers of the option when its points change."""
+        super().save_model(request, obj, form, change)
+        if change and "points" in form.changed_data:
+            transaction.on_commit(lambda: lead_tasks.rescore_answers.delay(
+                option_ids=[obj.id]))
+
 
 class ContactAdmin(BaseAdmin):
     list_display = (
@@ -79,6 +102,30 @@ class LeadContactAdmin(BaseAdmin):
     search_fields = ["lead_id"]
 
 
+class DashboardCounterAdmin(BaseAdmin):
+    list_display = (
+        "preset_id", "lead_source", "status", "current_stage",
+        "leads", "answers", "points_secured",
+    )
+    list_filter = ("status", "lead_source", )
+
+
+class LeadStageTransitionAdmin(BaseAdmin):
+    list_display = (
+        "lead_id", "from_stage", "to_stage",
+        "from_status", "to_status", "changed_on",
+    )
+    search_fields = ["lead_id__name"]
+
+
+class LeadDailyRollupAdmin(BaseAdmin):
+    list_display = (
+        "day", "event", "lead_source", "preset_id", "stage",
+        "status", "leads", "revenue",
+    )
+    list_filter = ("event", "status", )
+
+
 admin.site.register(lead_models.Tag, TagAdmin)
 admin.site.register(lead_models.StagePreset, StagePresetAdmin)
 admin.site.register(lead_models.Lead, LeadAdmin)
@@ -91,3 +138,7 @@ admin.site.register(lead_models.LeadTag, LeadTagAdmin)
 admin.site.register(lead_models.StageAnswer, StageAnswerAdmin)
 admin.site.register(lead_models.GeneralAnswer, GeneralAnswerAdmin)
 admin.site.register(lead_models.LeadContact, LeadContactAdmin)
+admin.site.register(lead_models.DashboardCounter, DashboardCounterAdmin)
+admin.site.register(
+    lead_models.LeadStageTransition, LeadStageTransitionAdmin)
+admin.site.register(lead_models.LeadDailyRollup, LeadDailyRollupAdmin)
@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+from django.db.models.signals import pre_migrate
+
+
+class LeadtrackerConfig(AppConfig):
+    name = "v1.leadtracker"
+
+    def ready(self):
+        """Connect the signals of the app."""
+        from v1.leadtracker import signals
+
+        pre_migrate.connect(signals.create_extensions, sender=self)
@@ -14,6 +14,7 @@ class QuestionType(ChoiceAdapter):
 #Lead source choice
 class LeadSourceChoice(ChoiceAdapter):
     LINKEDIN = 1,
+    PIPEDRIVE = 2,
 
 #Question field Type choice 
 class QuestionTypeChoice(ChoiceAdapter):
@@ -29,6 +30,18 @@ class StatusChoice(ChoiceAdapter):
     WON = 2, 
     LOST = 3, 
     
+#Lead event counted in the daily rollups
+class RollupEventChoice(ChoiceAdapter):
+    CREATED = 1,
+    WON = 2,
+    LOST = 3,
+
+#Pipedrive record synced into the leadtracker
+class PipedriveKindChoice(ChoiceAdapter):
+    ORGANIZATION = 1,
+    PERSON = 2,
+    DEAL = 3,
+
 class RoleChoice(ChoiceAdapter):
     CEO = 1,
     PROJRCT_MANAGER = 2,
@@ -36,3 +49,104 @@ class RoleChoice(ChoiceAdapter):
     SENIOR_FRONTEND_DEVELOPER = 4,
     JUNIOR_BACKEND_DEVELOPER = 5,
     JUNIOR_FRONTEND_DEVELOPER = 6,
+
+# Maximum points of an option, used to find the win possibility of a lead.
+MAX_OPTION_POINTS = 5
+
+# Sections available in the dashboard.
+DASHBOARD_SECTIONS = [
+    "totals", "lead_stage", "stages", "possibility", "top_leads", "trend"]
+# Sections computed when none are asked, top_leads lists leads.
+DASHBOARD_DEFAULT_SECTIONS = [
+    "totals", "lead_stage", "stages", "possibility", "trend"]
+# Buckets of the win possibility histogram, of equal width from 0 to 1.
+DASHBOARD_POSSIBILITY_BUCKETS = 10
+# Leads of the top_leads section, by win possibility.
+DASHBOARD_TOP_LEADS = 10
+
+# Lead fields by which the dashboard counters are maintained.
+COUNTER_DIMENSIONS = ("preset_id_id", "lead_source", "status", "current_stage_id")
+
+# Cache namespace of the dashboard.
+DASHBOARD_CACHE = "dashboard"
+# Cache namespace of the stage analytics.
+STAGE_ANALYTICS_CACHE = "stage_analytics"
+# Cache namespace of the lead cohorts.
+COHORT_CACHE = "cohort"
+# Cache namespace of the revenue forecast.
+FORECAST_CACHE = "forecast"
+
+# Cache namespaces computed from the leads and answers, invalidated on
+# their writes.
+LEAD_CACHES = (
+    DASHBOARD_CACHE, STAGE_ANALYTICS_CACHE, COHORT_CACHE, FORECAST_CACHE)
+
+# Seconds the typeahead matches of a text are cached.
+TYPEAHEAD_CACHE_TTL = 30
+# Cache namespace of the typeahead matches.
+TYPEAHEAD_CACHE = "typeahead"
+# Default and maximum number of typeahead matches.
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_MAX_LIMIT = 50
+
+# Cache namespace of the lead import jobs.
+LEAD_IMPORT_CACHE = "lead_import"
+# Rows of a lead import validated and written together.
+LEAD_IMPORT_CHUNK_SIZE = 1000
+# Invalid rows of a lead import reported with their errors.
+LEAD_IMPORT_MAX_ERRORS = 100
+# Storage folder of the uploaded workbooks, until they are imported.
+LEAD_IMPORT_FOLDER = "imports/leads"
+# Columns of a lead import, the encoded id or pipedrive url of a row
+# selects the lead to update.
+LEAD_IMPORT_COLUMNS = [
+    "id", "name", "organization", "pipedrive", "team_size", "revenue",
+    "lead_source", "expected_close_on",
+]
+
+# Link of a Pipedrive deal, by company domain and deal id, stored as the
+# pipedrive link of its lead.
+PIPEDRIVE_DEAL_URL = "https://%s.pipedrive.com/deal/%s"
+# Records of a Pipedrive import written together.
+PIPEDRIVE_CHUNK_SIZE = 1000
+# Role of the imported persons whose job title matches no role, as a
+# contact needs one.
+PIPEDRIVE_DEFAULT_ROLE = RoleChoice.CEO
+# Lead status of the Pipedrive deal status.
+PIPEDRIVE_DEAL_STATUS = {
+    "open": StatusChoice.ACTIVE,
+    "won": StatusChoice.WON,
+    "lost": StatusChoice.LOST,
+}
+
+# Cache namespace of the duplicate detection jobs.
+DEDUPE_CACHE = "dedupe"
+# Minimum score of two records to be clustered as duplicates.
+DEDUPE_MIN_SCORE = 0.85
+# Records sharing a blocking key compared at most, larger blocks are
+# too common to tell duplicates apart and are skipped.
+DEDUPE_MAX_BLOCK_SIZE = 100
+# Records merged into a target at most in a request.
+DEDUPE_MAX_MERGE = 100
+# Words dropped from the end of organization names before comparing.
+DEDUPE_LEGAL_SUFFIXES = {
+    "bv", "nv", "inc", "incorporated", "ltd", "limited", "llc", "llp",
+    "plc", "gmbh", "ag", "sa", "sarl", "srl", "spa", "pvt", "private",
+    "corp", "corporation", "co", "company", "group", "holding",
+    "holdings",
+}
+# Email domains of mail providers, not a sign of the same organization.
+DEDUPE_FREE_EMAIL_DOMAINS = {
+    "gmail.com", "googlemail.com", "yahoo.com", "hotmail.com",
+    "outlook.com", "live.com", "icloud.com", "aol.com", "proton.me",
+    "protonmail.com", "gmx.com", "zoho.com", "mail.com",
+}
+
+# Lead fields maintained from the answer scores.
+LEAD_SCORE_FIELDS = ["points_secured", "credit_registered", "possibility"]
+
+# Days of the trend section when the dashboard has no from date.
+TREND_DEFAULT_DAYS = 30
+
+# Days of changes processed by the periodic rollup refresh.
+ROLLUP_REFRESH_DAYS = 3
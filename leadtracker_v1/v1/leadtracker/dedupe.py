@@ -0,0 +1,428 @@
+"""
+Detection and merge of duplicate organizations and contacts.
+
+The organizations created by name from the lead forms, and the contacts
+entered for several leads, are often near duplicates, like "Acme" and
+"ACME B.V.". The records are grouped in blocks by keys that duplicates
+share, a normalized name, an email domain or a website host, and only
+the records of a block are compared, instead of every pair of records.
+The pairs scoring DEDUPE_MIN_SCORE or more are clustered with a
+union-find, so the duplicates of a duplicate are in the same cluster.
+
+A cluster is merged by moving the leads, contacts and lead contacts of
+its records to one of them, the target, and deleting the others.
+"""
+
+import itertools
+import unicodedata
+from difflib import SequenceMatcher
+from urllib.parse import urlparse
+
+from django.db import transaction
+from django.utils import timezone
+
+from common import library as comm_lib
+
+from v1.leadtracker import models as lead_model
+from v1.leadtracker import constants as lead_consts
+from v1.leadtracker import functions as lead_functions
+from v1.leadtracker import signals as lead_signals
+
+# Score added to the name similarity by a shared email domain, website
+# host or organization.
+DEDUPE_MATCH_BONUS = 0.2
+# Weight of the name similarity of contacts, a shared email domain,
+# email name or organization scores the rest.
+DEDUPE_CONTACT_NAME_WEIGHT = 0.6
+# Letters of the name prefix block, for names with typos after it.
+DEDUPE_PREFIX_LENGTH = 5
+
+
+class UnionFind:
+    """Disjoint sets of ids, to cluster the matching pairs."""
+
+    def __init__(self):
+        """Start with every id in its own set."""
+        self.parents = {}
+        self.sizes = {}
+
+    def find(self, item):
+        """Return the root of the set of the item, halving its path."""
+        self.parents.setdefault(item, item)
+        self.sizes.setdefault(item, 1)
+        while self.parents[item] != item:
+            self.parents[item] = self.parents[self.parents[item]]
+            item = self.parents[item]
+        return item
+
+    def union(self, first, second):
+        """Join the sets of two items, under the root of the larger."""
+        first = self.find(first)
+        second = self.find(second)
+        if first == second:
+            return
+        if self.sizes[first] < self.sizes[second]:
+            first, second = second, first
+        self.parents[second] = first
+        self.sizes[first] += self.sizes[second]
+
+    def groups(self):
+        """Return the sets with more than one item."""
+        groups = {}
+        for item in self.parents:
+            groups.setdefault(self.find(item), []).append(item)
+        return [sorted(items) for items in groups.values() if len(items) > 1]
+
+
+def normalize_name(name, suffixes=()):
+    """
+    Function to normalize a name for comparison.
+
+    Input Params:
+        name(str): name of the record.
+        suffixes(set): words dropped from the end of the name.
+    Returns:
+        (str): lowercase ascii words of the name, without punctuation.
+    """
+    name = unicodedata.normalize("NFKD", name or "")
+    name = name.encode("ascii", "ignore").decode().lower()
+    # Dotted abbreviations like "B.V." are one word.
+    name = name.replace(".", "")
+    words = "".join(
+        char if char.isalnum() else " " for char in name).split()
+    while len(words) > 1 and words[-1] in suffixes:
+        words.pop()
+    return " ".join(words)
+
+
+def get_email_domain(email):
+    """Function to get the domain of an email, unless a mail provider."""
+    domain = (email or "").rpartition("@")[2].strip().lower()
+    if domain in lead_consts.DEDUPE_FREE_EMAIL_DOMAINS:
+        return ""
+    return domain
+
+
+def get_email_name(email):
+    """Function to get the name of an email, without dots and tags."""
+    name = (email or "").rpartition("@")[0].lower()
+    return name.split("+", 1)[0].replace(".", "")
+
+
+def get_website_host(website):
+    """Function to get the host of a website, without www."""
+    website = (website or "").strip().lower()
+    if not website:
+        return ""
+    if "//" not in website:
+        website = "//" + website
+    host = urlparse(website).hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+
+def get_organization_record(organization):
+    """
+    Function to get the comparison fields of an organization.
+
+    Input Params:
+        organization(dict): id, name, email and website.
+    Returns:
+        (dict): normalized name, email domain and website host, with the
+            blocking keys.
+    """
+    name = normalize_name(
+        organization["name"], lead_consts.DEDUPE_LEGAL_SUFFIXES)
+    domain = get_email_domain(organization["email"])
+    host = get_website_host(organization["website"])
+    keys = {
+        ("name", name),
+        ("prefix", name.replace(" ", "")[:DEDUPE_PREFIX_LENGTH]),
+        ("domain", domain),
+        ("domain", host),
+    }
+    return {
+        "name": name, "sites": {domain, host} - {""},
+        "keys": {key for key in keys if key[1]}}
+
+
+def get_contact_record(contact):
+    """
+    Function to get the comparison fields of a contact.
+
+    Input Params:
+        contact(dict): id, name, email and organization id.
+    Returns:
+        (dict): normalized name, email domain, email name and
+            organization, with the blocking keys.
+    """
+    name = normalize_name(contact["name"])
+    domain = get_email_domain(contact["email"])
+    email_name = get_email_name(contact["email"])
+    keys = {
+        ("name", name),
+        ("email", email_name),
+        ("domain", "%s %s" % (domain, name[:1]) if domain else ""),
+        ("organization", "%s %s" % (
+            contact["organization_id"], name[:1])
+         if contact["organization_id"] else ""),
+    }
+    return {
+        "name": name, "domain": domain, "email_name": email_name,
+        "organization": contact["organization_id"],
+        "keys": {key for key in keys if key[1]}}
+
+
+def get_name_score(first, second):
+    """Function to get the similarity of two normalized names."""
+    if not first or not second:
+        return 0
+    if first == second:
+        return 1
+    return SequenceMatcher(None, first, second).ratio()
+
+
+def score_organizations(first, second):
+    """
+    Function to score two organizations as duplicates.
+
+    The similarity of the names, raised when they share an email domain
+    or a website host.
+    """
+    score = get_name_score(first["name"], second["name"])
+    if first["sites"] & second["sites"]:
+        score += DEDUPE_MATCH_BONUS
+    return min(score, 1)
+
+
+def score_contacts(first, second):
+    """
+    Function to score two contacts as duplicates.
+
+    A name is not enough to tell people apart, the similarity of the
+    names only adds up to a match with a shared organization, email
+    domain or email name.
+    """
+    score = DEDUPE_CONTACT_NAME_WEIGHT * get_name_score(
+        first["name"], second["name"])
+    if ((first["organization"]
+            and first["organization"] == second["organization"])
+            or (first["domain"] and first["domain"] == second["domain"])
+            or first["email_name"] == second["email_name"]):
+        score += 1 - DEDUPE_CONTACT_NAME_WEIGHT
+    return score
+
+
+DEDUPE_KINDS = {
+    "organization": (
+        lead_model.Organization, ("id", "name", "email", "website"),
+        get_organization_record, score_organizations),
+    "contact": (
+        lead_model.Contact, ("id", "name", "email", "organization_id"),
+        get_contact_record, score_contacts),
+}
+
+
+def find_duplicates(kind):
+    """
+    Function to find the clusters of duplicate organizations or contacts.
+
+    Input Params:
+        kind(str): organization or contact, a key of DEDUPE_KINDS.
+    Returns:
+        (dict): records and pairs compared, with the clusters of
+            duplicates, largest first. Each cluster has its records, the
+            suggested target, the oldest record, and its matching pairs
+            with their score.
+    """
+    model, fields, get_record, score = DEDUPE_KINDS[kind]
+    rows = {}
+    records = {}
+    blocks = {}
+    for row in model.objects.order_by("id").values(*fields).iterator():
+        rows[row["id"]] = row
+        records[row["id"]] = get_record(row)
+        for key in records[row["id"]]["keys"]:
+            blocks.setdefault(key, []).append(row["id"])
+
+    clusters = UnionFind()
+    pairs = {}
+    compared = set()
+    for ids in blocks.values():
+        if len(ids) > lead_consts.DEDUPE_MAX_BLOCK_SIZE:
+            continue
+        for pair in itertools.combinations(ids, 2):
+            if pair in compared:
+                continue
+            compared.add(pair)
+            pair_score = score(records[pair[0]], records[pair[1]])
+            if pair_score >= lead_consts.DEDUPE_MIN_SCORE:
+                clusters.union(*pair)
+                pairs[pair] = pair_score
+
+    groups = sorted(clusters.groups(), key=lambda ids: (-len(ids), ids[0]))
+    result = []
+    for ids in groups:
+        members = set(ids)
+        result.append({
+            "target": comm_lib.encode(ids[0]),
+            "records": [
+                {
+                    "id": comm_lib.encode(pk),
+                    "name": rows[pk]["name"],
+                    "email": rows[pk]["email"],
+                }
+                for pk in ids],
+            "pairs": [
+                {
+                    "ids": [comm_lib.encode(pk) for pk in pair],
+                    "score": round(pair_score, 3),
+                }
+                for pair, pair_score in sorted(pairs.items())
+                if pair[0] in members],
+        })
+    return {
+        "kind": kind,
+        "records": len(rows),
+        "compared": len(compared),
+        "clusters": result,
+    }
+
+
+def fill_blanks(target, sources, fields):
+    """Function to copy the first value of the sources to empty fields."""
+    for field in fields:
+        if getattr(target, field):
+            continue
+        for source in sources:
+            if getattr(source, field):
+                setattr(target, field, getattr(source, field))
+                break
+
+
+def move_pipedrive_syncs(kind, target, sources, user=None):
+    """
+    Function to point the Pipedrive records of merged objects to the target.
+
+    Input Params:
+        kind(int): PipedriveKindChoice of the objects.
+        target(obj): object kept.
+        sources(list): objects merged into the target.
+        user(obj): user merging the objects.
+    """
+    lead_model.PipedriveSync.objects.filter(
+        kind=kind, object_id__in=[source.id for source in sources]).update(
+            object_id=target.id, updater=user, updated_on=timezone.now())
+
+
+@transaction.atomic
+def merge_organizations(target, sources, user=None):
+    """
+    Function to merge duplicate organizations into one.
+
+    The leads and contacts of the sources are moved to the target with
+    one update each, the empty fields of the target are taken from the
+    sources, and the sources are deleted. Their Pipedrive records are
+    moved to the target, so that importing them again updates it.
+
+    Input Params:
+        target(obj): organization kept.
+        sources(list): duplicate organizations merged into the target.
+        user(obj): user merging the organizations.
+    Returns:
+        (dict): number of leads and contacts moved.
+    """
+    sources = [source for source in sources if source.id != target.id]
+    now = timezone.now()
+    lead_ids = list(lead_model.Lead.objects.filter(
+        organization__in=sources).values_list("id", flat=True))
+    snapshot = lead_functions.get_bulk_lead_snapshot(lead_ids)
+    leads = lead_model.Lead.objects.filter(id__in=lead_ids).update(
+        organization=target, updater=user, updated_on=now)
+    contacts = lead_model.Contact.objects.filter(
+        organization__in=sources).update(
+            organization=target, updater=user, updated_on=now)
+
+    move_pipedrive_syncs(
+        lead_consts.PipedriveKindChoice.ORGANIZATION, target, sources, user)
+    fill_blanks(target, sources, ("email", "website", "country"))
+    target.updater = user
+    with lead_signals.muted():
+        lead_model.Organization.objects.filter(
+            id__in=[source.id for source in sources]).delete()
+        target.save()
+    lead_functions.record_bulk_lead_writes(lead_ids, snapshot, creator=user)
+    lead_functions.invalidate_duplicates()
+    return {"leads": leads, "contacts": contacts}
+
+
+@transaction.atomic
+def merge_contacts(target, sources, user=None):
+    """
+    Function to merge duplicate contacts into one.
+
+    The lead contacts of the sources are moved to the target with one
+    bulk update. When the target is already a contact of the lead at the
+    same stage, the flags of the source are added to its lead contact
+    and the lead contact of the source is deleted. The empty fields of
+    the target are taken from the sources, and the sources are deleted
+    with their Pipedrive records moved to the target.
+
+    Input Params:
+        target(obj): contact kept.
+        sources(list): duplicate contacts merged into the target.
+        user(obj): user merging the contacts.
+    Returns:
+        (dict): number of lead contacts moved and merged.
+    """
+    sources = [source for source in sources if source.id != target.id]
+    now = timezone.now()
+    links = {
+        (link.lead_id_id, link.stage_id_id): link
+        for link in lead_model.LeadContact.objects.filter(contact_id=target)}
+    source_links = list(lead_model.LeadContact.objects.filter(
+        contact_id__in=sources).order_by("id"))
+    lead_ids = list({link.lead_id_id for link in source_links})
+    snapshot = lead_functions.get_bulk_lead_snapshot(lead_ids)
+
+    updated = {}
+    merged = []
+    for link in source_links:
+        key = (link.lead_id_id, link.stage_id_id)
+        existing = links.get(key)
+        if existing:
+            existing.is_decision_maker |= link.is_decision_maker
+            existing.is_board_member |= link.is_board_member
+            merged.append(link.id)
+        else:
+            existing = link
+            existing.contact_id = target
+            links[key] = existing
+        existing.updater = user
+        existing.updated_on = now
+        updated[existing.id] = existing
+    with lead_signals.muted():
+        lead_model.LeadContact.objects.filter(id__in=merged).delete()
+    lead_model.LeadContact.objects.bulk_update(
+        [link for pk, link in updated.items() if pk not in merged], [
+            "contact_id", "is_decision_maker", "is_board_member",
+            "updater", "updated_on"])
+
+    move_pipedrive_syncs(
+        lead_consts.PipedriveKindChoice.PERSON, target, sources, user)
+    fill_blanks(target, sources, ("organization_id", "linkedin"))
+    target.updater = user
+    with lead_signals.muted():
+        lead_model.Contact.objects.filter(
+            id__in=[source.id for source in sources]).delete()
+        target.save()
+    lead_functions.record_bulk_lead_writes(lead_ids, snapshot, creator=user)
+    lead_functions.invalidate_duplicates()
+    return {
+        "lead_contacts": len(source_links) - len(merged),
+        "merged": len(merged)}
+
+
+MERGES = {
+    "organization": merge_organizations,
+    "contact": merge_contacts,
+}
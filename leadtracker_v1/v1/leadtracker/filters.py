@@ -3,4 +3,105 @@
 from django_filters import rest_framework as filters
 
 from django.db.models import Q
-    
\ No newline at end of file
+from django.db.models import Exists
+from django.db.models import OuterRef
+
+from common import library as comm_lib
+from common.exceptions import BadRequest
+
+from v1.leadtracker import models as lead_models
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    """Filter on comma separated numbers, like ?status=1,2."""
+
+
+class IdencodeInFilter(filters.CharFilter):
+    """Filter on comma separated encoded ids, like ?organization=a1b,c2d."""
+
+    def filter(self, qs, value):
+        """Decode the ids and filter on them."""
+        if not value:
+            return qs
+        ids = comm_lib.decode_list(
+            [item.strip() for item in value.split(",")])
+        if not ids:
+            raise BadRequest("Invalid id in %s." % self.field_name)
+        return self.get_method(qs)(**{"%s__in" % self.field_name: ids})
+
+
+class UnixTimeFilter(filters.NumberFilter):
+    """Filter on a date time field with a unix timestamp."""
+
+    def filter(self, qs, value):
+        """Convert the timestamp and filter on it."""
+        if value is None:
+            return qs
+        return super().filter(qs, comm_lib.unix_to_datetime(value))
+
+
+class LeadFilter(filters.FilterSet):
+    """
+    Filter for Leads.
+
+    Query Params:
+        status(int): comma separated lead statuses.
+        lead_source(int): comma separated lead sources.
+        current_stage(idencode): comma separated stages.
+        preset(idencode): comma separated stage presets.
+        organization(idencode): comma separated organizations.
+        tag(idencode): comma separated tags, leads with any of them.
+        created_from, created_to(unix): created on range.
+        updated_from, updated_to(unix): updated on range.
+        revenue_min, revenue_max(float): revenue range.
+        team_size_min, team_size_max(int): team size range.
+        possibility_min, possibility_max(float): win possibility range.
+        ordering(str): comma separated fields, prefixed by - to reverse.
+    """
+
+    status = NumberInFilter(field_name="status", lookup_expr="in")
+    lead_source = NumberInFilter(field_name="lead_source", lookup_expr="in")
+    current_stage = IdencodeInFilter(field_name="current_stage")
+    preset = IdencodeInFilter(field_name="preset_id")
+    organization = IdencodeInFilter(field_name="organization")
+    tag = filters.CharFilter(method="filter_tag")
+    created_from = UnixTimeFilter(field_name="created_on", lookup_expr="gte")
+    created_to = UnixTimeFilter(field_name="created_on", lookup_expr="lte")
+    updated_from = UnixTimeFilter(field_name="updated_on", lookup_expr="gte")
+    updated_to = UnixTimeFilter(field_name="updated_on", lookup_expr="lte")
+    revenue_min = filters.NumberFilter(
+        field_name="revenue", lookup_expr="gte")
+    revenue_max = filters.NumberFilter(
+        field_name="revenue", lookup_expr="lte")
+    team_size_min = filters.NumberFilter(
+        field_name="team_size", lookup_expr="gte")
+    team_size_max = filters.NumberFilter(
+        field_name="team_size", lookup_expr="lte")
+    possibility_min = filters.NumberFilter(
+        field_name="possibility", lookup_expr="gte")
+    possibility_max = filters.NumberFilter(
+        field_name="possibility", lookup_expr="lte")
+    ordering = filters.OrderingFilter(
+        fields=(
+            "possibility", "created_on", "updated_on", "name",
+            "revenue", "team_size", "status",
+        ))
+
+    class Meta:
+        model = lead_models.Lead
+        fields = [
+            "status", "lead_source", "current_stage", "preset",
+            "organization", "tag", "created_from", "created_to",
+            "updated_from", "updated_to", "revenue_min", "revenue_max",
+            "team_size_min", "team_size_max", "possibility_min",
+            "possibility_max", "ordering",
+        ]
+
+    def filter_tag(self, queryset, name, value):
+        """Leads with any of the tags, without duplicating the leads."""
+        ids = comm_lib.decode_list(
+            [item.strip() for item in value.split(",")])
+        if not ids:
+            raise BadRequest("Invalid id in tag.")
+        return queryset.filter(Exists(lead_models.LeadTag.objects.filter(
+            lead_id=OuterRef("pk"), tag_id__in=ids)))
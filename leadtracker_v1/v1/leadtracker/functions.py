@@ -1,33 +1,998 @@
+from datetime import datetime
+from datetime import time
+from datetime import timedelta
+
 from . import models as lead_model
-from django.db.models import Count, Sum, F
+from . import constants as lead_consts
+from . import search as lead_search
+from django.db import IntegrityError
+from django.db import connection
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Count, Sum, F, Q
+from django.db.models import FloatField, IntegerField, Value
+from django.db.models.functions import Coalesce
+from django.db.models.functions import Floor
+from django.db.models.functions import Least
+from django.db.models.functions import TruncDate
+from django.db.models.functions import TruncMonth
+
+from common import library as comm_lib
+from common import cache as cache_lib
+from common.exceptions import BadRequest
+
+
+def get_dashboard_params(query_params):
+    """
+    Parse the dashboard query params into a plain filter dictionary.
+
+    The returned dictionary only holds JSON friendly values, so that it can
+    be reused as a cache key or sent to a background worker as it is.
+
+    Input Params:
+        query_params(dict): request query params with,
+            from(unix): lower bound of lead created_on.
+            to(unix): upper bound of lead created_on.
+            preset_id(idencode): stage preset of the leads.
+            lead_source(int): source of the leads.
+            sections(str): comma separated dashboard sections.
+    Returns:
+        (dict): parsed dashboard params.
+    """
+    params = {}
+    for key in ("from", "to"):
+        if query_params.get(key):
+            params[key] = comm_lib.unix_to_datetime(
+                query_params[key]).timestamp()
+    if query_params.get("preset_id"):
+        preset_id = comm_lib.decode(query_params["preset_id"])
+        if not preset_id:
+            raise BadRequest("Invalid preset_id.")
+        params["preset_id"] = preset_id
+    if query_params.get("lead_source"):
+        try:
+            params["lead_source"] = int(query_params["lead_source"])
+        except ValueError:
+            raise BadRequest("lead_source should be an integer.")
+    sections = lead_consts.DASHBOARD_DEFAULT_SECTIONS
+    if query_params.get("sections"):
+        sections = [
+            section.strip() for section in query_params["sections"].split(",")
+            if section.strip()]
+        invalid = set(sections) - set(lead_consts.DASHBOARD_SECTIONS)
+        if invalid:
+            raise BadRequest(
+                "Invalid sections %s." % ", ".join(sorted(invalid)))
+    params["sections"] = sorted(set(sections))
+    return params
+
+
+def get_lead_filter(params, prefix=""):
+    """
+    Build the lead filter of the dashboard params.
+
+    Input Params:
+        params(dict): params from get_dashboard_params.
+        prefix(str): lookup prefix to reach the lead from another model.
+    Returns:
+        (obj): Q object to filter the leads.
+    """
+    query = Q()
+    if "from" in params:
+        query &= Q(**{
+            prefix + "created_on__gte": comm_lib.unix_to_datetime(
+                params["from"])})
+    if "to" in params:
+        query &= Q(**{
+            prefix + "created_on__lte": comm_lib.unix_to_datetime(
+                params["to"])})
+    if "preset_id" in params:
+        query &= Q(**{prefix + "preset_id": params["preset_id"]})
+    if "lead_source" in params:
+        query &= Q(**{prefix + "lead_source": params["lead_source"]})
+    return query
+
+
+def get_possibility(points_secured, credit_registered):
+    """
+    Function to get the win possibility from the answer points.
+
+    Input Params:
+        points_secured(int): sum of option points * question credit.
+        credit_registered(int): maximum score of the answers.
+    Returns:
+        (float): possibility between 0 and 1.
+    """
+    if not credit_registered or credit_registered <= 0:
+        return 0
+    return min(max((points_secured or 0) / credit_registered, 0), 1)
+
+
+def update_lead_scores(lead_ids):
+    """
+    Function to recompute the stored win possibility of leads.
+
+    The scores of the stage and general answers of the leads are summed
+    with one grouped query per answer model.
+
+    Input Params:
+        lead_ids(list): ids of the leads to update.
+    Returns:
+        (int): number of leads with changed scores, the others are not
+            written.
+    """
+    lead_ids = {lead_id for lead_id in lead_ids if lead_id}
+    if not lead_ids:
+        return 0
+    scores = {lead_id: [0, 0] for lead_id in lead_ids}
+    for model in (lead_model.StageAnswer, lead_model.GeneralAnswer):
+        answers = (
+            model.objects.filter(lead_id__in=lead_ids)
+            .order_by()
+            .values("lead_id")
+            .annotate(
+                points=Coalesce(Sum("score"), 0),
+                credit=Coalesce(Sum("question_id__credit"), 0))
+        )
+        for answer in answers:
+            scores[answer["lead_id"]][0] += answer["points"]
+            scores[answer["lead_id"]][1] += (
+                answer["credit"] * lead_consts.MAX_OPTION_POINTS)
+
+    stored = {
+        lead_id: values for lead_id, *values in
+        lead_model.Lead.objects.filter(id__in=lead_ids).values_list(
+            "id", *lead_consts.LEAD_SCORE_FIELDS)}
+    now = timezone.now()
+    leads = []
+    for lead_id, (points, credit) in scores.items():
+        values = [points, credit, get_possibility(points, credit)]
+        # Unchanged leads keep their updated_on, which the rollups,
+        # ETags and snapshots read as a change.
+        if lead_id not in stored or stored[lead_id] == values:
+            continue
+        leads.append(lead_model.Lead(
+            id=lead_id,
+            points_secured=values[0],
+            credit_registered=values[1],
+            possibility=values[2],
+            updated_on=now,
+        ))
+    lead_model.Lead.objects.bulk_update(
+        leads, lead_consts.LEAD_SCORE_FIELDS + ["updated_on"],
+        batch_size=1000)
+    return len(leads)
+
+
+@transaction.atomic
+def save_answers(lead, stage, answers, user=None):
+    """
+    Function to save the answers of a lead to a questionnaire.
+
+    The selected options of each question replace its previous answers,
+    this is not an upsert: the answers of the options still selected are
+    kept as they are, the newly selected ones are inserted with one query
+    and the unselected ones are deleted with another. An answer inserted
+    meanwhile by another request fails the unique constraints and the
+    whole submission is refused with BadRequest. The dashboard counters
+    and the lead score are updated once for all the answers.
+
+    Input Params:
+        lead(obj): lead object.
+        stage(obj): stage of the answers, None for general answers.
+        answers(list): question and selected options tuples, validated
+            by AnswerSubmissionSerializer.
+        user(obj): user submitting the answers.
+    Returns:
+        (dict): number of answers created and deleted.
+    """
+    # The signals import this module.
+    from v1.leadtracker import signals as lead_signals
+
+    # Lock the lead, so that concurrent submissions are applied in order.
+    lead = lead_model.Lead.objects.select_for_update().get(id=lead.id)
+    model = lead_model.StageAnswer if stage else lead_model.GeneralAnswer
+    existing = model.objects.filter(
+        lead_id=lead, question_id__in=[question.id for question, _ in answers])
+    if stage:
+        existing = existing.filter(stage_id=stage)
+    existing = {
+        (question_id, option_id): (answer_id, score)
+        for answer_id, question_id, option_id, score in existing.values_list(
+            "id", "question_id", "option_id", "score")
+    }
+
+    created = []
+    selected = set()
+    for question, options in answers:
+        for option in options:
+            selected.add((question.id, option.id))
+            if (question.id, option.id) in existing:
+                continue
+            answer = model(
+                lead_id=lead, question_id=question, option_id=option,
+                creator=user, updater=user)
+            if stage:
+                answer.stage_id = stage
+            answer.score = lead_model.get_answer_score(answer)
+            created.append(answer)
+    deleted = [
+        value for key, value in existing.items() if key not in selected]
+
+    try:
+        model.objects.bulk_create(created, batch_size=1000)
+    except IntegrityError:
+        # Answers added with the single answer endpoints do not lock the
+        # lead, the submission is refused instead of counted twice.
+        raise BadRequest(
+            "The answers were changed by another request, submit again.")
+    with lead_signals.muted():
+        model.objects.filter(
+            id__in=[answer_id for answer_id, _ in deleted]).delete()
+
+    if stage:
+        lead_model.DashboardCounter.add(
+            lead_model.DashboardCounter.dimensions(lead),
+            answers=len(created) - len(deleted),
+            points_secured=(
+                sum(answer.score for answer in created)
+                - sum(score for _, score in deleted)))
+    update_lead_scores([lead.id])
+    for namespace in lead_consts.LEAD_CACHES:
+        transaction.on_commit(
+            lambda namespace=namespace: cache_lib.invalidate(namespace))
+    return {"created": len(created), "deleted": len(deleted)}
 
 
-def get_dashboard():
+def invalidate_duplicates():
+    """
+    Function to mark the duplicate detection jobs stale.
+
+    The jobs are shared by their cache generation, a new job is started
+    once the organizations or contacts written are committed.
+    """
+    transaction.on_commit(
+        lambda: cache_lib.invalidate(lead_consts.DEDUPE_CACHE))
+
+
+def use_snapshot(params):
+    """
+    Check if the dashboard params can be served from the counters.
+
+    The counters are maintained per preset, lead source, status and stage,
+    a created_on range needs the live computation.
+    """
+    return "from" not in params and "to" not in params
+
+
+def get_snapshot_sections(params, sections):
+    """
+    Function to read the totals and stage sections from the counters.
+
+    Input Params:
+        params(dict): params from get_dashboard_params.
+        sections(list): sections to compute.
+    Returns:
+        (dict): totals and lead_stage sections.
+    """
+    query = Q()
+    if "preset_id" in params:
+        query &= Q(preset_id=params["preset_id"])
+    if "lead_source" in params:
+        query &= Q(lead_source=params["lead_source"])
+    counters = lead_model.DashboardCounter.objects.filter(query).order_by()
+    data = {}
+
+    if "totals" in sections:
+        data.update(counters.aggregate(
+            lead_total=Coalesce(Sum("leads"), 0),
+            lead_won=Coalesce(Sum(
+                "leads", filter=Q(status=lead_consts.StatusChoice.WON)), 0),
+            lead_lost=Coalesce(Sum(
+                "leads", filter=Q(status=lead_consts.StatusChoice.LOST)), 0),
+        ))
+
+    if "lead_stage" in sections:
+        stages = (
+            counters.values(stage=F("current_stage__name"))
+            .annotate(
+                count=Sum("leads"), answers=Sum("answers"),
+                points_secured=Sum("points_secured"))
+            .filter(count__gt=0)
+            .order_by("-count")
+        )
+        data["lead_stage"] = [{
+            "stage": stage["stage"],
+            "count": stage["count"],
+            "possibility": get_possibility(
+                stage["points_secured"],
+                stage["answers"] * lead_consts.MAX_OPTION_POINTS),
+        } for stage in stages]
+    return data
+
+
+def get_live_sections(params, sections):
+    """
+    Function to compute the totals and stage sections from the leads.
+
+    Input Params:
+        params(dict): params from get_dashboard_params.
+        sections(list): sections to compute.
+    Returns:
+        (dict): totals and lead_stage sections.
+    """
+    leads = lead_model.Lead.objects.filter(
+        get_lead_filter(params)).order_by()
+    data = {}
+
+    if "totals" in sections:
+        data.update(leads.aggregate(
+            lead_total=Count("id"),
+            lead_won=Count(
+                "id", filter=Q(status=lead_consts.StatusChoice.WON)),
+            lead_lost=Count(
+                "id", filter=Q(status=lead_consts.StatusChoice.LOST)),
+        ))
+
+    if "lead_stage" in sections:
+        answers = {
+            stage["stage"]: stage for stage in (
+                lead_model.StageAnswer.objects.filter(
+                    get_lead_filter(params, prefix="lead_id__"))
+                .order_by()
+                .values(stage=F("lead_id__current_stage__name"))
+                .annotate(
+                    answers=Count("id"), points_secured=Sum("score"))
+            )}
+        stages = (
+            leads.values(stage=F("current_stage__name"))
+            .annotate(count=Count("id"))
+            .order_by("-count")
+        )
+        data["lead_stage"] = []
+        for stage in stages:
+            answer = answers.get(stage["stage"], {})
+            stage["possibility"] = get_possibility(
+                answer.get("points_secured"),
+                answer.get("answers", 0) * lead_consts.MAX_OPTION_POINTS)
+            data["lead_stage"].append(stage)
+    return data
+
+
+def get_dashboard(params=None):
     """
     Contain data about lead and their possibility to win.
+
+    Totals and stage counts are read from the dashboard counters, unless
+    a created_on range is asked, in which case each section is computed
+    with a single query using conditional aggregation. The possibility
+    section counts the leads by win possibility, only top_leads lists
+    leads, a fixed number of them. Only the sections asked in the params
+    are computed.
+
+    Input Params:
+        params(dict): params from get_dashboard_params.
+    Returns:
+        (dict): dashboard data of the requested sections.
+    """
+    params = params or {}
+    sections = params.get(
+        "sections", lead_consts.DASHBOARD_DEFAULT_SECTIONS)
+    if use_snapshot(params):
+        data = get_snapshot_sections(params, sections)
+    else:
+        data = get_live_sections(params, sections)
+
+    if "stages" in sections:
+        stages = lead_model.Stage.objects.order_by()
+        if "preset_id" in params:
+            stages = stages.filter(preset_id=params["preset_id"])
+        data["stages"] = list(stages.values("name"))
+
+    if "trend" in sections:
+        data["trend"] = get_trend(params)
+
+    scored = lead_model.Lead.objects.filter(
+        get_lead_filter(params), credit_registered__gt=0)
+    if "possibility" in sections:
+        data["possibility"] = get_possibility_histogram(scored)
+
+    if "top_leads" in sections:
+        data["top_leads"] = [
+            {"id": comm_lib.encode(lead_id), "name": name,
+             "possibility": possibility}
+            for lead_id, name, possibility in scored.order_by(
+                "-possibility", "-id").values_list(
+                    "id", "name", "possibility")[
+                        :lead_consts.DASHBOARD_TOP_LEADS]]
+
+    return data
+
+
+def get_possibility_histogram(leads):
+    """
+    Function to count the leads by win possibility.
+
+    The leads are counted in one grouped query, by buckets of equal width
+    from 0 to 1, the last one including 1.
+
+    Input Params:
+        leads(obj): queryset of the scored leads.
+    Returns:
+        (list): from, to and count of each bucket, empty buckets included.
+    """
+    size = lead_consts.DASHBOARD_POSSIBILITY_BUCKETS
+    counts = dict(
+        leads.order_by()
+        .annotate(bucket=Least(
+            Floor(F("possibility") * size), Value(size - 1),
+            output_field=IntegerField()))
+        .values_list("bucket")
+        .annotate(count=Count("id"))
+    )
+    return [{
+        "from": round(bucket / size, 4),
+        "to": round((bucket + 1) / size, 4),
+        "count": counts.get(bucket, 0),
+    } for bucket in range(size)]
+
+
+def get_live_counters(lead_ids=None):
+    """
+    Function to compute the dashboard counters from the leads and answers.
+
+    Input Params:
+        lead_ids(list): ids of the leads to count, all the leads if None.
+    Returns:
+        (dict): counter values with the dimension tuple as key.
+    """
+    counters = {}
+    leads = lead_model.Lead.objects.all()
+    answers = lead_model.StageAnswer.objects.filter(lead_id__isnull=False)
+    if lead_ids is not None:
+        leads = leads.filter(id__in=lead_ids)
+        answers = answers.filter(lead_id__in=lead_ids)
+    leads = (
+        leads.order_by()
+        .values(*lead_consts.COUNTER_DIMENSIONS)
+        .annotate(leads=Count("id"))
+    )
+    for lead in leads:
+        key = tuple(lead[dim] for dim in lead_consts.COUNTER_DIMENSIONS)
+        counters[key] = {
+            "leads": lead["leads"], "answers": 0, "points_secured": 0}
+
+    prefixed = ["lead_id__" + dim for dim in lead_consts.COUNTER_DIMENSIONS]
+    answers = (
+        answers.order_by()
+        .values(*prefixed)
+        .annotate(
+            answers=Count("id"),
+            points_secured=Coalesce(Sum("score"), 0))
+    )
+    for answer in answers:
+        key = tuple(answer[dim] for dim in prefixed)
+        counter = counters.setdefault(
+            key, {"leads": 0, "answers": 0, "points_secured": 0})
+        counter["answers"] = answer["answers"]
+        counter["points_secured"] = answer["points_secured"]
+    return counters
+
+
+def get_lead_states(lead_ids):
+    """
+    Function to get the current stage and status of leads.
+
+    Input Params:
+        lead_ids(list): ids of the leads.
+    Returns:
+        (dict): (current_stage_id, status) with the lead id as key.
+    """
+    leads = lead_model.Lead.objects.filter(id__in=lead_ids).values_list(
+        "id", "current_stage_id", "status")
+    return {lead_id: (stage_id, status) for lead_id, stage_id, status in leads}
+
+
+def get_bulk_lead_snapshot(lead_ids):
+    """
+    Function to get the lead aggregates that a bulk write can change.
+
+    Input Params:
+        lead_ids(list): ids of the leads to be written.
+    Returns:
+        (dict): counters and states of the leads.
     """
-    lead_total = lead_model.Lead.objects.all().count()
-    lead_won = lead_model.Lead.objects.filter(status=2).count()
-    lead_lost = lead_model.Lead.objects.filter(status=3).count()
-    lead_stage = (lead_model.Lead.objects.values(
-        stage=F("current_stage__name"))
-        .annotate(count=Count("current_stage"))
-        .order_by("-count")
-    )
-    all_stages = (lead_model.Stage.objects.values("name"))
-            
-    possibility = lead_model.StageAnswer.objects.annotate(
-            points_secured=Sum(
-                F('option_id__points') * F('question_id__credit')),
-            credit_registerd=Count('question_id') * 5, 
-            possibility=F('points_secured') / F('credit_registerd')
-            ).order_by('lead_id').values('lead_id__name','possibility')
-        
     return {
-            "lead_total": lead_total,
-            "lead_won": lead_won,
-            "lead_lost": lead_lost,
-            "lead_stage": lead_stage,
-            "stages": all_stages,
-            "possibility":possibility,
-    }
\ No newline at end of file
+        "counters": get_live_counters(lead_ids),
+        "states": get_lead_states(lead_ids),
+    }
+
+
+def apply_counter_changes(before, after):
+    """
+    Function to move the dashboard counters by the change of some leads.
+
+    Only the difference is added to each counter, so the increments made
+    meanwhile by other writes are kept.
+
+    Input Params:
+        before(dict): get_live_counters of the leads before the write.
+        after(dict): get_live_counters of the leads after the write.
+    """
+    for key in set(before) | set(after):
+        old = before.get(key, {})
+        new = after.get(key, {})
+        lead_model.DashboardCounter.add(
+            dict(zip(lead_consts.COUNTER_DIMENSIONS, key)),
+            **{
+                value: new.get(value, 0) - old.get(value, 0)
+                for value in ("leads", "answers", "points_secured")
+            })
+
+
+def record_bulk_lead_writes(lead_ids, snapshot=None, creator=None):
+    """
+    Function to maintain the lead aggregates after a bulk write.
+
+    bulk_create and bulk_update do not send the model signals, and bulk
+    deletes mute them, so the changes of all the leads are applied at
+    once. The dashboard counters are moved by the difference of the
+    counters of the leads before and after the write, the stage history
+    is appended for the leads whose stage or status changed, their search
+    vectors are rebuilt, and the lead caches are invalidated once the
+    write is committed. The scores only depend on the answers and are
+    not changed by lead writes.
+
+    Input Params:
+        lead_ids(list): ids of the created, updated or deleted leads.
+        snapshot(dict): get_bulk_lead_snapshot before the write, None for
+            created leads.
+        creator(obj): user to record as creator of the stage history.
+    """
+    snapshot = snapshot or {"counters": {}, "states": {}}
+    apply_counter_changes(
+        snapshot["counters"], get_live_counters(lead_ids))
+
+    transitions = []
+    for lead_id, state in get_lead_states(lead_ids).items():
+        previous = snapshot["states"].get(lead_id, (None, None))
+        if previous == state:
+            continue
+        transitions.append(lead_model.LeadStageTransition(
+            lead_id_id=lead_id,
+            from_stage_id=previous[0], to_stage_id=state[0],
+            from_status=previous[1], to_status=state[1],
+            creator=creator,
+        ))
+    lead_model.LeadStageTransition.objects.bulk_create(
+        transitions, batch_size=1000)
+    lead_search.update_search_vectors(
+        lead_model.Lead.objects.filter(id__in=lead_ids))
+
+    for namespace in lead_consts.LEAD_CACHES:
+        transaction.on_commit(
+            lambda namespace=namespace: cache_lib.invalidate(namespace))
+
+
+def get_stored_counters():
+    """
+    Function to read the stored dashboard counters.
+
+    Returns:
+        (dict): counter values with the dimension tuple as key.
+    """
+    counters = {}
+    stored = (
+        lead_model.DashboardCounter.objects.order_by()
+        .values(*lead_consts.COUNTER_DIMENSIONS)
+        .annotate(
+            leads_sum=Sum("leads"), answers_sum=Sum("answers"),
+            points_sum=Sum("points_secured"))
+    )
+    for counter in stored:
+        if not (counter["leads_sum"] or counter["answers_sum"]
+                or counter["points_sum"]):
+            continue
+        key = tuple(counter[dim] for dim in lead_consts.COUNTER_DIMENSIONS)
+        counters[key] = {
+            "leads": counter["leads_sum"],
+            "answers": counter["answers_sum"],
+            "points_secured": counter["points_sum"],
+        }
+    return counters
+
+
+@transaction.atomic
+def rebuild_dashboard_counters(counters=None):
+    """
+    Function to replace the stored dashboard counters.
+
+    Input Params:
+        counters(dict): counters from get_live_counters.
+    Returns:
+        (int): number of counters created.
+    """
+    counters = counters if counters is not None else get_live_counters()
+    lead_model.DashboardCounter.objects.all().delete()
+    objects = []
+    for key, values in counters.items():
+        dimensions = dict(zip(lead_consts.COUNTER_DIMENSIONS, key))
+        objects.append(lead_model.DashboardCounter(**dimensions, **values))
+    lead_model.DashboardCounter.objects.bulk_create(objects, batch_size=1000)
+    return len(objects)
+
+
+STAGE_ANALYTICS_SQL = """
+WITH changes AS (
+    SELECT
+        t.lead_id_id AS lead_id,
+        t.to_stage_id AS stage_id,
+        t.changed_on,
+        LAG(t.to_stage_id) OVER lead_history AS previous_stage_id,
+        ROW_NUMBER() OVER lead_history AS position
+    FROM {transition} t
+    WHERE t.lead_id_id IN ({leads})
+    WINDOW lead_history AS (PARTITION BY t.lead_id_id ORDER BY t.changed_on, t.id)
+),
+periods AS (
+    SELECT
+        lead_id,
+        stage_id,
+        changed_on AS entered_on,
+        LEAD(changed_on) OVER (
+            PARTITION BY lead_id ORDER BY changed_on) AS left_on
+    FROM changes
+    WHERE position = 1 OR stage_id IS DISTINCT FROM previous_stage_id
+)
+SELECT
+    s.id,
+    s.name,
+    COUNT(DISTINCT p.lead_id) AS leads,
+    COUNT(*) AS periods,
+    COUNT(p.left_on) AS exited,
+    percentile_cont(0.5) WITHIN GROUP (
+        ORDER BY EXTRACT(EPOCH FROM p.left_on - p.entered_on)) AS median_dwell,
+    percentile_cont(0.9) WITHIN GROUP (
+        ORDER BY EXTRACT(EPOCH FROM p.left_on - p.entered_on)) AS p90_dwell,
+    COUNT(DISTINCT p.lead_id) FILTER (WHERE l.status = %s) AS won,
+    COUNT(DISTINCT p.lead_id) FILTER (WHERE l.status = %s) AS lost
+FROM periods p
+JOIN {stage} s ON s.id = p.stage_id
+JOIN {lead} l ON l.id = p.lead_id
+GROUP BY s.id, s.name, s.weightage
+ORDER BY s.weightage, s.name
+"""
+
+
+def get_stage_analytics(params=None):
+    """
+    Function to get the time spent by leads in each stage.
+
+    The stage periods of each lead are found from the transition history
+    with window functions, a status change without a stage change does
+    not split a period. Dwell times are of the periods the leads already
+    left, in seconds.
+
+    Input Params:
+        params(dict): params from get_dashboard_params.
+    Returns:
+        (list): per stage dwell time percentiles and conversion rates.
+    """
+    params = params or {}
+    leads_sql, leads_params = (
+        lead_model.Lead.objects.filter(get_lead_filter(params))
+        .order_by().values("id").query.sql_with_params()
+    )
+    sql = STAGE_ANALYTICS_SQL.format(
+        transition=lead_model.LeadStageTransition._meta.db_table,
+        stage=lead_model.Stage._meta.db_table,
+        lead=lead_model.Lead._meta.db_table,
+        leads=leads_sql,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, list(leads_params) + [
+            lead_consts.StatusChoice.WON, lead_consts.StatusChoice.LOST])
+        columns = [column[0] for column in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    data = []
+    for row in rows:
+        data.append({
+            "stage": comm_lib.encode(row["id"]),
+            "name": row["name"],
+            "leads": row["leads"],
+            "median_dwell": row["median_dwell"],
+            "p90_dwell": row["p90_dwell"],
+            "exit_rate": comm_lib.percentage(row["exited"], row["periods"]),
+            "won_rate": comm_lib.percentage(row["won"], row["leads"]),
+            "lost_rate": comm_lib.percentage(row["lost"], row["leads"]),
+        })
+    return data
+
+
+def get_day_start(day):
+    """Function to get the aware start time of a day."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+@transaction.atomic
+def rebuild_lead_rollups(start, end):
+    """
+    Function to replace the daily rollups of a range of days.
+
+    Input Params:
+        start(date): first day to rebuild.
+        end(date): day after the last day to rebuild.
+    Returns:
+        (int): number of rollups created.
+    """
+    start_time, end_time = get_day_start(start), get_day_start(end)
+    rollups = []
+
+    created = (
+        lead_model.Lead.objects.filter(
+            created_on__gte=start_time, created_on__lt=end_time)
+        .order_by()
+        .annotate(day=TruncDate("created_on"))
+        .values(
+            "day", "lead_source", "preset_id", "current_stage", "status")
+        .annotate(leads=Count("id"), revenue=Coalesce(Sum("revenue"), 0.0))
+    )
+    for row in created:
+        rollups.append(lead_model.LeadDailyRollup(
+            day=row["day"],
+            event=lead_consts.RollupEventChoice.CREATED,
+            lead_source=row["lead_source"],
+            preset_id_id=row["preset_id"],
+            stage_id=row["current_stage"],
+            status=row["status"],
+            leads=row["leads"],
+            revenue=row["revenue"],
+        ))
+
+    outcomes = (
+        lead_model.LeadStageTransition.objects.filter(
+            changed_on__gte=start_time, changed_on__lt=end_time,
+            to_status__in=[
+                lead_consts.StatusChoice.WON, lead_consts.StatusChoice.LOST])
+        .exclude(from_status=F("to_status"))
+        .order_by()
+        .annotate(day=TruncDate("changed_on"))
+        .values(
+            "day", "lead_id__lead_source", "lead_id__preset_id",
+            "to_stage", "to_status")
+        .annotate(
+            leads=Count("lead_id", distinct=True),
+            revenue=Coalesce(Sum("lead_id__revenue"), 0.0))
+    )
+    for row in outcomes:
+        won = row["to_status"] == lead_consts.StatusChoice.WON
+        rollups.append(lead_model.LeadDailyRollup(
+            day=row["day"],
+            event=(
+                lead_consts.RollupEventChoice.WON if won
+                else lead_consts.RollupEventChoice.LOST),
+            lead_source=row["lead_id__lead_source"],
+            preset_id_id=row["lead_id__preset_id"],
+            stage_id=row["to_stage"],
+            status=row["to_status"],
+            leads=row["leads"],
+            revenue=row["revenue"],
+        ))
+
+    lead_model.LeadDailyRollup.objects.filter(
+        day__gte=start, day__lt=end).delete()
+    lead_model.LeadDailyRollup.objects.bulk_create(rollups, batch_size=1000)
+    return len(rollups)
+
+
+def record_deleted_lead_days(lead_ids):
+    """
+    Function to save the rollup days of leads about to be deleted.
+
+    The creation day of the leads and the days they were won or lost are
+    saved as RollupRefreshDay, to be refreshed by refresh_lead_rollups.
+
+    Input Params:
+        lead_ids(list): ids of the leads to be deleted.
+    """
+    days = set(
+        lead_model.Lead.objects.filter(id__in=lead_ids)
+        .order_by()
+        .annotate(day=TruncDate("created_on"))
+        .values_list("day", flat=True)
+        .distinct()
+    )
+    days |= set(
+        lead_model.LeadStageTransition.objects.filter(
+            lead_id__in=lead_ids,
+            to_status__in=[
+                lead_consts.StatusChoice.WON, lead_consts.StatusChoice.LOST])
+        .order_by()
+        .annotate(day=TruncDate("changed_on"))
+        .values_list("day", flat=True)
+        .distinct()
+    )
+    lead_model.RollupRefreshDay.objects.bulk_create(
+        [lead_model.RollupRefreshDay(day=day) for day in days],
+        ignore_conflicts=True)
+
+
+def refresh_lead_rollups(days=lead_consts.ROLLUP_REFRESH_DAYS):
+    """
+    Function to refresh the rollups of the days changed recently.
+
+    The last days are always refreshed, along with the creation days of
+    the leads updated and the days of the transitions made in that period,
+    and the days of the deleted leads saved by record_deleted_lead_days.
+
+    Input Params:
+        days(int): number of days of changes to process.
+    Returns:
+        (list): refreshed days.
+    """
+    today = timezone.localdate()
+    cutoff = get_day_start(today - timedelta(days=days))
+    changed_days = {today - timedelta(days=day) for day in range(days + 1)}
+    changed_days |= set(
+        lead_model.Lead.objects.filter(updated_on__gte=cutoff)
+        .order_by()
+        .annotate(day=TruncDate("created_on"))
+        .values_list("day", flat=True)
+        .distinct()
+    )
+    changed_days |= set(
+        lead_model.LeadStageTransition.objects.filter(changed_on__gte=cutoff)
+        .order_by()
+        .annotate(day=TruncDate("changed_on"))
+        .values_list("day", flat=True)
+        .distinct()
+    )
+    refresh_days = dict(
+        lead_model.RollupRefreshDay.objects.values_list("id", "day"))
+    changed_days |= set(refresh_days.values())
+    changed_days = sorted(changed_days)
+    for day in changed_days:
+        rebuild_lead_rollups(day, day + timedelta(days=1))
+    lead_model.RollupRefreshDay.objects.filter(
+        id__in=list(refresh_days)).delete()
+    return changed_days
+
+
+def get_trend(params):
+    """
+    Function to get the daily created, won and lost leads from the rollups.
+
+    Input Params:
+        params(dict): params from get_dashboard_params, the range defaults
+            to the last TREND_DEFAULT_DAYS days.
+    Returns:
+        (list): counts and revenue of each day with events.
+    """
+    end = timezone.localdate()
+    if "to" in params:
+        end = timezone.localdate(comm_lib.unix_to_datetime(params["to"]))
+    start = end - timedelta(days=lead_consts.TREND_DEFAULT_DAYS)
+    if "from" in params:
+        start = timezone.localdate(comm_lib.unix_to_datetime(params["from"]))
+    query = Q(day__gte=start, day__lte=end)
+    if "preset_id" in params:
+        query &= Q(preset_id=params["preset_id"])
+    if "lead_source" in params:
+        query &= Q(lead_source=params["lead_source"])
+
+    events = lead_consts.RollupEventChoice
+    days = (
+        lead_model.LeadDailyRollup.objects.filter(query)
+        .order_by()
+        .values("day")
+        .annotate(
+            created=Coalesce(Sum("leads", filter=Q(event=events.CREATED)), 0),
+            won=Coalesce(Sum("leads", filter=Q(event=events.WON)), 0),
+            lost=Coalesce(Sum("leads", filter=Q(event=events.LOST)), 0),
+            revenue_created=Coalesce(
+                Sum("revenue", filter=Q(event=events.CREATED)), 0.0),
+            revenue_won=Coalesce(
+                Sum("revenue", filter=Q(event=events.WON)), 0.0),
+        )
+        .order_by("day")
+    )
+    return [dict(day, day=day["day"].isoformat()) for day in days]
+
+
+def get_cohorts(params=None):
+    """
+    Function to get the leads by creation month and current status/stage.
+
+    Both matrices are pivoted from a single query grouped by month, status
+    and stage.
+
+    Input Params:
+        params(dict): params from get_dashboard_params.
+    Returns:
+        (dict): by_status and by_stage rows of each month.
+    """
+    params = params or {}
+    cells = (
+        lead_model.Lead.objects.filter(get_lead_filter(params))
+        .order_by()
+        .annotate(month=TruncMonth("created_on"))
+        .values("month", "status", stage=F("current_stage__name"))
+        .annotate(count=Count("id"))
+        .order_by("month")
+    )
+    statuses = {
+        status.value: status.name for status in lead_consts.StatusChoice}
+    by_status, by_stage = {}, {}
+    for cell in cells:
+        month = cell["month"].strftime("%Y-%m")
+        status_row = by_status.setdefault(
+            month, {"month": month, "total": 0, "counts": {}})
+        stage_row = by_stage.setdefault(
+            month, {"month": month, "total": 0, "counts": {}})
+        status = statuses.get(cell["status"], cell["status"])
+        status_row["counts"][status] = (
+            status_row["counts"].get(status, 0) + cell["count"])
+        stage_row["counts"][cell["stage"]] = (
+            stage_row["counts"].get(cell["stage"], 0) + cell["count"])
+        status_row["total"] += cell["count"]
+        stage_row["total"] += cell["count"]
+    return {
+        "by_status": list(by_status.values()),
+        "by_stage": list(by_stage.values()),
+    }
+
+
+def get_forecast(params=None):
+    """
+    Function to get the expected revenue of the active leads.
+
+    The expected revenue of a lead is its revenue weighted by its win
+    possibility, which is stored between 0 and 1. It is summed in the
+    database per stage, per preset and per month of the expected close
+    date.
+
+    Input Params:
+        params(dict): params from get_dashboard_params.
+    Returns:
+        (dict): by_stage, by_preset and by_month forecast rows.
+    """
+    params = params or {}
+    leads = lead_model.Lead.objects.filter(
+        get_lead_filter(params),
+        status=lead_consts.StatusChoice.ACTIVE).order_by()
+    revenue = Coalesce(F("revenue"), Value(0.0))
+    # expected_revenue comes before the revenue alias, which would shadow
+    # the revenue field in its expression.
+    aggregates = {
+        "leads": Count("id"),
+        "expected_revenue": Coalesce(Sum(
+            revenue * F("possibility"),
+            output_field=FloatField()), 0.0),
+        "revenue": Coalesce(Sum(revenue), 0.0),
+    }
+
+    by_stage = (
+        leads.values(stage=F("current_stage__name"))
+        .annotate(**aggregates)
+        .order_by("-expected_revenue")
+    )
+    by_preset = (
+        leads.values(preset=F("preset_id__name"))
+        .annotate(**aggregates)
+        .order_by("-expected_revenue")
+    )
+    by_month = (
+        leads.annotate(month=TruncMonth("expected_close_on"))
+        .values("month")
+        .annotate(**aggregates)
+        .order_by("month")
+    )
+    return {
+        "by_stage": list(by_stage),
+        "by_preset": list(by_preset),
+        "by_month": [
+            dict(row, month=row["month"].strftime("%Y-%m")
+                 if row["month"] else None)
+            for row in by_month],
+    }
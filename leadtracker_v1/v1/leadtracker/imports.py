@@ -0,0 +1,231 @@
+"""
+Import of leads from Excel workbooks.
+
+The rows are streamed from the workbook in chunks, each chunk is
+validated with the lead serializer and written with bulk queries in its
+own transaction. The invalid rows of a chunk are reported and skipped,
+its valid rows are written. A row with the encoded id or the pipedrive
+url of an existing lead updates it, so importing a sheet again does not
+duplicate its leads.
+"""
+
+import datetime
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from common import excel
+from common import library as comm_lib
+
+from v1.accounts.models import ProjectUser
+from v1.leadtracker import models as lead_model
+from v1.leadtracker import constants as lead_consts
+from v1.leadtracker import functions as lead_functions
+from v1.leadtracker.serializers import lead as lead_serializer
+
+
+def get_organizations(values):
+    """
+    Function to get the organizations of a chunk, by id or name.
+
+    Input Params:
+        values(set): encoded ids or names of the organizations.
+    Returns:
+        (dict): organizations by the values referring to them.
+    """
+    ids = {value: comm_lib.decode(value) for value in values}
+    organizations = lead_model.Organization.objects.filter(
+        Q(id__in=[pk for pk in ids.values() if pk]) | Q(name__in=values)
+    ).order_by("id")
+    by_id = {}
+    by_name = {}
+    for organization in organizations:
+        by_id[organization.id] = organization
+        by_name.setdefault(organization.name, organization)
+    return {
+        value: by_id.get(ids[value]) or by_name.get(value)
+        for value in values
+        if by_id.get(ids[value]) or by_name.get(value)
+    }
+
+
+def get_existing_leads(rows):
+    """
+    Function to get the leads updated by the rows of a chunk.
+
+    Input Params:
+        rows(list): prepared rows of the chunk.
+    Returns:
+        (tuple): leads by decoded id and by pipedrive url.
+    """
+    ids = [comm_lib.decode(row["id"]) for row in rows if row.get("id")]
+    urls = [row["pipedrive"] for row in rows if row.get("pipedrive")]
+    by_id = lead_model.Lead.objects.in_bulk([pk for pk in ids if pk])
+    by_url = {}
+    for lead in lead_model.Lead.objects.filter(
+            pipedrive__in=urls).order_by("id"):
+        by_url.setdefault(lead.pipedrive, lead)
+    return by_id, by_url
+
+
+def prepare_row(row, date_fields):
+    """
+    Function to convert the cells of a row to the serializer input.
+
+    Input Params:
+        row(dict): cells of the row by column.
+        date_fields(list): names of the date fields of the serializer.
+    Returns:
+        (dict): values of the import columns.
+    """
+    data = {}
+    for name in lead_consts.LEAD_IMPORT_COLUMNS:
+        value = row.get(name)
+        if value is None:
+            continue
+        if name in date_fields and isinstance(value, datetime.datetime):
+            value = value.date()
+        elif isinstance(value, str):
+            value = value.strip()
+        elif name in ("id", "organization", "pipedrive"):
+            value = str(value)
+        data[name] = value
+    return data
+
+
+def validate_chunk(chunk, result):
+    """
+    Function to validate the rows of a chunk.
+
+    The organizations and the leads to update are loaded with one query
+    each for the whole chunk.
+
+    Input Params:
+        chunk(list): row numbers and rows.
+        result(dict): import result, the errors are added to it.
+    Returns:
+        (tuple): validated data of the new leads, and updated leads with
+            their validated data.
+    """
+    create_serializer = lead_serializer.LeadSerializer()
+    update_serializer = lead_serializer.LeadSerializer(partial=True)
+    date_fields = [
+        name for name, field in create_serializer.fields.items()
+        if isinstance(field, serializers.DateField)]
+    rows = [(number, prepare_row(row, date_fields)) for number, row in chunk]
+
+    organizations = get_organizations(
+        {row["organization"] for _, row in rows if row.get("organization")})
+    by_id, by_url = get_existing_leads([row for _, row in rows])
+
+    creates = []
+    updates = []
+    seen = set()
+    for number, row in rows:
+        if row.get("organization") in organizations:
+            row["organization"] = organizations[row["organization"]]
+        instance = None
+        if row.get("id"):
+            instance = by_id.get(comm_lib.decode(row["id"]))
+            if not instance:
+                add_error(result, number, {
+                    "id": ["Invalid pk - object does not exist."]})
+                continue
+        elif row.get("pipedrive"):
+            instance = by_url.get(row["pipedrive"])
+        key = instance.id if instance else row.get("pipedrive")
+        if key and key in seen:
+            add_error(result, number, {
+                "id": ["Lead is repeated in the sheet."]})
+            continue
+        if key:
+            seen.add(key)
+
+        serializer = update_serializer if instance else create_serializer
+        serializer.instance = instance
+        row.pop("id", None)
+        try:
+            data = serializer.run_validation(row)
+        except ValidationError as e:
+            add_error(result, number, e.detail)
+            continue
+        if instance:
+            updates.append((instance, data))
+        else:
+            creates.append(data)
+    return creates, updates
+
+
+def add_error(result, number, errors):
+    """Function to count an invalid row, with the first errors."""
+    result["failed"] += 1
+    if len(result["errors"]) < lead_consts.LEAD_IMPORT_MAX_ERRORS:
+        result["errors"].append({"row": number, "errors": errors})
+
+
+@transaction.atomic
+def write_chunk(creates, updates, user=None):
+    """
+    Function to write the valid rows of a chunk.
+
+    Input Params:
+        creates(list): validated data of the new leads.
+        updates(list): updated leads with their validated data.
+        user(obj): user importing the leads.
+    """
+    if creates:
+        leads = [
+            lead_model.Lead(**data, creator=user, updater=user)
+            for data in creates]
+        lead_model.Lead.objects.bulk_create(
+            leads, batch_size=lead_consts.LEAD_IMPORT_CHUNK_SIZE)
+        lead_functions.record_bulk_lead_writes(
+            [lead.id for lead in leads], creator=user)
+    if updates:
+        lead_ids = [lead.id for lead, _ in updates]
+        snapshot = lead_functions.get_bulk_lead_snapshot(lead_ids)
+        now = timezone.now()
+        fields = {"updater", "updated_on"}
+        for lead, data in updates:
+            for attr, value in data.items():
+                setattr(lead, attr, value)
+            lead.updater = user
+            lead.updated_on = now
+            fields.update(data)
+        lead_model.Lead.objects.bulk_update(
+            [lead for lead, _ in updates], list(fields),
+            batch_size=lead_consts.LEAD_IMPORT_CHUNK_SIZE)
+        lead_functions.record_bulk_lead_writes(
+            lead_ids, snapshot, creator=user)
+
+
+def import_leads(file, user_id=None, chunk_size=None, progress=None):
+    """
+    Function to import the leads of the first sheet of a workbook.
+
+    Input Params:
+        file(obj): path or file object of the workbook.
+        user_id(int): id of the user importing the leads.
+        chunk_size(int): rows validated and written together.
+        progress(callable): called with the result after each chunk.
+    Returns:
+        (dict): processed, created, updated and failed rows, with the
+            errors of the first failed rows.
+    """
+    user = ProjectUser.objects.filter(id=user_id).first() if user_id else None
+    result = {
+        "processed": 0, "created": 0, "updated": 0, "failed": 0,
+        "errors": []}
+    for chunk in excel.iter_row_chunks(
+            file, chunk_size or lead_consts.LEAD_IMPORT_CHUNK_SIZE):
+        creates, updates = validate_chunk(chunk, result)
+        write_chunk(creates, updates, user)
+        result["processed"] += len(chunk)
+        result["created"] += len(creates)
+        result["updated"] += len(updates)
+        if progress:
+            progress(result)
+    return result
@@ -0,0 +1,61 @@
+"""Command to rebuild the history of the daily lead rollups."""
+
+from datetime import datetime
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from v1.leadtracker import models as lead_models
+from v1.leadtracker import functions as lead_functions
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the daily lead rollups in chunks of days.
+
+    Each chunk is rebuilt in its own transaction, so the command can be
+    stopped and started again from a later day.
+    """
+
+    help = "Rebuild the daily lead rollups from the leads and transitions."
+
+    def add_arguments(self, parser):
+        """Arguments of the command."""
+        parser.add_argument(
+            "--from", dest="start",
+            help="First day to rebuild (YYYY-MM-DD), defaults to the "
+                 "creation day of the first lead.")
+        parser.add_argument(
+            "--chunk-days", type=int, default=30,
+            help="Number of days rebuilt at a time.")
+
+    def handle(self, *args, **options):
+        """Rebuild each chunk of days up to today."""
+        if options["start"]:
+            try:
+                start = datetime.strptime(options["start"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("--from should be in YYYY-MM-DD format.")
+        else:
+            first = lead_models.Lead.objects.aggregate(
+                first=Min("created_on"))["first"]
+            if not first:
+                self.stdout.write("No leads to rollup.")
+                return
+            start = timezone.localdate(first)
+
+        end = timezone.localdate() + timedelta(days=1)
+        chunk = timedelta(days=options["chunk_days"])
+        total = 0
+        while start < end:
+            chunk_end = min(start + chunk, end)
+            created = lead_functions.rebuild_lead_rollups(start, chunk_end)
+            total += created
+            self.stdout.write("Rebuilt %s to %s: %d rollups." % (
+                start, chunk_end - timedelta(days=1), created))
+            start = chunk_end
+        self.stdout.write(self.style.SUCCESS(
+            "Rebuilt %d daily lead rollups." % total))
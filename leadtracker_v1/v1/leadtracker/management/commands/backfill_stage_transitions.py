@@ -0,0 +1,33 @@
+"""Command to start the stage history of the leads without one."""
+
+from django.core.management.base import BaseCommand
+
+from v1.leadtracker import models as lead_models
+
+
+class Command(BaseCommand):
+    """
+    Add the initial transition of the leads created before the history.
+
+    The current stage and status are recorded at the creation time of the
+    lead, as the earlier changes are not known.
+    """
+
+    help = "Add the initial stage transition of leads without history."
+
+    def handle(self, *args, **options):
+        """Create the missing transitions in batches."""
+        leads = lead_models.Lead.objects.filter(
+            stage_transitions__isnull=True).order_by().values(
+            "id", "current_stage_id", "status", "created_on")
+        transitions = [
+            lead_models.LeadStageTransition(
+                lead_id_id=lead["id"],
+                to_stage_id=lead["current_stage_id"],
+                to_status=lead["status"],
+                changed_on=lead["created_on"],
+            ) for lead in leads.iterator()]
+        lead_models.LeadStageTransition.objects.bulk_create(
+            transitions, batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(
+            "Added %d stage transitions." % len(transitions)))
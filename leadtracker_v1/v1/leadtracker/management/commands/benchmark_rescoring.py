@@ -0,0 +1,73 @@
+"""Command to benchmark the vectorized answer rescoring."""
+
+from time import perf_counter
+
+from django.db import transaction
+from django.core.management.base import BaseCommand
+
+from v1.leadtracker import models as lead_models
+from v1.leadtracker import scoring
+
+
+class Command(BaseCommand):
+    """
+    Time the rescoring of the leads end to end, by phase.
+
+    The leads are rescored with rescore_lead_chunk, loading the answers,
+    computing the scores and writing them back. The stored scores are
+    cleared first, so every answer and lead is written like after a
+    change of the question credits. Each run is rolled back, the data is
+    not changed.
+    """
+
+    help = "Benchmark the rescoring of the answers of the leads."
+
+    def add_arguments(self, parser):
+        """Arguments of the command."""
+        parser.add_argument(
+            "--leads", type=int, default=50000,
+            help="Number of leads rescored, by id.")
+        parser.add_argument(
+            "--chunk-size", type=int, default=5000,
+            help="Number of leads rescored per transaction.")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument(
+            "--keep-scores", action="store_true",
+            help="Keep the stored scores, to time a rescore without "
+                 "changes.")
+
+    def handle(self, *args, **options):
+        """Rescore the leads in rolled back runs and print the timings."""
+        lead_ids = list(lead_models.Lead.objects.order_by("id").values_list(
+            "id", flat=True)[:options["leads"]])
+        chunk_size = options["chunk_size"]
+        runs = []
+        for _ in range(options["repeat"]):
+            timings = {}
+            with transaction.atomic():
+                if not options["keep_scores"]:
+                    self.clear_scores(lead_ids)
+                start = perf_counter()
+                answers = 0
+                for index in range(0, len(lead_ids), chunk_size):
+                    answers += scoring.rescore_lead_chunk(
+                        lead_ids[index:index + chunk_size], timings=timings)
+                timings["total"] = perf_counter() - start
+                transaction.set_rollback(True)
+            runs.append(timings)
+
+        self.stdout.write("Rescored %d answers of %d leads." % (
+            answers, len(lead_ids)))
+        for phase in ("load", "compute", "write", "total"):
+            values = [run.get(phase, 0) for run in runs]
+            self.stdout.write("%s: best %.1f ms, mean %.1f ms." % (
+                phase, min(values) * 1000,
+                sum(values) / len(values) * 1000))
+
+    @staticmethod
+    def clear_scores(lead_ids):
+        """Clear the stored scores of the leads and their answers."""
+        for model in scoring.ANSWER_MODELS:
+            model.objects.filter(lead_id__in=lead_ids).update(score=-1)
+        lead_models.Lead.objects.filter(id__in=lead_ids).update(
+            points_secured=-1)
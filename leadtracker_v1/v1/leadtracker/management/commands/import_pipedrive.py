@@ -0,0 +1,59 @@
+"""Command to import Pipedrive export files into the leadtracker."""
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from v1.accounts.models import ProjectUser
+from v1.leadtracker import pipedrive
+
+
+class Command(BaseCommand):
+    """
+    Import the organizations, persons and deals exported from Pipedrive.
+
+    The exports are CSV files of the web app or JSON files of the API.
+    Importing them again only writes the records changed in Pipedrive.
+    """
+
+    help = "Import Pipedrive export files into the leadtracker."
+
+    def add_arguments(self, parser):
+        """Arguments of the command."""
+        parser.add_argument(
+            "--domain", required=True,
+            help="Company domain of the Pipedrive account, for deal links.")
+        parser.add_argument(
+            "--organizations", default=None,
+            help="Path of the organizations export.")
+        parser.add_argument(
+            "--persons", default=None,
+            help="Path of the persons export.")
+        parser.add_argument(
+            "--deals", default=None,
+            help="Path of the deals export.")
+        parser.add_argument(
+            "--user", type=int, default=None,
+            help="Id of the user recorded as creator of the objects.")
+
+    def handle(self, *args, **options):
+        """Import the exports and report the records of each."""
+        if not any(
+                options[name] for name in ("organizations", "persons", "deals")):
+            raise CommandError(
+                "Give at least one of --organizations, --persons, --deals.")
+        user = None
+        if options["user"]:
+            user = ProjectUser.objects.filter(id=options["user"]).first()
+            if not user:
+                raise CommandError("User %s does not exist." % options["user"])
+        result = pipedrive.import_pipedrive(
+            options["domain"], options["organizations"], options["persons"],
+            options["deals"], user)
+        for name in ("organizations", "persons", "deals"):
+            self.stdout.write("%s: %s" % (name, ", ".join(
+                "%d %s" % (count, key)
+                for key, count in result[name].items())))
+        for error in result["errors"]:
+            self.stdout.write(self.style.WARNING(
+                "%(kind)s %(id)s: %(error)s" % error))
+        self.stdout.write(self.style.SUCCESS("Imported the Pipedrive exports."))
@@ -0,0 +1,49 @@
+"""Command to rebuild the dashboard counters of the leads."""
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from v1.leadtracker import functions as lead_functions
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the dashboard counters from a live recomputation.
+
+    With --verify the stored counters are only compared with the live
+    values and the drifted counters are listed.
+    """
+
+    help = "Rebuild or verify the dashboard counters of the leads."
+
+    def add_arguments(self, parser):
+        """Arguments of the command."""
+        parser.add_argument(
+            "--verify", action="store_true",
+            help="Only report the drift, without rebuilding.")
+
+    def handle(self, *args, **options):
+        """Compare the counters and rebuild them if asked."""
+        live = lead_functions.get_live_counters()
+        stored = lead_functions.get_stored_counters()
+        drifted = sorted(
+            (key for key in set(live) | set(stored)
+             if live.get(key) != stored.get(key)),
+            key=str)
+        for key in drifted:
+            self.stdout.write(
+                "Drift %s: stored %s, live %s" % (
+                    key, stored.get(key), live.get(key)))
+
+        if options["verify"]:
+            if drifted:
+                raise CommandError(
+                    "%d dashboard counters drifted." % len(drifted))
+            self.stdout.write(self.style.SUCCESS(
+                "Dashboard counters are in sync."))
+            return
+
+        created = lead_functions.rebuild_dashboard_counters(live)
+        self.stdout.write(self.style.SUCCESS(
+            "Rebuilt %d dashboard counters, %d had drifted." % (
+                created, len(drifted))))
@@ -0,0 +1,31 @@
+"""Command to recompute the answer scores and lead win possibility."""
+
+from django.core.management.base import BaseCommand
+
+from v1.leadtracker import functions as lead_functions
+from v1.leadtracker import scoring
+
+
+class Command(BaseCommand):
+    """
+    Recompute the stored scores from the option points and question credit.
+
+    Required once for answers stored before the scores were maintained, and
+    after editing points or credits outside the admin.
+    """
+
+    help = "Recompute the answer scores and the lead win possibility."
+
+    def add_arguments(self, parser):
+        """Arguments of the command."""
+        parser.add_argument(
+            "--chunk-size", type=int, default=5000,
+            help="Number of leads rescored at a time.")
+
+    def handle(self, *args, **options):
+        """Rescore all the leads, then rebuild the dashboard counters."""
+        result = scoring.rescore_answers(chunk_size=options["chunk_size"])
+        lead_functions.rebuild_dashboard_counters()
+        self.stdout.write(self.style.SUCCESS(
+            "Rescored %(leads)d leads, %(answers)d answer scores changed."
+            % result))
@@ -0,0 +1,37 @@
+"""Command to rebuild the full text search vectors of the leads."""
+
+from django.db.models import Max
+from django.core.management.base import BaseCommand
+
+from v1.leadtracker import models as lead_models
+from v1.leadtracker import search as lead_search
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the search vectors of all the leads.
+
+    Required once for the leads created before the vectors were
+    maintained, and after editing the names outside the app.
+    """
+
+    help = "Rebuild the full text search vectors of the leads."
+
+    def add_arguments(self, parser):
+        """Arguments of the command."""
+        parser.add_argument(
+            "--chunk-size", type=int, default=5000,
+            help="Number of lead ids updated at a time.")
+
+    def handle(self, *args, **options):
+        """Update the leads in ranges of ids."""
+        chunk_size = options["chunk_size"]
+        last_id = lead_models.Lead.objects.aggregate(
+            last_id=Max("id"))["last_id"] or 0
+        updated = 0
+        for start in range(0, last_id, chunk_size):
+            updated += lead_search.update_search_vectors(
+                lead_models.Lead.objects.filter(
+                    id__gt=start, id__lte=start + chunk_size))
+        self.stdout.write(self.style.SUCCESS(
+            "Rebuilt the search vectors of %d leads." % updated))
@@ -0,0 +1,40 @@
+"""Command to write a columnar snapshot of the leadtracker tables."""
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from v1.leadtracker import snapshots
+
+
+class Command(BaseCommand):
+    """
+    Write a Parquet snapshot of the leadtracker tables for analytics.
+
+    The rows updated since the previous snapshot are written, or all the
+    rows with --full.
+    """
+
+    help = "Write a Parquet snapshot of the leadtracker tables."
+
+    def add_arguments(self, parser):
+        """Arguments of the command."""
+        parser.add_argument(
+            "--path", default=None,
+            help="Folder of the snapshots, SNAPSHOT_ROOT by default.")
+        parser.add_argument(
+            "--full", action="store_true",
+            help="Write all the rows instead of the updated ones.")
+        parser.add_argument(
+            "--batch-size", type=int, default=snapshots.SNAPSHOT_BATCH_SIZE,
+            help="Number of rows read and written at a time.")
+
+    def handle(self, *args, **options):
+        """Write the snapshot and report the rows of each table."""
+        snapshot = snapshots.write_snapshot(
+            options["path"], options["full"], options["batch_size"])
+        if snapshot is None:
+            raise CommandError("Another snapshot is being written.")
+        for table, rows in snapshot["rows"].items():
+            self.stdout.write("%s: %d rows" % (table, rows))
+        self.stdout.write(self.style.SUCCESS(
+            "Wrote the snapshot %s." % snapshot["id"]))
@@ -1,7 +1,11 @@
 """ Models for leadtracker """
 
 from django.db import models
+from django.db import transaction
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 from common.models import AbstractBaseModel
 from common.library import get_file_path
@@ -10,6 +14,18 @@ from v1.leadtracker import constants as lead_consts
 # Create your models here.
 
 
+def get_answer_score(answer):
+    """
+    Function to get the score of a stage or general answer.
+
+    The score is the points of the selected option weighted by the
+    credit of the question.
+    """
+    if not answer.option_id or not answer.question_id:
+        return 0
+    return answer.option_id.points * answer.question_id.credit
+
+
 class Tag(AbstractBaseModel):
     """
     Model to save lead tag details.
@@ -86,7 +102,18 @@ class Organization(AbstractBaseModel):
         default='', blank=True, null=True,
         
     )
-    
+
+    class Meta(AbstractBaseModel.Meta):
+        """Meta class for the above model."""
+
+        indexes = [
+            models.Index(
+                fields=['-created_on', '-id'], name='organization_created_id_idx'),
+            GinIndex(
+                fields=['name'], opclasses=['gin_trgm_ops'],
+                name='organization_name_trgm_idx'),
+        ]
+
     def __str__(self):
         """String format of model object"""
         return f'{self.name}'
@@ -103,6 +130,15 @@ class Lead(AbstractBaseModel):
         revenue(float)   : Revenue of Lead.
         lead_source(char): Source of lead.
         is_active(int)   : True if lead is active(default=True)
+        points_secured(int)   : Sum of the scores of the lead answers.
+        credit_registered(int): Maximum score of the lead answers, the
+            question credits * MAX_OPTION_POINTS.
+        possibility(float)    : Win possibility of the lead between 0 and
+            1, maintained from points_secured / credit_registered on
+            answer writes.
+        expected_close_on(date): Expected closing date of the lead.
+        search_vector(tsvector): Words of the lead, its organization,
+            contacts and tags, maintained by the search module.
 
     Inherited Attribs:
         preset_id(obj): Lead current Stage Preset.
@@ -116,11 +152,11 @@ class Lead(AbstractBaseModel):
     preset_id = models.ForeignKey(
         'leadtracker.StagePreset', on_delete=models.CASCADE,
         related_name='leads', verbose_name=_('Preset ID'),
-        blank=True, null=True, default=None)
+        blank=True, null=True, default=None, db_index=False)
     organization = models.ForeignKey(
         'leadtracker.Organization', on_delete=models.CASCADE, 
         related_name='leads',verbose_name=_('Organization'), 
-        blank=True, null=True, default='')
+        blank=True, null=True, default='', db_index=False)
     name = models.CharField(
         max_length=100, verbose_name=_('Lead Name'))
     pipedrive = models.URLField(
@@ -141,12 +177,59 @@ class Lead(AbstractBaseModel):
     current_stage = models.ForeignKey(
         'leadtracker.Stage', on_delete=models.CASCADE,
         related_name='leads', verbose_name=_('Current Stage'),
-        blank=True, null=True, default='')
+        blank=True, null=True, default='', db_index=False)
+    points_secured = models.IntegerField(
+        default=0, verbose_name=_('Points Secured'))
+    credit_registered = models.IntegerField(
+        default=0, verbose_name=_('Credit Registered'))
+    possibility = models.FloatField(
+        default=0, db_index=True, verbose_name=_('Win Possibility'))
+    expected_close_on = models.DateField(
+        blank=True, null=True, default=None,
+        verbose_name=_('Expected Close Date'))
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta(AbstractBaseModel.Meta):
+        """Meta class for the above model."""
+
+        # preset_id, organization and current_stage lead an index below,
+        # so they have no index of their own.
+        indexes = [
+            models.Index(
+                fields=['status', '-possibility'],
+                name='lead_status_possibility_idx'),
+            models.Index(
+                fields=['-created_on', '-id'], name='lead_created_id_idx'),
+            models.Index(
+                fields=['status', '-created_on'],
+                name='lead_status_created_idx'),
+            models.Index(
+                fields=['lead_source', '-created_on'],
+                name='lead_source_created_idx'),
+            models.Index(
+                fields=['current_stage', 'status'],
+                name='lead_stage_status_idx'),
+            models.Index(
+                fields=['preset_id', 'status'],
+                name='lead_preset_status_idx'),
+            models.Index(
+                fields=['organization', '-created_on'],
+                name='lead_org_created_idx'),
+            models.Index(fields=['-updated_on'], name='lead_updated_idx'),
+            models.Index(fields=['revenue'], name='lead_revenue_idx'),
+            models.Index(fields=['team_size'], name='lead_team_size_idx'),
+            GinIndex(fields=['search_vector'], name='lead_search_vector_idx'),
+        ]
     
     def __str__(self):
         """String format of model object"""
         return f'{self.name,self.lead_source}'
 
+    def save(self, *args, **kwargs):
+        """Save in a transaction along with the dashboard counters."""
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class LeadTag(AbstractBaseModel):
     """
@@ -165,7 +248,17 @@ class LeadTag(AbstractBaseModel):
         verbose_name=_('Lead'), blank=True, null=True, default=None)
     tag_id = models.ForeignKey(
         'leadtracker.Tag', on_delete=models.CASCADE, related_name='tags',
-        verbose_name=_('Tag'), blank=True, null=True, default=None)
+        verbose_name=_('Tag'), blank=True, null=True, default=None,
+        db_index=False)
+
+    class Meta(AbstractBaseModel.Meta):
+        """Meta class for the above model."""
+
+        # Also the index of the tag_id foreign key.
+        indexes = [
+            models.Index(
+                fields=['tag_id', 'lead_id'], name='leadtag_tag_lead_idx'),
+        ]
     
     
 class Stage(AbstractBaseModel):
@@ -199,6 +292,14 @@ class Stage(AbstractBaseModel):
     weightage = models.SmallIntegerField(default=0)
     credit = models.SmallIntegerField(default=1)
 
+    class Meta(AbstractBaseModel.Meta):
+        """Meta class for the above model."""
+
+        indexes = [
+            models.Index(
+                fields=['-created_on', '-id'], name='stage_created_id_idx'),
+        ]
+
     def __str__(self):
         """String format of model object"""
         return f'{self.name}'
@@ -280,7 +381,7 @@ class StageAnswer(AbstractBaseModel):
 
     Attribs:
         is_active(int) : True if stage answer is active(default=True)
-        score(int) : Add score to each answers.
+        score(int) : option points * question credit, set on save.
 
     Inherited Attribs:
         option_id(obj): Option object of stage answer.
@@ -314,6 +415,42 @@ class StageAnswer(AbstractBaseModel):
     is_active = models.BooleanField(
         default=True, verbose_name=_('Is Active'))
     score = models.IntegerField(default=0)
+
+    class Meta(AbstractBaseModel.Meta):
+        """Meta class for the above model."""
+
+        indexes = [
+            models.Index(
+                fields=['-created_on', '-id'], name='stageanswer_created_id_idx'),
+        ]
+        # NULLs are distinct in unique constraints, the answers without a
+        # stage or an option are unique on their other fields.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['lead_id', 'stage_id', 'question_id', 'option_id'],
+                name='stageanswer_unique_option'),
+            models.UniqueConstraint(
+                fields=['lead_id', 'question_id', 'option_id'],
+                condition=models.Q(
+                    stage_id__isnull=True, option_id__isnull=False),
+                name='stageanswer_unique_option_no_stage'),
+            models.UniqueConstraint(
+                fields=['lead_id', 'stage_id', 'question_id'],
+                condition=models.Q(
+                    stage_id__isnull=False, option_id__isnull=True),
+                name='stageanswer_unique_no_option'),
+            models.UniqueConstraint(
+                fields=['lead_id', 'question_id'],
+                condition=models.Q(
+                    stage_id__isnull=True, option_id__isnull=True),
+                name='stageanswer_unique_no_stage_option'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Save in a transaction along with the lead score and counters."""
+        self.score = get_answer_score(self)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
     
 
 class GeneralAnswer(AbstractBaseModel):
@@ -322,7 +459,7 @@ class GeneralAnswer(AbstractBaseModel):
 
     Attribs:
         is_active(int) : True if stage answer is active(default=True)
-        score(int) : Add score to each answers.
+        score(int) : option points * question credit, set on save.
 
     Inherited Attribs:
         answer_id(obj): Answer object of stage answer.
@@ -347,6 +484,31 @@ class GeneralAnswer(AbstractBaseModel):
     is_active = models.BooleanField(
         default=True, verbose_name=_('Is Active'))
     score = models.IntegerField(default=0)
+
+    class Meta(AbstractBaseModel.Meta):
+        """Meta class for the above model."""
+
+        indexes = [
+            models.Index(
+                fields=['-created_on', '-id'], name='generalanswer_created_id_idx'),
+        ]
+        # NULLs are distinct in unique constraints, the answers without an
+        # option are unique on their other fields.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['lead_id', 'question_id', 'option_id'],
+                name='generalanswer_unique_option'),
+            models.UniqueConstraint(
+                fields=['lead_id', 'question_id'],
+                condition=models.Q(option_id__isnull=True),
+                name='generalanswer_unique_no_option'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Save in a transaction along with the lead score."""
+        self.score = get_answer_score(self)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
     
     
 class Contact(AbstractBaseModel):
@@ -382,7 +544,21 @@ class Contact(AbstractBaseModel):
     linkedin = models.URLField(
         max_length=1024, default='', blank=True, null=True,
         verbose_name=_('LinkedIn'))
-    
+
+    class Meta(AbstractBaseModel.Meta):
+        """Meta class for the above model."""
+
+        indexes = [
+            models.Index(
+                fields=['-created_on', '-id'], name='contact_created_id_idx'),
+            GinIndex(
+                fields=['name'], opclasses=['gin_trgm_ops'],
+                name='contact_name_trgm_idx'),
+            GinIndex(
+                fields=['email'], opclasses=['gin_trgm_ops'],
+                name='contact_email_trgm_idx'),
+        ]
+
     def __str__(self):
         """String format of model object"""
         return f'{self.name}'
@@ -420,4 +596,311 @@ class LeadContact(AbstractBaseModel):
     is_decision_maker = models.BooleanField(
         default=False, verbose_name=_('Is Decision Maker'))
     is_board_member = models.BooleanField(
-        default=False, verbose_name=_('Is Board Member'))
\ No newline at end of file
+        default=False, verbose_name=_('Is Board Member'))
+
+    class Meta(AbstractBaseModel.Meta):
+        """Meta class for the above model."""
+
+        indexes = [
+            models.Index(
+                fields=['-created_on', '-id'],
+                name='leadcontact_created_id_idx'),
+        ]
+
+
+class DashboardCounter(AbstractBaseModel):
+    """
+    Model to save the materialized dashboard counters.
+
+    Each row holds the counts of one combination of the lead dimensions,
+    it is updated in the same transaction as the lead and stage answer
+    writes, so the dashboard can be read without scanning the leads.
+    The preset and stage are not constrained, so that deleting them does
+    not conflict with the counter updates of their cascaded leads.
+
+    Attribs:
+        lead_source(int)   : Source of the leads.
+        status(int)        : Status of the leads.
+        leads(int)         : Number of leads.
+        answers(int)       : Number of stage answers of the leads.
+        points_secured(int): Sum of option points * question credit of
+            the stage answers of the leads.
+
+    Inherited Attribs:
+        preset_id(obj): Preset object of the leads.
+        current_stage(obj): Current stage object of the leads.
+        creator(obj): Creator user of the object.
+        updater(obj): Updater of the object.
+        created_on(datetime): Added date of the object.
+        updated_on(datetime): Last updated date of the object.
+    """
+    preset_id = models.ForeignKey(
+        'leadtracker.StagePreset', on_delete=models.DO_NOTHING,
+        related_name='dashboard_counters', verbose_name=_('Preset ID'),
+        blank=True, null=True, default=None, db_constraint=False)
+    lead_source = models.IntegerField(
+        default=lead_consts.LeadSourceChoice.LINKEDIN,
+        choices=lead_consts.LeadSourceChoice.choices(),
+        verbose_name=_('Lead Source'))
+    status = models.IntegerField(
+        default=lead_consts.StatusChoice.ACTIVE,
+        choices=lead_consts.StatusChoice.choices(),
+        verbose_name=_('Lead Status'))
+    current_stage = models.ForeignKey(
+        'leadtracker.Stage', on_delete=models.DO_NOTHING,
+        related_name='dashboard_counters', verbose_name=_('Current Stage'),
+        blank=True, null=True, default=None, db_constraint=False)
+    leads = models.IntegerField(default=0)
+    answers = models.IntegerField(default=0)
+    points_secured = models.IntegerField(default=0)
+
+    class Meta(AbstractBaseModel.Meta):
+        """Meta class for the above model."""
+
+        # Postgres does not compare nulls in unique constraints, so the
+        # counters without a preset or stage are unique by a constraint
+        # on their other dimensions.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['preset_id', 'lead_source', 'status', 'current_stage'],
+                name='dashboardcounter_unique_dimensions'),
+            models.UniqueConstraint(
+                fields=['lead_source', 'status', 'current_stage'],
+                condition=models.Q(
+                    preset_id__isnull=True, current_stage__isnull=False),
+                name='dashboardcounter_unique_no_preset'),
+            models.UniqueConstraint(
+                fields=['preset_id', 'lead_source', 'status'],
+                condition=models.Q(
+                    preset_id__isnull=False, current_stage__isnull=True),
+                name='dashboardcounter_unique_no_stage'),
+            models.UniqueConstraint(
+                fields=['lead_source', 'status'],
+                condition=models.Q(
+                    preset_id__isnull=True, current_stage__isnull=True),
+                name='dashboardcounter_unique_no_preset_stage'),
+        ]
+
+    def __str__(self):
+        """String format of model object"""
+        return f'{self.status, self.current_stage_id}: {self.leads}'
+
+    @staticmethod
+    def dimensions(lead):
+        """
+        Function to get the counter dimensions of a lead.
+
+        Input Params:
+            lead(obj/dict): Lead object or lead values with the
+                COUNTER_DIMENSIONS keys.
+        Returns:
+            (dict): dimension values of the lead.
+        """
+        if not isinstance(lead, dict):
+            lead = {
+                key: getattr(lead, key)
+                for key in lead_consts.COUNTER_DIMENSIONS}
+        # Empty foreign keys are kept as '' on unsaved objects.
+        return {
+            key: (lead[key] or None) if key.endswith('_id') else lead[key]
+            for key in lead_consts.COUNTER_DIMENSIONS}
+
+    @classmethod
+    def add(cls, dimensions, leads=0, answers=0, points_secured=0):
+        """
+        Function to add the values to the counter of the dimensions.
+
+        The counter is updated with F expressions, so that concurrent
+        writes on the same counter do not overwrite each other. A counter
+        created concurrently fails on the unique constraints, and
+        get_or_create reads the one committed first.
+        """
+        if not (leads or answers or points_secured):
+            return
+        counter, created = cls.objects.get_or_create(**dimensions)
+        cls.objects.filter(id=counter.id).update(
+            leads=models.F('leads') + leads,
+            answers=models.F('answers') + answers,
+            points_secured=models.F('points_secured') + points_secured)
+
+
+class LeadStageTransition(AbstractBaseModel):
+    """
+    Model to save the history of the lead stage and status.
+
+    A row is appended whenever the current stage or the status of a lead
+    changes, rows are never updated.
+
+    Attribs:
+        from_status(int): Status of the lead before the change.
+        to_status(int)  : Status of the lead after the change.
+        changed_on(datetime): Time of the change.
+
+    Inherited Attribs:
+        lead_id(obj): Lead object of the transition.
+        from_stage(obj): Stage of the lead before the change.
+        to_stage(obj): Stage of the lead after the change.
+        creator(obj): Creator user of the object.
+        updater(obj): Updater of the object.
+        created_on(datetime): Added date of the object.
+        updated_on(datetime): Last updated date of the object.
+    """
+    lead_id = models.ForeignKey(
+        'leadtracker.Lead', on_delete=models.CASCADE,
+        related_name='stage_transitions', verbose_name=_('Lead'))
+    from_stage = models.ForeignKey(
+        'leadtracker.Stage', on_delete=models.SET_NULL,
+        related_name='transitions_from', verbose_name=_('From Stage'),
+        blank=True, null=True, default=None)
+    to_stage = models.ForeignKey(
+        'leadtracker.Stage', on_delete=models.SET_NULL,
+        related_name='transitions_to', verbose_name=_('To Stage'),
+        blank=True, null=True, default=None)
+    from_status = models.IntegerField(
+        choices=lead_consts.StatusChoice.choices(),
+        blank=True, null=True, default=None,
+        verbose_name=_('From Status'))
+    to_status = models.IntegerField(
+        choices=lead_consts.StatusChoice.choices(),
+        verbose_name=_('To Status'))
+    changed_on = models.DateTimeField(
+        default=timezone.now, verbose_name=_('Changed On'))
+
+    class Meta(AbstractBaseModel.Meta):
+        """Meta class for the above model."""
+
+        indexes = [
+            models.Index(
+                fields=['lead_id', 'changed_on'],
+                name='transition_lead_changed_idx'),
+        ]
+
+    def __str__(self):
+        """String format of model object"""
+        return f'{self.lead_id_id}: {self.from_stage_id} -> {self.to_stage_id}'
+
+
+class LeadDailyRollup(AbstractBaseModel):
+    """
+    Model to save the daily lead counts for the trend charts.
+
+    Rows of a day are replaced whenever the day is refreshed. Created
+    events are counted on the creation day of the leads with their current
+    stage and status, won and lost events on the day of the transition with
+    the stage of the transition.
+
+    Attribs:
+        day(date)        : Day of the event.
+        event(int)       : Created, won or lost.
+        lead_source(int) : Source of the leads.
+        status(int)      : Status of the leads.
+        leads(int)       : Number of leads.
+        revenue(float)   : Sum of the revenue of the leads.
+
+    Inherited Attribs:
+        preset_id(obj): Preset object of the leads.
+        stage(obj): Stage object of the leads.
+        creator(obj): Creator user of the object.
+        updater(obj): Updater of the object.
+        created_on(datetime): Added date of the object.
+        updated_on(datetime): Last updated date of the object.
+    """
+    day = models.DateField(verbose_name=_('Day'))
+    event = models.IntegerField(
+        choices=lead_consts.RollupEventChoice.choices(),
+        verbose_name=_('Event'))
+    lead_source = models.IntegerField(
+        default=lead_consts.LeadSourceChoice.LINKEDIN,
+        choices=lead_consts.LeadSourceChoice.choices(),
+        verbose_name=_('Lead Source'))
+    preset_id = models.ForeignKey(
+        'leadtracker.StagePreset', on_delete=models.DO_NOTHING,
+        related_name='daily_rollups', verbose_name=_('Preset ID'),
+        blank=True, null=True, default=None, db_constraint=False)
+    stage = models.ForeignKey(
+        'leadtracker.Stage', on_delete=models.DO_NOTHING,
+        related_name='daily_rollups', verbose_name=_('Stage'),
+        blank=True, null=True, default=None, db_constraint=False)
+    status = models.IntegerField(
+        choices=lead_consts.StatusChoice.choices(),
+        verbose_name=_('Lead Status'))
+    leads = models.IntegerField(default=0)
+    revenue = models.FloatField(default=0)
+
+    class Meta(AbstractBaseModel.Meta):
+        """Meta class for the above model."""
+
+        indexes = [
+            models.Index(
+                fields=['day', 'event'], name='rollup_day_event_idx'),
+        ]
+
+    def __str__(self):
+        """String format of model object"""
+        return f'{self.day} {self.event}: {self.leads}'
+
+
+class RollupRefreshDay(AbstractBaseModel):
+    """
+    Model to save the days of the daily rollups to refresh.
+
+    Deleted leads leave no updated lead or transition for the refresh to
+    find, so the days they were counted on are saved when they are
+    deleted, and refreshed along with the recent changes.
+
+    Attribs:
+        day(date): Day of the rollups to refresh.
+
+    Inherited Attribs:
+        creator(obj): Creator user of the object.
+        updater(obj): Updater of the object.
+        created_on(datetime): Added date of the object.
+        updated_on(datetime): Last updated date of the object.
+    """
+    day = models.DateField(unique=True, verbose_name=_('Day'))
+
+    def __str__(self):
+        """String format of model object"""
+        return f'{self.day}'
+
+
+class PipedriveSync(AbstractBaseModel):
+    """
+    Model to save the Pipedrive records imported into the leadtracker.
+
+    The update time of each record is kept so that importing an export
+    again only processes the records changed in Pipedrive since.
+
+    Attribs:
+        kind(int)           : Organization, person or deal.
+        pipedrive_id(int)   : Id of the record in Pipedrive.
+        update_time(datetime): Update time of the record in Pipedrive.
+        object_id(int)      : Id of the organization, contact or lead of
+            the record.
+
+    Inherited Attribs:
+        creator(obj): Creator user of the object.
+        updater(obj): Updater of the object.
+        created_on(datetime): Added date of the object.
+        updated_on(datetime): Last updated date of the object.
+    """
+    kind = models.IntegerField(
+        choices=lead_consts.PipedriveKindChoice.choices(),
+        verbose_name=_('Kind'))
+    pipedrive_id = models.BigIntegerField(verbose_name=_('Pipedrive ID'))
+    update_time = models.DateTimeField(
+        blank=True, null=True, default=None, verbose_name=_('Update Time'))
+    object_id = models.BigIntegerField(verbose_name=_('Object ID'))
+
+    class Meta(AbstractBaseModel.Meta):
+        """Meta class for the above model."""
+
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'pipedrive_id'],
+                name='pipedrive_sync_unique_record'),
+        ]
+
+    def __str__(self):
+        """String format of model object"""
+        return f'{self.kind} {self.pipedrive_id}: {self.object_id}'
@@ -0,0 +1,569 @@
+"""
+Import of Pipedrive exports into the leadtracker.
+
+The organizations, persons and deals exported from Pipedrive, as JSON
+from its API or as CSV from its web app, are upserted into organizations,
+contacts and leads, with the contact person of each deal as a contact of
+its lead. Organizations are matched by name, contacts by email and leads
+by the pipedrive link of the deal, so importing an export again updates
+the same objects.
+
+The update time of each imported record is kept in PipedriveSync, the
+records not changed in Pipedrive since their last import are skipped.
+The records are written with bulk queries, one transaction per chunk.
+"""
+
+import csv
+import json
+import datetime
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_datetime
+
+from v1.leadtracker import models as lead_model
+from v1.leadtracker import constants as lead_consts
+from v1.leadtracker import functions as lead_functions
+from v1.leadtracker import search as lead_search
+
+ORGANIZATION = lead_consts.PipedriveKindChoice.ORGANIZATION
+PERSON = lead_consts.PipedriveKindChoice.PERSON
+DEAL = lead_consts.PipedriveKindChoice.DEAL
+
+ROLE_BY_TITLE = {
+    label.lower(): value
+    for value, label in lead_consts.RoleChoice.choices()}
+
+
+def get_record_key(name):
+    """
+    Function to normalize a field name of an export.
+
+    The CSV headers are prefixed by the entity, like "Deal - Title", and
+    match the JSON keys, like "title", without it.
+    """
+    name = str(name or "")
+    if " - " in name:
+        name = name.split(" - ", 1)[1]
+    return "_".join(name.strip().lower().split())
+
+
+def load_records(path):
+    """
+    Function to read the records of a Pipedrive export file.
+
+    Input Params:
+        path(str): path of a .csv export, or of a .json file with a list of
+            records or an API response with the records in data.
+    Returns:
+        (list): records as dicts with normalized keys.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as file:
+            records = list(csv.DictReader(file))
+    else:
+        with open(path, encoding="utf-8") as file:
+            records = json.load(file)
+        if isinstance(records, dict):
+            records = records.get("data") or []
+    return [
+        {get_record_key(key): value for key, value in record.items()}
+        for record in records if isinstance(record, dict)]
+
+
+def get_text(record, *keys):
+    """Function to get the first non empty text of the keys."""
+    for key in keys:
+        value = record.get(key)
+        if isinstance(value, dict):
+            value = value.get("name") or value.get("value")
+        if isinstance(value, list):
+            values = [
+                item.get("value") if isinstance(item, dict) else item
+                for item in value]
+            primary = [
+                item.get("value") for item in value
+                if isinstance(item, dict) and item.get("primary")]
+            value = (primary or values or [None])[0]
+        if value not in (None, ""):
+            return str(value).strip()
+    return ""
+
+
+def get_id(value):
+    """Function to get a Pipedrive id from an id or a related record."""
+    if isinstance(value, dict):
+        value = value.get("value") or value.get("id")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_reference(record, id_keys, name_keys):
+    """
+    Function to get the related record of a record.
+
+    The JSON exports refer to it by id, or by an object with its id and
+    name, the CSV exports by name.
+
+    Returns:
+        (tuple): Pipedrive id and name of the related record.
+    """
+    pipedrive_id = None
+    for key in id_keys:
+        pipedrive_id = get_id(record.get(key))
+        if pipedrive_id:
+            break
+    return pipedrive_id, get_text(record, *name_keys)
+
+
+def get_update_time(record):
+    """Function to get the update time of a record, in UTC."""
+    value = get_text(record, "update_time")
+    update_time = parse_datetime(value) if value else None
+    if update_time and timezone.is_naive(update_time):
+        update_time = timezone.make_aware(update_time, datetime.timezone.utc)
+    return update_time
+
+
+def get_number(value):
+    """Function to get a float from a number or a text."""
+    try:
+        return float(str(value).replace(",", "")) if value not in (
+            None, "") else None
+    except ValueError:
+        return None
+
+
+def get_chunks(records):
+    """Function to split the records in chunks."""
+    size = lead_consts.PIPEDRIVE_CHUNK_SIZE
+    for start in range(0, len(records), size):
+        yield records[start:start + size]
+
+
+def add_error(result, kind, record, error):
+    """Function to count a record that can not be imported."""
+    result[kind]["failed"] += 1
+    if len(result["errors"]) < lead_consts.LEAD_IMPORT_MAX_ERRORS:
+        result["errors"].append({
+            "kind": kind, "id": record.get("id"), "error": error})
+
+
+def get_changed(kind, records, result, name):
+    """
+    Function to drop the records not changed since their last import.
+
+    Input Params:
+        kind(int): PipedriveKindChoice of the records.
+        records(list): normalized records, with id and update_time.
+        result(dict): import result, the skipped records are counted.
+        name(str): key of the records in the result.
+    Returns:
+        (tuple): changed records, and the sync rows of the records by
+            Pipedrive id.
+    """
+    synced = {
+        sync.pipedrive_id: sync
+        for sync in lead_model.PipedriveSync.objects.filter(
+            kind=kind, pipedrive_id__in=[record["id"] for record in records])}
+    changed = []
+    seen = set()
+    for record in records:
+        sync = synced.get(record["id"])
+        if record["id"] in seen or (
+                sync and record["update_time"]
+                and sync.update_time == record["update_time"]):
+            result[name]["skipped"] += 1
+            continue
+        seen.add(record["id"])
+        changed.append(record)
+    return changed, synced
+
+
+def get_synced_objects(kind, pipedrive_ids):
+    """Function to get the object ids of Pipedrive records, by their id."""
+    return dict(lead_model.PipedriveSync.objects.filter(
+        kind=kind, pipedrive_id__in=[pk for pk in pipedrive_ids if pk]
+    ).values_list("pipedrive_id", "object_id"))
+
+
+def save_syncs(kind, records, objects, synced, user=None):
+    """
+    Function to record the imported records and their objects.
+
+    Input Params:
+        kind(int): PipedriveKindChoice of the records.
+        records(list): imported records.
+        objects(list): objects of the records, in the same order.
+        synced(dict): existing sync rows by Pipedrive id.
+        user(obj): user importing the records.
+    """
+    now = timezone.now()
+    creates = []
+    updates = []
+    for record, obj in zip(records, objects):
+        sync = synced.get(record["id"])
+        if sync:
+            sync.update_time = record["update_time"]
+            sync.object_id = obj.id
+            sync.updater = user
+            sync.updated_on = now
+            updates.append(sync)
+            continue
+        creates.append(lead_model.PipedriveSync(
+            kind=kind, pipedrive_id=record["id"],
+            update_time=record["update_time"], object_id=obj.id,
+            creator=user, updater=user))
+    lead_model.PipedriveSync.objects.bulk_create(creates)
+    lead_model.PipedriveSync.objects.bulk_update(
+        updates, ["update_time", "object_id", "updater", "updated_on"])
+
+
+def upsert(model, key, records, get_fields, user=None):
+    """
+    Function to create or update the objects of records by a key field.
+
+    Records with the same key are written to the same object, the fields
+    of the last one are kept.
+
+    Input Params:
+        model(obj): model of the objects.
+        key(str): field matching the records and the objects.
+        records(list): records with the key value in key.
+        get_fields(callable): fields of the object of a record, called
+            with the record and if the object is created.
+        user(obj): user importing the records.
+    Returns:
+        (tuple): objects of the records, created objects, updated objects
+            and updated fields.
+    """
+    existing = {}
+    for obj in model.objects.filter(**{
+            key + "__in": [record[key] for record in records]}).order_by("id"):
+        existing.setdefault(getattr(obj, key), obj)
+    now = timezone.now()
+    objects = []
+    created = {}
+    updated = {}
+    fields = {"updater", "updated_on"}
+    for record in records:
+        obj = existing.get(record[key]) or created.get(record[key])
+        values = get_fields(record, obj is None)
+        if obj is None:
+            values[key] = record[key]
+            obj = model(**values, creator=user, updater=user)
+            created[record[key]] = obj
+        else:
+            for attr, value in values.items():
+                setattr(obj, attr, value)
+            if obj.id:
+                obj.updater = user
+                obj.updated_on = now
+                updated[obj.id] = obj
+                fields.update(values)
+        objects.append(obj)
+    model.objects.bulk_create(list(created.values()))
+    model.objects.bulk_update(list(updated.values()), list(fields))
+    return objects, list(created.values()), list(updated.values()), fields
+
+
+def import_organizations(records, result, user=None):
+    """
+    Function to import Pipedrive organizations, matched by name.
+
+    Input Params:
+        records(list): records of the organizations export.
+        result(dict): import result.
+        user(obj): user importing the records.
+    """
+    normalized = []
+    for record in records:
+        result["organizations"]["processed"] += 1
+        name = get_text(record, "name")[:100]
+        if not get_id(record.get("id")) or not name:
+            add_error(result, "organizations", record, "id and name required.")
+            continue
+        normalized.append({
+            "id": get_id(record.get("id")),
+            "update_time": get_update_time(record),
+            "name": name,
+            "country": get_text(record, "address_country", "country")[:100],
+        })
+
+    def get_fields(record, create):
+        fields = {}
+        if record["country"]:
+            fields["country"] = record["country"]
+        if create:
+            fields["email"] = ""
+        return fields
+
+    for chunk in get_chunks(normalized):
+        with transaction.atomic():
+            chunk, synced = get_changed(
+                ORGANIZATION, chunk, result, "organizations")
+            objects, created, updated, _ = upsert(
+                lead_model.Organization, "name", chunk, get_fields, user)
+            save_syncs(ORGANIZATION, chunk, objects, synced, user)
+            if created or updated:
+                lead_functions.invalidate_duplicates()
+            if updated:
+                lead_search.update_search_vectors(
+                    lead_model.Lead.objects.filter(
+                        organization__in=[obj.id for obj in updated]))
+        result["organizations"]["created"] += len(created)
+        result["organizations"]["updated"] += len(updated)
+
+
+def get_organizations(references):
+    """
+    Function to get the organizations of Pipedrive references.
+
+    Input Params:
+        references(list): Pipedrive ids and names of organizations.
+    Returns:
+        (tuple): organization ids by Pipedrive id, and by name.
+    """
+    by_id = get_synced_objects(
+        ORGANIZATION, [pipedrive_id for pipedrive_id, _ in references])
+    by_name = dict(lead_model.Organization.objects.filter(
+        name__in=[name for _, name in references if name]
+    ).values_list("name", "id"))
+    return by_id, by_name
+
+
+def get_organization_id(reference, by_id, by_name):
+    """Function to get the organization id of a Pipedrive reference."""
+    pipedrive_id, name = reference
+    return by_id.get(pipedrive_id) or by_name.get(name)
+
+
+def import_persons(records, result, user=None):
+    """
+    Function to import Pipedrive persons as contacts, matched by email.
+
+    Input Params:
+        records(list): records of the persons export.
+        result(dict): import result.
+        user(obj): user importing the records.
+    """
+    normalized = []
+    for record in records:
+        result["persons"]["processed"] += 1
+        email = get_text(record, "email")
+        if not get_id(record.get("id")) or not email:
+            add_error(result, "persons", record, "id and email required.")
+            continue
+        normalized.append({
+            "id": get_id(record.get("id")),
+            "update_time": get_update_time(record),
+            "name": get_text(record, "name")[:100] or email[:100],
+            "email": email,
+            "organization": get_reference(
+                record, ["org_id"], ["org_name", "org_id", "organization"]),
+            "role": ROLE_BY_TITLE.get(
+                " ".join(get_text(record, "job_title").lower().split())),
+        })
+
+    for chunk in get_chunks(normalized):
+        with transaction.atomic():
+            chunk, synced = get_changed(PERSON, chunk, result, "persons")
+            by_id, by_name = get_organizations(
+                [record["organization"] for record in chunk])
+
+            def get_fields(record, create):
+                fields = {"name": record["name"]}
+                organization_id = get_organization_id(
+                    record["organization"], by_id, by_name)
+                if organization_id or create:
+                    fields["organization_id"] = organization_id
+                if record["role"] or create:
+                    fields["role"] = (
+                        record["role"] or lead_consts.PIPEDRIVE_DEFAULT_ROLE)
+                return fields
+
+            objects, created, updated, _ = upsert(
+                lead_model.Contact, "email", chunk, get_fields, user)
+            save_syncs(PERSON, chunk, objects, synced, user)
+            if created or updated:
+                lead_functions.invalidate_duplicates()
+            if updated:
+                lead_search.update_search_vectors(
+                    lead_model.Lead.objects.filter(
+                        lead_contacts__contact_id__in=[
+                            obj.id for obj in updated]))
+        result["persons"]["created"] += len(created)
+        result["persons"]["updated"] += len(updated)
+
+
+def get_contacts(references):
+    """
+    Function to get the contacts of Pipedrive references.
+
+    The CSV exports refer to the contact person of a deal by name, it is
+    matched when a single contact has the name.
+
+    Input Params:
+        references(list): Pipedrive ids and names of persons.
+    Returns:
+        (tuple): contact ids by Pipedrive id, and by name.
+    """
+    by_id = get_synced_objects(
+        PERSON, [pipedrive_id for pipedrive_id, _ in references])
+    by_name = {}
+    for name, contact_id in lead_model.Contact.objects.filter(
+            name__in=[name for _, name in references if name]
+    ).values_list("name", "id"):
+        by_name[name] = None if name in by_name else contact_id
+    return by_id, by_name
+
+
+def import_deals(records, domain, result, user=None):
+    """
+    Function to import Pipedrive deals as leads, matched by their link.
+
+    The contact person of each deal is added to the contacts of its lead.
+
+    Input Params:
+        records(list): records of the deals export.
+        domain(str): company domain of the Pipedrive account, for the
+            links of the deals.
+        result(dict): import result.
+        user(obj): user importing the records.
+    """
+    normalized = []
+    for record in records:
+        result["deals"]["processed"] += 1
+        pipedrive_id = get_id(record.get("id"))
+        title = get_text(record, "title")[:100]
+        status = lead_consts.PIPEDRIVE_DEAL_STATUS.get(
+            get_text(record, "status").lower() or "open")
+        if not pipedrive_id or not title:
+            add_error(result, "deals", record, "id and title required.")
+            continue
+        if not status:
+            # Deleted deals are exported with the deleted status.
+            result["deals"]["skipped"] += 1
+            continue
+        normalized.append({
+            "id": pipedrive_id,
+            "update_time": get_update_time(record),
+            "pipedrive": lead_consts.PIPEDRIVE_DEAL_URL % (
+                domain, pipedrive_id),
+            "name": title,
+            "status": status,
+            "revenue": get_number(record.get("value")),
+            "expected_close_on": parse_date(
+                get_text(record, "expected_close_date")[:10] or "") or None,
+            "organization": get_reference(
+                record, ["org_id"], ["org_name", "org_id", "organization"]),
+            "person": get_reference(
+                record, ["person_id"],
+                ["person_name", "person_id", "contact_person"]),
+        })
+
+    for chunk in get_chunks(normalized):
+        with transaction.atomic():
+            chunk, synced = get_changed(DEAL, chunk, result, "deals")
+            organizations = get_organizations(
+                [record["organization"] for record in chunk])
+            existing_ids = list(lead_model.Lead.objects.filter(
+                pipedrive__in=[record["pipedrive"] for record in chunk]
+            ).values_list("id", flat=True))
+            snapshot = lead_functions.get_bulk_lead_snapshot(existing_ids)
+
+            def get_fields(record, create):
+                fields = {
+                    "name": record["name"],
+                    "status": record["status"],
+                }
+                organization_id = get_organization_id(
+                    record["organization"], *organizations)
+                if organization_id or create:
+                    fields["organization_id"] = organization_id
+                if record["expected_close_on"]:
+                    fields["expected_close_on"] = record["expected_close_on"]
+                if record["revenue"] is not None:
+                    fields["revenue"] = record["revenue"]
+                if create:
+                    fields["lead_source"] = (
+                        lead_consts.LeadSourceChoice.PIPEDRIVE)
+                return fields
+
+            objects, created, updated, _ = upsert(
+                lead_model.Lead, "pipedrive", chunk, get_fields, user)
+            add_lead_contacts(chunk, objects, user)
+            save_syncs(DEAL, chunk, objects, synced, user)
+            if created:
+                lead_functions.record_bulk_lead_writes(
+                    [lead.id for lead in created], creator=user)
+            if updated:
+                lead_functions.record_bulk_lead_writes(
+                    [lead.id for lead in updated], snapshot, creator=user)
+        result["deals"]["created"] += len(created)
+        result["deals"]["updated"] += len(updated)
+
+
+def add_lead_contacts(records, leads, user=None):
+    """
+    Function to add the contact person of the deals to their leads.
+
+    Input Params:
+        records(list): imported deals.
+        leads(list): leads of the deals, in the same order.
+        user(obj): user importing the records.
+    """
+    by_id, by_name = get_contacts([record["person"] for record in records])
+    pairs = set()
+    for record, lead in zip(records, leads):
+        pipedrive_id, name = record["person"]
+        contact_id = by_id.get(pipedrive_id) or by_name.get(name)
+        if contact_id:
+            pairs.add((lead.id, contact_id))
+    if not pairs:
+        return
+    existing = set(lead_model.LeadContact.objects.filter(
+        lead_id__in={lead_id for lead_id, _ in pairs},
+        contact_id__in={contact_id for _, contact_id in pairs},
+    ).values_list("lead_id", "contact_id"))
+    lead_model.LeadContact.objects.bulk_create([
+        lead_model.LeadContact(
+            lead_id_id=lead_id, contact_id_id=contact_id,
+            creator=user, updater=user)
+        for lead_id, contact_id in sorted(pairs - existing)])
+
+
+def import_pipedrive(domain, organizations=None, persons=None, deals=None,
+                     user=None):
+    """
+    Function to import Pipedrive export files.
+
+    The organizations are imported first, then the persons and the deals
+    referring to them.
+
+    Input Params:
+        domain(str): company domain of the Pipedrive account.
+        organizations(str): path of the organizations export.
+        persons(str): path of the persons export.
+        deals(str): path of the deals export.
+        user(obj): user importing the records.
+    Returns:
+        (dict): processed, created, updated, skipped and failed records of
+            each export, with the errors of the first failed records.
+    """
+    result = {
+        name: {
+            "processed": 0, "created": 0, "updated": 0, "skipped": 0,
+            "failed": 0}
+        for name in ("organizations", "persons", "deals")}
+    result["errors"] = []
+    if organizations:
+        import_organizations(load_records(organizations), result, user)
+    if persons:
+        import_persons(load_records(persons), result, user)
+    if deals:
+        import_deals(load_records(deals), domain, result, user)
+    return result
@@ -0,0 +1,230 @@
+"""
+Vectorized rescoring of the answers and the lead win possibility.
+
+The answers are loaded as NumPy arrays of option points, question credits
+and lead ids, the scores and the per lead sums are computed without
+Python loops, and only the changed rows are written back in batches.
+"""
+
+from time import perf_counter
+
+import numpy as np
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from v1.leadtracker import models as lead_models
+from v1.leadtracker import constants as lead_consts
+from v1.leadtracker import functions as lead_functions
+
+
+ANSWER_MODELS = (lead_models.StageAnswer, lead_models.GeneralAnswer)
+
+
+def compute_scores(points, credits, lead_index, lead_count):
+    """
+    Function to compute the answer scores and the lead sums.
+
+    Input Params:
+        points(array): option points of each answer.
+        credits(array): question credit of each answer.
+        lead_index(array): position of the lead of each answer.
+        lead_count(int): number of leads.
+    Returns:
+        scores(array): score of each answer.
+        lead_points(array): sum of the scores of each lead.
+        lead_credits(array): sum of the question credits of each lead.
+    """
+    scores = points.astype(np.int64) * credits.astype(np.int64)
+    lead_points = np.bincount(
+        lead_index, weights=scores, minlength=lead_count).astype(np.int64)
+    lead_credits = np.bincount(
+        lead_index, weights=credits, minlength=lead_count).astype(np.int64)
+    return scores, lead_points, lead_credits
+
+
+def compute_possibility(lead_points, lead_credits):
+    """
+    Function to compute the win possibility of the leads.
+
+    The possibility is the points over the maximum score of the answers,
+    kept between 0 and 1 for options above MAX_OPTION_POINTS.
+
+    Input Params:
+        lead_points(array): sum of the scores of each lead.
+        lead_credits(array): sum of the question credits of each lead.
+    Returns:
+        credit(array): maximum score of each lead.
+        possibility(array): win possibility of each lead.
+    """
+    credit = lead_credits * lead_consts.MAX_OPTION_POINTS
+    possibility = np.zeros(len(lead_points), dtype=np.float64)
+    np.divide(lead_points, credit, out=possibility, where=credit > 0)
+    np.clip(possibility, 0, 1, out=possibility)
+    return credit, possibility
+
+
+def load_answers(model, lead_ids):
+    """
+    Function to load the answers of the leads as arrays.
+
+    Returns:
+        (array): rows of id, lead id, points, credit and stored score.
+    """
+    rows = (
+        model.objects.filter(lead_id__in=lead_ids)
+        .order_by()
+        .annotate(
+            points=Coalesce("option_id__points", 0),
+            credit=Coalesce("question_id__credit", 0))
+        .values_list("id", "lead_id", "points", "credit", "score")
+    )
+    data = np.array(list(rows), dtype=np.int64)
+    return data.reshape(-1, 5)
+
+
+def is_stored(lead_ids, lead_points, credit, possibility):
+    """
+    Function to check which leads already store the computed scores.
+
+    Input Params:
+        lead_ids(array): sorted ids of the leads.
+        lead_points(array): computed points of each lead.
+        credit(array): computed credit of each lead.
+        possibility(array): computed possibility of each lead.
+    Returns:
+        (array): True for the leads storing the same scores, and for the
+            leads that do not exist.
+    """
+    rows = np.array(list(
+        lead_models.Lead.objects.filter(id__in=lead_ids.tolist())
+        .order_by("id")
+        .values_list("id", *lead_consts.LEAD_SCORE_FIELDS)
+    ), dtype=np.float64).reshape(-1, 4)
+    stored = np.ones(len(lead_ids), dtype=bool)
+    index = np.searchsorted(lead_ids, rows[:, 0].astype(np.int64))
+    stored[index] = (
+        (rows[:, 1] == lead_points[index])
+        & (rows[:, 2] == credit[index])
+        & (rows[:, 3] == possibility[index]))
+    return stored
+
+
+@transaction.atomic
+def rescore_lead_chunk(lead_ids, batch_size=1000, timings=None):
+    """
+    Function to rescore the answers of a chunk of leads.
+
+    The dashboard counters of the leads are moved by the change of their
+    stage answer scores.
+
+    Input Params:
+        lead_ids(list): ids of the leads.
+        batch_size(int): number of rows per update query.
+        timings(dict): seconds spent to load, compute and write are added
+            to its load, compute and write keys.
+    Returns:
+        (int): number of answers with a changed score.
+    """
+    timings = timings if timings is not None else {}
+    clock = [perf_counter()]
+
+    def lap(phase):
+        now = perf_counter()
+        timings[phase] = timings.get(phase, 0) + now - clock[0]
+        clock[0] = now
+
+    lead_ids = np.unique(np.asarray(lead_ids, dtype=np.int64))
+    lead_points = np.zeros(len(lead_ids), dtype=np.int64)
+    lead_credits = np.zeros(len(lead_ids), dtype=np.int64)
+    changed = 0
+    now = timezone.now()
+    counters = lead_functions.get_live_counters(lead_ids.tolist())
+    for model in ANSWER_MODELS:
+        data = load_answers(model, lead_ids.tolist())
+        lap("load")
+        if not len(data):
+            continue
+        lead_index = np.searchsorted(lead_ids, data[:, 1])
+        scores, points, credits = compute_scores(
+            data[:, 2], data[:, 3], lead_index, len(lead_ids))
+        lead_points += points
+        lead_credits += credits
+
+        mask = scores != data[:, 4]
+        updates = [
+            model(id=answer_id, score=score, updated_on=now)
+            for answer_id, score in zip(
+                data[mask, 0].tolist(), scores[mask].tolist())]
+        lap("compute")
+        model.objects.bulk_update(
+            updates, ["score", "updated_on"], batch_size=batch_size)
+        changed += len(updates)
+        lap("write")
+
+    credit, possibility = compute_possibility(lead_points, lead_credits)
+    lap("compute")
+    # Only the leads with changed scores are written, updated_on is read
+    # as a change by the rollups, ETags and snapshots.
+    changed_leads = ~is_stored(
+        lead_ids, lead_points, credit, possibility)
+    lap("load")
+    leads = [
+        lead_models.Lead(
+            id=lead_id, points_secured=points, credit_registered=credits,
+            possibility=value, updated_on=now)
+        for lead_id, points, credits, value in zip(
+            lead_ids[changed_leads].tolist(),
+            lead_points[changed_leads].tolist(),
+            credit[changed_leads].tolist(),
+            possibility[changed_leads].tolist())]
+    lead_models.Lead.objects.bulk_update(
+        leads, lead_consts.LEAD_SCORE_FIELDS + ["updated_on"],
+        batch_size=batch_size)
+    if changed:
+        lead_functions.apply_counter_changes(
+            counters, lead_functions.get_live_counters(lead_ids.tolist()))
+    lap("write")
+    return changed
+
+
+def get_affected_leads(question_ids=None, option_ids=None):
+    """
+    Function to get the leads with answers to the questions or options.
+
+    All the leads are returned when no question or option is given.
+    """
+    if not question_ids and not option_ids:
+        return lead_models.Lead.objects.order_by("id").values_list(
+            "id", flat=True)
+    query = Q()
+    if question_ids:
+        query |= Q(question_id__in=question_ids)
+    if option_ids:
+        query |= Q(option_id__in=option_ids)
+    lead_ids = set()
+    for model in ANSWER_MODELS:
+        lead_ids.update(
+            model.objects.filter(query, lead_id__isnull=False)
+            .order_by().values_list("lead_id", flat=True).distinct())
+    return sorted(lead_ids)
+
+
+def rescore_answers(question_ids=None, option_ids=None, chunk_size=5000):
+    """
+    Function to rescore the answers after points or credits changed.
+
+    Input Params:
+        question_ids(list): ids of the questions with a changed credit.
+        option_ids(list): ids of the options with changed points.
+        chunk_size(int): number of leads rescored per transaction.
+    Returns:
+        (dict): number of leads and answers updated.
+    """
+    lead_ids = list(get_affected_leads(question_ids, option_ids))
+    changed = 0
+    for start in range(0, len(lead_ids), chunk_size):
+        changed += rescore_lead_chunk(lead_ids[start:start + chunk_size])
+    return {"leads": len(lead_ids), "answers": changed}
@@ -0,0 +1,254 @@
+"""
+Full text search of leads.
+
+Each lead keeps a tsvector of its own name and of the names of its
+organization, contacts and tags, in Lead.search_vector with a GIN index.
+The vectors are rebuilt with a single UPDATE for the leads affected by a
+write, so searching is an index lookup whatever the number of leads.
+
+Organizations and contacts are matched by trigram similarity for the
+typeahead of the pickers, over GIN trigram indexes of pg_trgm.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import F
+from django.db.models import Q
+from django.db.models import CharField
+from django.db.models.lookups import IContains
+from django.core.cache import cache
+from django.db.models.functions import Greatest
+from django.contrib.postgres.search import TrigramSimilarity
+from django.contrib.postgres.search import SearchRank
+from django.contrib.postgres.search import SearchQuery
+
+from v1.leadtracker import models as lead_model
+from v1.leadtracker import constants as lead_consts
+
+from common import library as comm_lib
+from common import cache as cache_lib
+
+
+SEARCH_CONFIG = "simple"
+
+# Weights of the D, C, B and A parts of the vector, for the ranking.
+SEARCH_WEIGHTS = [0.1, 0.2, 0.4, 1.0]
+
+# A: lead name, B: organization and tag names, C: contact names and
+# emails, D: organization website and country.
+SEARCH_VECTOR_SQL = """
+UPDATE {lead} AS lead_row SET search_vector =
+    setweight(to_tsvector({config}, coalesce(lead_row.name, '')), 'A')
+    || setweight(to_tsvector({config}, coalesce((
+        SELECT org.name FROM {organization} AS org
+        WHERE org.id = lead_row.organization_id), '')), 'B')
+    || setweight(to_tsvector({config}, coalesce((
+        SELECT string_agg(tag.name, ' ')
+        FROM {leadtag} AS lead_tag
+        JOIN {tag} AS tag ON tag.id = lead_tag.tag_id_id
+        WHERE lead_tag.lead_id_id = lead_row.id), '')), 'B')
+    || setweight(to_tsvector({config}, coalesce((
+        SELECT string_agg(contact.name || ' ' || contact.email, ' ')
+        FROM {leadcontact} AS lead_contact
+        JOIN {contact} AS contact
+            ON contact.id = lead_contact.contact_id_id
+        WHERE lead_contact.lead_id_id = lead_row.id), '')), 'C')
+    || setweight(to_tsvector({config}, coalesce((
+        SELECT concat_ws(' ', org.website, org.country)
+        FROM {organization} AS org
+        WHERE org.id = lead_row.organization_id), '')), 'D')
+WHERE lead_row.id IN ({leads})
+"""
+
+
+def update_search_vectors(leads):
+    """
+    Function to rebuild the search vectors of leads.
+
+    Input Params:
+        leads(obj): queryset of the leads to update.
+    Returns:
+        (int): number of leads updated.
+    """
+    leads_sql, params = (
+        leads.order_by().values("id").query.sql_with_params())
+    sql = SEARCH_VECTOR_SQL.format(
+        lead=lead_model.Lead._meta.db_table,
+        organization=lead_model.Organization._meta.db_table,
+        leadtag=lead_model.LeadTag._meta.db_table,
+        tag=lead_model.Tag._meta.db_table,
+        leadcontact=lead_model.LeadContact._meta.db_table,
+        contact=lead_model.Contact._meta.db_table,
+        config="'%s'" % SEARCH_CONFIG,
+        leads=leads_sql,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def get_search_query(text):
+    """
+    Function to get the prefix matching query of a search text.
+
+    Every word of the text should match the start of a word of the lead,
+    the special characters of tsquery are dropped from the words.
+
+    Input Params:
+        text(str): search text.
+    Returns:
+        (obj): SearchQuery, None if the text has no words.
+    """
+    words = re.findall(r"[\w@.\-]+", text or "")
+    if not words:
+        return None
+    raw = " & ".join("'%s':*" % word for word in words)
+    return SearchQuery(raw, search_type="raw", config=SEARCH_CONFIG)
+
+
+def search_leads(text, queryset=None):
+    """
+    Function to search leads, by rank.
+
+    Input Params:
+        text(str): search text.
+        queryset(obj): leads to search in, all leads if None.
+    Returns:
+        (obj): queryset of the matching leads annotated with rank.
+    """
+    queryset = (
+        queryset if queryset is not None else lead_model.Lead.objects.all())
+    query = get_search_query(text)
+    if query is None:
+        return queryset.none()
+    return queryset.filter(search_vector=query).annotate(
+        rank=SearchRank(F("search_vector"), query, weights=SEARCH_WEIGHTS)
+    ).order_by("-rank", "-created_on")
+
+
+@CharField.register_lookup
+class TrigramContains(IContains):
+    """
+    Case insensitive contains as ILIKE, answered by the trigram index of
+    the field. icontains compares UPPER() of the field, which the index
+    does not cover.
+    """
+
+    lookup_name = "trigram_contains"
+
+    def as_sql(self, compiler, connection):
+        """ILIKE of the escaped text between wildcards."""
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return "%s ILIKE %s" % (lhs, rhs), lhs_params + rhs_params
+
+
+def get_typeahead_matches(queryset, text, fields, limit):
+    """
+    Function to get the best trigram matches of a text.
+
+    Rows similar to the text, above the pg_trgm.similarity_threshold, or
+    containing it in any of the fields match, both are answered by the
+    trigram indexes of the fields.
+
+    Input Params:
+        queryset(obj): rows to match.
+        text(str): typed text.
+        fields(list): names of the text fields to match on.
+        limit(int): number of matches.
+    Returns:
+        (obj): queryset of the matches annotated with similarity.
+    """
+    similarities = [TrigramSimilarity(field, text) for field in fields]
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{"%s__trigram_similar" % field: text})
+        condition |= Q(**{"%s__trigram_contains" % field: text})
+    return queryset.annotate(
+        similarity=(
+            Greatest(*similarities) if len(similarities) > 1
+            else similarities[0])
+    ).filter(condition).order_by("-similarity", "name", "id")[:limit]
+
+
+def typeahead_organizations(text, limit=lead_consts.TYPEAHEAD_LIMIT):
+    """
+    Function to get the organizations matching a typed text.
+
+    Input Params:
+        text(str): typed text.
+        limit(int): number of matches.
+    Returns:
+        (list): dicts of the matches, by similarity.
+    """
+    matches = get_typeahead_matches(
+        lead_model.Organization.objects.all(), text, ["name"], limit)
+    return [
+        {
+            "id": comm_lib.encode(match["id"]),
+            "name": match["name"],
+            "similarity": match["similarity"],
+        }
+        for match in matches.values("id", "name", "similarity")
+    ]
+
+
+def typeahead_contacts(text, limit=lead_consts.TYPEAHEAD_LIMIT):
+    """
+    Function to get the contacts matching a typed text, by name or email.
+
+    Input Params:
+        text(str): typed text.
+        limit(int): number of matches.
+    Returns:
+        (list): dicts of the matches, by similarity.
+    """
+    matches = get_typeahead_matches(
+        lead_model.Contact.objects.all(), text, ["name", "email"], limit)
+    return [
+        {
+            "id": comm_lib.encode(match["id"]),
+            "name": match["name"],
+            "email": match["email"],
+            "organization": comm_lib.encode(match["organization"])
+            if match["organization"] else None,
+            "similarity": match["similarity"],
+        }
+        for match in matches.values(
+            "id", "name", "email", "organization", "similarity")
+    ]
+
+
+TYPEAHEADS = {
+    "organization": typeahead_organizations,
+    "contact": typeahead_contacts,
+}
+
+
+def typeahead(kind, text, limit=lead_consts.TYPEAHEAD_LIMIT):
+    """
+    Function to get the typeahead matches of a picker, cached shortly.
+
+    The same prefixes are typed by every user of a picker, so the matches
+    are kept for a few seconds by the normalized text instead of being
+    invalidated on the writes.
+
+    Input Params:
+        kind(str): picker, a key of TYPEAHEADS.
+        text(str): typed text.
+        limit(int): number of matches.
+    Returns:
+        (list): dicts of the matches, by similarity.
+    """
+    text = " ".join((text or "").lower().split())
+    if not text:
+        return []
+    key = cache_lib.get_cache_key(
+        lead_consts.TYPEAHEAD_CACHE,
+        {"kind": kind, "text": text, "limit": limit})
+    matches = cache.get(key)
+    if matches is None:
+        matches = TYPEAHEADS[kind](text, limit)
+        cache.set(key, matches, timeout=lead_consts.TYPEAHEAD_CACHE_TTL)
+    return matches
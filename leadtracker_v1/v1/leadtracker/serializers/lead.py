@@ -1,13 +1,20 @@
 from rest_framework import serializers
 
+from django.db import IntegrityError
+from django.db.models import Prefetch
 from django.utils.translation import gettext_lazy as _
 
 from v1.leadtracker import models as lead_models
+from v1.leadtracker import constants as lead_consts
 
+from common import excel
+from common import library as comm_lib
 from common.drf_custom import fields as custom_fields
+from common.drf_custom.mixins import SparseFieldsMixin
+from common.drf_custom.mixins import IncludeFieldsMixin
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Tag.
     """
@@ -25,7 +32,7 @@ class TagSerializer(serializers.ModelSerializer):
             _("Tag Name should be greater than 3"))
 
 
-class StagePresetSerializer(serializers.ModelSerializer):
+class StagePresetSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Stage Preset.
     """
@@ -37,7 +44,7 @@ class StagePresetSerializer(serializers.ModelSerializer):
         fields = ("idencode", "name", )
 
 
-class OrganizationSerializer(serializers.ModelSerializer):
+class OrganizationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Organization.
     """
@@ -51,7 +58,28 @@ class OrganizationSerializer(serializers.ModelSerializer):
             "website", "country", )
 
 
-class LeadSerializer(serializers.ModelSerializer):
+class LeadTagSerializer(
+        IncludeFieldsMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Serializer for Lead Tag.
+    """
+    lead_id = custom_fields.IdencodeField(
+        related_model=lead_models.Lead)
+    tag_id = custom_fields.IdencodeField(
+        related_model=lead_models.Tag)
+
+    class Meta:
+        """Meta Info"""
+
+        model = lead_models.LeadTag
+        fields = ("idencode", "lead_id", "tag_id", )
+        include_fields = {
+            "tag_id": ("TagSerializer", False),
+        }
+
+
+class LeadSerializer(
+        IncludeFieldsMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Lead, create with organization(
         user can select or create one).
@@ -67,12 +95,22 @@ class LeadSerializer(serializers.ModelSerializer):
         model = lead_models.Lead
         fields = (
             "idencode", "name", "pipedrive", "team_size",
-            "revenue", "lead_source", "organization"
+            "revenue", "lead_source", "organization", "expected_close_on",
+            "points_secured", "credit_registered", "possibility",
         )
+        read_only_fields = (
+            "points_secured", "credit_registered", "possibility", )
+        include_fields = {
+            "organization": ("OrganizationSerializer", False),
+            "preset_id": ("StagePresetSerializer", False),
+            "current_stage": ("StageSerializer", False),
+            "lead_contacts": ("LeadContactSerializer", True),
+            "tags": ("LeadTagSerializer", True),
+        }
         
-    def validate_name(self, attrs):
-        if len(attrs['name']) > 3:
-            return attrs
+    def validate_name(self, value):
+        if len(value) > 3:
+            return value
         raise serializers.ValidationError(
             _("Lead Name should be greater than 3"))
 
@@ -87,13 +125,6 @@ class LeadSerializer(serializers.ModelSerializer):
     #     }
     #     return data
     
-    def create(self, validated_data):
-        organization_data = validated_data["organization"]
-        if lead_models.Organization.objects.filter(name=organization_data):
-            lead = lead_models.Lead.objects.create(**validated_data)
-        lead_models.Organization.objects.create(name=organization_data,)
-        return lead
-    
     # def create(self, validated_data):
     #     organization_data = validated_data.pop("organization")
     #     lead = lead_models.Lead.objects.create(**validated_data)
@@ -102,7 +133,144 @@ class LeadSerializer(serializers.ModelSerializer):
     #     return lead
 
 
-class OptionSerializer(serializers.ModelSerializer):
+class LeadSearchSerializer(LeadSerializer):
+    """
+    Serializer for Lead search results, with the rank of the match.
+    """
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta(LeadSerializer.Meta):
+        """Meta Info"""
+
+        fields = LeadSerializer.Meta.fields + ("rank", )
+
+
+class LeadDetailSerializer(LeadSerializer):
+    """
+    Serializer for the full Lead page, with its organization, stage
+    preset, current stage, contacts with their roles, tags and answers.
+
+    The related objects are always included, by the fixed plan of
+    plan_queryset() in five queries whatever their number.
+    """
+    detail_include = {
+        "organization": {},
+        "preset_id": {},
+        "current_stage": {},
+        "lead_contacts": {"contact_id": {}, "stage_id": {}},
+        "tags": {"tag_id": {}},
+    }
+
+    stage_answers = serializers.SerializerMethodField()
+    general_answers = serializers.SerializerMethodField()
+
+    class Meta(LeadSerializer.Meta):
+        """Meta Info"""
+
+        fields = LeadSerializer.Meta.fields + (
+            "status", "created_on", "updated_on",
+            "stage_answers", "general_answers", )
+
+    def __init__(self, *args, **kwargs):
+        """Include the related objects whatever the include param."""
+        kwargs["include"] = self.detail_include
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def plan_queryset(cls, queryset, include=None):
+        """
+        Function to load the related objects and answers of the leads.
+
+        Input Params:
+            queryset(obj): queryset of leads.
+            include(dict): ignored, the included paths are fixed.
+        Returns:
+            (obj): queryset with the related lookups.
+        """
+        queryset = super().plan_queryset(queryset, cls.detail_include)
+        return queryset.prefetch_related(
+            Prefetch(
+                "stageanswers",
+                queryset=lead_models.StageAnswer.objects.select_related(
+                    "stage_id", "question_id", "option_id"
+                ).order_by("created_on", "id")),
+            Prefetch(
+                "generalanswers",
+                queryset=lead_models.GeneralAnswer.objects.select_related(
+                    "question_id", "option_id"
+                ).order_by("created_on", "id")),
+        )
+
+    @staticmethod
+    def group_by_question(answers):
+        """
+        Function to group answers by question.
+
+        Input Params:
+            answers(list): answers with their question and option loaded.
+        Returns:
+            (list): questions with the selected options and their score,
+                answers without a question or option are skipped.
+        """
+        questions = {}
+        for answer in answers:
+            question = answer.question_id
+            if question is None or answer.option_id is None:
+                continue
+            if question.id not in questions:
+                questions[question.id] = {
+                    "question": question.idencode,
+                    "text": question.question,
+                    "type": question.type,
+                    "field_type": question.field_type,
+                    "score": 0,
+                    "options": [],
+                }
+            group = questions[question.id]
+            group["score"] += answer.score
+            group["options"].append({
+                "id": answer.option_id.idencode,
+                "option": answer.option_id.option,
+                "points": answer.option_id.points,
+                "score": answer.score,
+            })
+        return list(questions.values())
+
+    def get_stage_answers(self, instance):
+        """
+        Answers of the lead grouped by stage, in the stage order.
+
+        The answers without a stage are grouped last, with a null stage.
+        """
+        stages = {}
+        answers = {}
+        for answer in instance.stageanswers.all():
+            stage_id = answer.stage_id.id if answer.stage_id else None
+            if stage_id:
+                stages[stage_id] = answer.stage_id
+            answers.setdefault(stage_id, []).append(answer)
+        groups = [
+            (stage.id, StageSerializer(stage).data) for stage in sorted(
+                stages.values(),
+                key=lambda stage: (stage.created_on, stage.id))]
+        if None in answers:
+            groups.append((None, None))
+        data = []
+        for stage_id, stage in groups:
+            questions = self.group_by_question(answers[stage_id])
+            data.append({
+                "stage": stage,
+                "score": sum(question["score"] for question in questions),
+                "questions": questions,
+            })
+        return data
+
+    def get_general_answers(self, instance):
+        """General answers of the lead grouped by question."""
+        return self.group_by_question(instance.generalanswers.all())
+
+
+class OptionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     serializer for Answer.
     """
@@ -129,7 +297,7 @@ class OptionSerializer(serializers.ModelSerializer):
         return data
 
 
-class QuestionSerializer(serializers.ModelSerializer):
+class QuestionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Question.
     Nested representaion of options.
@@ -144,7 +312,7 @@ class QuestionSerializer(serializers.ModelSerializer):
         fields = ("idencode", "question", "type", "field_type", "options")
 
 
-class StageAnswerSerializer(serializers.ModelSerializer):
+class StageAnswerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Question.
     """
@@ -165,6 +333,7 @@ class StageAnswerSerializer(serializers.ModelSerializer):
             "idencode", "stage_id", "lead_id",
             "question_id", "option_id", "score",
         )
+        read_only_fields = ("score", )
 
     def create(self, validated_data):
         if lead_models.Option.objects.filter(
@@ -176,8 +345,12 @@ class StageAnswerSerializer(serializers.ModelSerializer):
                 question_id=validated_data['question_id'],
                 option_id=validated_data['option_id']).exists():
                 raise serializers.ValidationError("Already selected.")
-            stage_answer = lead_models.StageAnswer.objects.create(
-                **validated_data)
+            try:
+                stage_answer = lead_models.StageAnswer.objects.create(
+                    **validated_data)
+            except IntegrityError:
+                # Selected by a concurrent request since the check.
+                raise serializers.ValidationError("Already selected.")
         else:
             raise serializers.ValidationError(
                 'no question with selected option')
@@ -191,7 +364,7 @@ class StageAnswerSerializer(serializers.ModelSerializer):
         raise serializers.ValidationError('no question with selected option')
     
     
-class GeneralAnswerSerializer(serializers.ModelSerializer):
+class GeneralAnswerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Question.
     """
@@ -208,6 +381,7 @@ class GeneralAnswerSerializer(serializers.ModelSerializer):
         model = lead_models.GeneralAnswer
         fields = (
             "idencode", "lead_id", "question_id", "option_id", "score", )
+        read_only_fields = ("score", )
         
     def create(self, validated_data):
         if lead_models.Option.objects.filter(
@@ -218,8 +392,12 @@ class GeneralAnswerSerializer(serializers.ModelSerializer):
                 question_id=validated_data['question_id'],
                 option_id=validated_data['option_id']).exists():
                 raise serializers.ValidationError("Already selected.")
-            general_answer = lead_models.GeneralAnswer.objects.create(
-                **validated_data)
+            try:
+                general_answer = lead_models.GeneralAnswer.objects.create(
+                    **validated_data)
+            except IntegrityError:
+                # Selected by a concurrent request since the check.
+                raise serializers.ValidationError("Already selected.")
         else:
             raise serializers.ValidationError(
                 'no question with selected option')
@@ -233,7 +411,134 @@ class GeneralAnswerSerializer(serializers.ModelSerializer):
         raise serializers.ValidationError('no question with selected option')
     
 
-class StageSerializer(serializers.ModelSerializer):
+class SubmittedAnswerSerializer(serializers.Serializer):
+    """
+    Serializer for the selected options of a question.
+    """
+    question = serializers.CharField()
+    options = serializers.ListField(
+        child=serializers.CharField(), allow_empty=True)
+
+
+class AnswerSubmissionSerializer(serializers.Serializer):
+    """
+    Serializer for the answers of a lead to a whole questionnaire.
+
+    The answers are stage answers when the stage is given, general
+    answers otherwise. The questions and options are validated with a
+    single query, the questions should be of the preset of the stage, or
+    of the lead for general answers, or without a preset.
+    """
+    lead = custom_fields.IdencodeField(related_model=lead_models.Lead)
+    stage = custom_fields.IdencodeField(
+        related_model=lead_models.Stage, required=False, allow_null=True)
+    answers = SubmittedAnswerSerializer(many=True)
+
+    SINGLE_OPTION_TYPES = (
+        lead_consts.QuestionTypeChoice.RADIO,
+        lead_consts.QuestionTypeChoice.BOOL,
+    )
+
+    def validate(self, attrs):
+        lead = attrs['lead']
+        stage = attrs.get('stage')
+        preset_id = stage.preset_id_id if stage else lead.preset_id_id
+        question_ids = [
+            comm_lib.decode(answer['question']) for answer in attrs['answers']]
+        options = lead_models.Option.objects.filter(
+            question_id__in=[pk for pk in question_ids if pk],
+            is_active=True).select_related('question_id')
+        questions = {}
+        for option in options:
+            question = questions.setdefault(
+                option.question_id_id, (option.question_id, {}))
+            question[1][option.idencode] = option
+
+        errors = []
+        answers = []
+        submitted = set()
+        for question_id, answer in zip(question_ids, attrs['answers']):
+            question, question_options = questions.get(question_id, (None, {}))
+            if (not question or question_id in submitted
+                    or question.preset_id_id not in (preset_id, None)):
+                errors.append({'question': [_('Invalid question.')]})
+                continue
+            submitted.add(question_id)
+            selected = [
+                question_options.get(option) for option in answer['options']]
+            if None in selected:
+                errors.append({'options': [_('Invalid option.')]})
+                continue
+            if (question.field_type in self.SINGLE_OPTION_TYPES
+                    and len(selected) > 1):
+                errors.append({'options': [_('Select only one option.')]})
+                continue
+            errors.append({})
+            answers.append((question, selected))
+        if any(errors):
+            raise serializers.ValidationError({'answers': errors})
+        attrs['answers'] = answers
+        return attrs
+
+
+class LeadImportSerializer(serializers.Serializer):
+    """
+    Serializer for a workbook of leads to import.
+
+    Only the header is read here, the rows are read by the import task.
+    """
+    file = serializers.FileField()
+
+    def validate_file(self, value):
+        if not value.name.lower().endswith(".xlsx"):
+            raise serializers.ValidationError(
+                _("Only .xlsx workbooks can be imported."))
+        try:
+            header = excel.read_header(value)
+        except Exception:
+            raise serializers.ValidationError(_("Invalid workbook."))
+        finally:
+            value.seek(0)
+        columns = set(header) & set(lead_consts.LEAD_IMPORT_COLUMNS)
+        if not columns & {"id", "name", "pipedrive"}:
+            raise serializers.ValidationError(_(
+                "The first row should name the columns, with an id, name "
+                "or pipedrive column."))
+        return value
+
+
+class MergeSerializer(serializers.Serializer):
+    """
+    Serializer for duplicate records to merge into a target.
+
+    The model of the records is given as model in the context, the
+    records are loaded with a single query.
+    """
+    target = serializers.CharField()
+    sources = serializers.ListField(
+        child=serializers.CharField(), min_length=1,
+        max_length=lead_consts.DEDUPE_MAX_MERGE)
+
+    def validate(self, attrs):
+        target_id = comm_lib.decode(attrs['target'])
+        source_ids = [comm_lib.decode(pk) for pk in attrs['sources']]
+        records = self.context['model'].objects.in_bulk(
+            [pk for pk in [target_id] + source_ids if pk])
+        if target_id not in records:
+            raise serializers.ValidationError(
+                {'target': [_('Invalid pk - object does not exist.')]})
+        if any(pk not in records for pk in source_ids):
+            raise serializers.ValidationError(
+                {'sources': [_('Invalid pk - object does not exist.')]})
+        if target_id in source_ids:
+            raise serializers.ValidationError(
+                {'sources': [_('The target can not be merged into itself.')]})
+        attrs['target'] = records[target_id]
+        attrs['sources'] = [records[pk] for pk in dict.fromkeys(source_ids)]
+        return attrs
+
+
+class StageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Stages.
     """
@@ -245,7 +550,8 @@ class StageSerializer(serializers.ModelSerializer):
         fields = ( "idencode", "name", "weightage", "credit", )
 
     
-class ContactSerializer(serializers.ModelSerializer):
+class ContactSerializer(
+        IncludeFieldsMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Contact.
     """
@@ -259,9 +565,13 @@ class ContactSerializer(serializers.ModelSerializer):
         model = lead_models.Contact
         fields = ("idencode", "name", "email", 
                   "organization", "role", "linkedin" )
+        include_fields = {
+            "organization": ("OrganizationSerializer", False),
+        }
 
 
-class LeadContactSerializer(serializers.ModelSerializer):
+class LeadContactSerializer(
+        IncludeFieldsMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for Lead Contact.
     """
@@ -278,4 +588,9 @@ class LeadContactSerializer(serializers.ModelSerializer):
         model = lead_models.LeadContact
         fields = (
             "idencode", "contact_id", "lead_id", "stage_id",
-            "is_decision_maker", "is_board_member", )
\ No newline at end of file
+            "is_decision_maker", "is_board_member", )
+        include_fields = {
+            "contact_id": ("ContactSerializer", False),
+            "lead_id": ("LeadSerializer", False),
+            "stage_id": ("StageSerializer", False),
+        }
\ No newline at end of file
@@ -0,0 +1,272 @@
+"""Signals of the app leadtracker."""
+
+import threading
+import functools
+from contextlib import contextmanager
+
+from django.db import connections
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.signals import pre_save
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from v1.leadtracker import models as lead_models
+from v1.leadtracker import constants as lead_consts
+from v1.leadtracker import functions as lead_functions
+from v1.leadtracker import search as lead_search
+
+from common import cache as cache_lib
+
+DashboardCounter = lead_models.DashboardCounter
+
+_muted = threading.local()
+
+
+@contextmanager
+def muted():
+    """
+    Context manager to skip the receivers of this module.
+
+    To be used by bulk writes that maintain the counters, stage history,
+    scores and caches of all their rows at once.
+    """
+    _muted.depth = getattr(_muted, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _muted.depth -= 1
+
+
+def unless_muted(receiver_function):
+    """Decorator to skip a receiver inside muted()."""
+
+    @functools.wraps(receiver_function)
+    def wrapper(*args, **kwargs):
+        if getattr(_muted, 'depth', 0):
+            return None
+        return receiver_function(*args, **kwargs)
+    return wrapper
+
+
+def get_lead_dimensions(lead_id):
+    """Function to get the dashboard counter dimensions of a lead."""
+    if not lead_id:
+        return None
+    lead = lead_models.Lead.objects.filter(id=lead_id).values(
+        *lead_consts.COUNTER_DIMENSIONS).first()
+    if not lead:
+        return None
+    return DashboardCounter.dimensions(lead)
+
+
+@receiver(pre_save, sender=lead_models.Lead)
+@unless_muted
+def lead_pre_save(sender, instance, **kwargs):
+    """Keep the dimensions of the lead before the update."""
+    instance._previous_dimensions = None
+    if instance.pk:
+        instance._previous_dimensions = get_lead_dimensions(instance.pk)
+
+
+@receiver(post_save, sender=lead_models.Lead)
+@unless_muted
+def lead_post_save(sender, instance, created, **kwargs):
+    """Move the lead and its answers to the counter of its dimensions."""
+    old = getattr(instance, '_previous_dimensions', None)
+    new = DashboardCounter.dimensions(instance)
+    if created or not old:
+        DashboardCounter.add(new, leads=1)
+        return
+    if old == new:
+        return
+    answers = lead_models.StageAnswer.objects.filter(
+        lead_id=instance).order_by().aggregate(
+        answers=Count('id'), points_secured=Sum('score'))
+    answer_count = answers['answers']
+    points_secured = answers['points_secured'] or 0
+    DashboardCounter.add(
+        old, leads=-1, answers=-answer_count, points_secured=-points_secured)
+    DashboardCounter.add(
+        new, leads=1, answers=answer_count, points_secured=points_secured)
+
+
+@receiver(post_save, sender=lead_models.Lead)
+@unless_muted
+def record_stage_transition(sender, instance, created, **kwargs):
+    """Append to the stage history when the stage or status changes."""
+    old = getattr(instance, '_previous_dimensions', None) or {}
+    new = DashboardCounter.dimensions(instance)
+    if old and all(
+            old[key] == new[key] for key in ('current_stage_id', 'status')):
+        return
+    lead_models.LeadStageTransition.objects.create(
+        lead_id=instance,
+        from_stage_id=old.get('current_stage_id'),
+        to_stage_id=new['current_stage_id'],
+        from_status=old.get('status'),
+        to_status=new['status'],
+        creator_id=instance.updater_id or instance.creator_id,
+    )
+
+
+@receiver(pre_delete, sender=lead_models.Lead)
+@unless_muted
+def lead_pre_delete(sender, instance, **kwargs):
+    """Save the rollup days of the lead, before its transitions go."""
+    lead_functions.record_deleted_lead_days([instance.id])
+
+
+@receiver(post_delete, sender=lead_models.Lead)
+@unless_muted
+def lead_post_delete(sender, instance, **kwargs):
+    """
+    Remove the lead from its counter.
+
+    The answers of the lead are deleted before the lead, and they remove
+    themselves from the counter.
+    """
+    DashboardCounter.add(DashboardCounter.dimensions(instance), leads=-1)
+
+
+@receiver(pre_save, sender=lead_models.StageAnswer)
+@receiver(pre_save, sender=lead_models.GeneralAnswer)
+@unless_muted
+def answer_pre_save(sender, instance, **kwargs):
+    """Keep the lead and score of the answer before the update."""
+    instance._previous_score = None
+    if instance.pk:
+        instance._previous_score = sender.objects.filter(
+            id=instance.pk).values_list('lead_id', 'score').first()
+
+
+@receiver(post_save, sender=lead_models.StageAnswer)
+@unless_muted
+def stage_answer_post_save(sender, instance, created, **kwargs):
+    """Add the answer to the counter of its lead."""
+    old = getattr(instance, '_previous_score', None)
+    if not created and old:
+        old_lead_id, old_score = old
+        if old_lead_id == instance.lead_id_id:
+            dimensions = get_lead_dimensions(instance.lead_id_id)
+            if dimensions:
+                DashboardCounter.add(
+                    dimensions, points_secured=instance.score - old_score)
+            return
+        dimensions = get_lead_dimensions(old_lead_id)
+        if dimensions:
+            DashboardCounter.add(
+                dimensions, answers=-1, points_secured=-old_score)
+    dimensions = get_lead_dimensions(instance.lead_id_id)
+    if dimensions:
+        DashboardCounter.add(
+            dimensions, answers=1, points_secured=instance.score)
+
+
+@receiver(post_delete, sender=lead_models.StageAnswer)
+@unless_muted
+def stage_answer_post_delete(sender, instance, **kwargs):
+    """Remove the answer from the counter of its lead."""
+    dimensions = get_lead_dimensions(instance.lead_id_id)
+    if dimensions:
+        DashboardCounter.add(
+            dimensions, answers=-1, points_secured=-instance.score)
+
+
+@receiver(post_save, sender=lead_models.StageAnswer)
+@receiver(post_save, sender=lead_models.GeneralAnswer)
+@receiver(post_delete, sender=lead_models.StageAnswer)
+@receiver(post_delete, sender=lead_models.GeneralAnswer)
+@unless_muted
+def update_lead_score(sender, instance, **kwargs):
+    """Recompute the win possibility of the leads of the answer."""
+    lead_ids = [instance.lead_id_id]
+    old = getattr(instance, '_previous_score', None)
+    if old:
+        lead_ids.append(old[0])
+    lead_functions.update_lead_scores(lead_ids)
+
+
+@receiver(post_save, sender=lead_models.Lead)
+@receiver(post_delete, sender=lead_models.Lead)
+@receiver(post_save, sender=lead_models.StageAnswer)
+@receiver(post_delete, sender=lead_models.StageAnswer)
+@receiver(post_save, sender=lead_models.GeneralAnswer)
+@receiver(post_delete, sender=lead_models.GeneralAnswer)
+@unless_muted
+def invalidate_lead_caches(sender, **kwargs):
+    """Mark the cached lead aggregates stale once the write is committed."""
+    for namespace in lead_consts.LEAD_CACHES:
+        transaction.on_commit(
+            lambda namespace=namespace: cache_lib.invalidate(namespace))
+
+
+@receiver(post_save, sender=lead_models.Organization)
+@receiver(post_delete, sender=lead_models.Organization)
+@receiver(post_save, sender=lead_models.Contact)
+@receiver(post_delete, sender=lead_models.Contact)
+@unless_muted
+def invalidate_duplicates(sender, **kwargs):
+    """Mark the duplicate detection jobs stale."""
+    lead_functions.invalidate_duplicates()
+
+
+@receiver(post_save, sender=lead_models.Lead)
+@unless_muted
+def update_lead_search(sender, instance, **kwargs):
+    """Rebuild the search vector of the lead."""
+    lead_search.update_search_vectors(
+        lead_models.Lead.objects.filter(id=instance.id))
+
+
+@receiver(post_save, sender=lead_models.Organization)
+@unless_muted
+def update_organization_search(sender, instance, created, **kwargs):
+    """Rebuild the search vectors of the leads of the organization."""
+    if not created:
+        lead_search.update_search_vectors(
+            lead_models.Lead.objects.filter(organization=instance))
+
+
+@receiver(post_save, sender=lead_models.Contact)
+@unless_muted
+def update_contact_search(sender, instance, created, **kwargs):
+    """Rebuild the search vectors of the leads of the contact."""
+    if not created:
+        lead_search.update_search_vectors(
+            lead_models.Lead.objects.filter(lead_contacts__contact_id=instance))
+
+
+@receiver(post_save, sender=lead_models.Tag)
+@unless_muted
+def update_tag_search(sender, instance, created, **kwargs):
+    """Rebuild the search vectors of the leads of the tag."""
+    if not created:
+        lead_search.update_search_vectors(
+            lead_models.Lead.objects.filter(tags__tag_id=instance))
+
+
+@receiver(post_save, sender=lead_models.LeadContact)
+@receiver(post_delete, sender=lead_models.LeadContact)
+@receiver(post_save, sender=lead_models.LeadTag)
+@receiver(post_delete, sender=lead_models.LeadTag)
+@unless_muted
+def update_lead_link_search(sender, instance, **kwargs):
+    """Rebuild the search vector of the lead of the contact or tag."""
+    if instance.lead_id_id:
+        lead_search.update_search_vectors(
+            lead_models.Lead.objects.filter(id=instance.lead_id_id))
+
+
+def create_extensions(sender, using, **kwargs):
+    """
+    Create the postgres extensions of the indexes of the app before its
+    tables, the app has no migrations to create them.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
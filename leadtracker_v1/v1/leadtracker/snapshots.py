@@ -0,0 +1,236 @@
+"""
+Columnar snapshots of the leadtracker tables for offline analytics.
+
+The tables are read in one repeatable read transaction, so all the files
+of a snapshot show the database at the same instant, and streamed with a
+server side cursor into Parquet files, one row group per batch. Columns
+with choices are stored dictionary encoded with their labels.
+
+The files of a snapshot are written in a partition of each table,
+    <root>/<table>/snapshot=<id>/part-0.parquet
+and the snapshots are listed in <root>/_manifest.json. A snapshot holds
+the rows updated since the previous one, or all the rows for a full
+snapshot. The incremental snapshots overlap by SNAPSHOT_OVERLAP to
+include the rows committed late, readers keep the row of each id with
+the latest updated_on. Deleted rows are only dropped by a full snapshot.
+"""
+
+import os
+import json
+import shutil
+import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from django.conf import settings
+from django.db import models
+from django.db import connection
+from django.db import transaction
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.contrib.postgres.search import SearchVectorField
+
+from v1.leadtracker import models as lead_model
+
+
+SNAPSHOT_MODELS = [
+    lead_model.Lead,
+    lead_model.Organization,
+    lead_model.Contact,
+    lead_model.LeadContact,
+    lead_model.StageAnswer,
+    lead_model.GeneralAnswer,
+    lead_model.Question,
+    lead_model.Option,
+]
+
+MANIFEST = "_manifest.json"
+# Rows written as one row group.
+SNAPSHOT_BATCH_SIZE = 50000
+# Overlap of the incremental snapshots, for the rows committed late.
+SNAPSHOT_OVERLAP = datetime.timedelta(minutes=5)
+# Seconds after which the lock of a snapshot is released.
+SNAPSHOT_LOCK_TIMEOUT = 6 * 60 * 60
+SNAPSHOT_LOCK = "snapshot:lock"
+
+FIELD_TYPES = [
+    (models.BooleanField, pa.bool_()),
+    (models.FloatField, pa.float64()),
+    (models.DecimalField, pa.float64()),
+    (models.DateTimeField, pa.timestamp("us", tz="UTC")),
+    (models.DateField, pa.date32()),
+    (models.IntegerField, pa.int64()),
+    (models.AutoField, pa.int64()),
+    (models.ForeignKey, pa.int64()),
+]
+
+
+def get_columns(model):
+    """
+    Function to get the columns of the snapshot of a model.
+
+    Input Params:
+        model(obj): model class.
+    Returns:
+        (list): column name, Arrow type and labels of the choices by
+            value, for each concrete field.
+    """
+    columns = []
+    for field in model._meta.concrete_fields:
+        if isinstance(field, SearchVectorField):
+            continue
+        if field.choices:
+            labels = {value: str(label) for value, label in field.choices}
+            columns.append(
+                (field.attname, pa.dictionary(pa.int16(), pa.string()),
+                 labels))
+            continue
+        arrow_type = pa.string()
+        for field_class, field_type in FIELD_TYPES:
+            if isinstance(field, field_class):
+                arrow_type = field_type
+                break
+        columns.append((field.attname, arrow_type, None))
+    return columns
+
+
+def get_array(values, arrow_type, labels):
+    """Function to convert the values of a column to an Arrow array."""
+    if labels is None:
+        return pa.array(values, type=arrow_type)
+    dictionary = list(labels.values())
+    positions = {value: index for index, value in enumerate(labels)}
+    indices = pa.array(
+        [positions.get(value) for value in values], type=pa.int16())
+    return pa.DictionaryArray.from_arrays(
+        indices, pa.array(dictionary, type=pa.string()))
+
+
+def write_table(queryset, path, batch_size=SNAPSHOT_BATCH_SIZE):
+    """
+    Function to stream a queryset into a Parquet file.
+
+    Input Params:
+        queryset(obj): rows to write.
+        path(str): path of the file, not created if there are no rows.
+        batch_size(int): rows read and written at a time.
+    Returns:
+        (int): number of rows written.
+    """
+    columns = get_columns(queryset.model)
+    schema = pa.schema([(name, arrow_type) for name, arrow_type, _ in columns])
+    rows = queryset.order_by().values_list(
+        *[name for name, _, _ in columns]).iterator(chunk_size=batch_size)
+    writer = None
+    count = 0
+    try:
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+            arrays = [
+                get_array(values, arrow_type, labels)
+                for values, (_, arrow_type, labels) in zip(
+                    zip(*batch), columns)]
+            if writer is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def get_partition(root, table, snapshot_id):
+    """Function to get the folder of a table in a snapshot."""
+    return os.path.join(root, table, "snapshot=%s" % snapshot_id)
+
+
+def read_manifest(root):
+    """Function to read the manifest of the snapshots in a folder."""
+    path = os.path.join(root, MANIFEST)
+    if not os.path.exists(path):
+        return {"until": None, "snapshots": []}
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_manifest(root, manifest):
+    """Function to replace the manifest, without leaving it partial."""
+    path = os.path.join(root, MANIFEST)
+    with open(path + ".tmp", "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def write_snapshot(root=None, full=False, batch_size=SNAPSHOT_BATCH_SIZE):
+    """
+    Function to write a snapshot of the leadtracker tables.
+
+    Input Params:
+        root(str): folder of the snapshots, settings.SNAPSHOT_ROOT if None.
+        full(bool): write all the rows instead of the updated ones.
+        batch_size(int): rows read and written at a time.
+    Returns:
+        (dict): snapshot with its id, range and rows by table, None if
+            another snapshot is being written.
+    """
+    root = root or settings.SNAPSHOT_ROOT
+    if not cache.add(SNAPSHOT_LOCK, True, timeout=SNAPSHOT_LOCK_TIMEOUT):
+        return None
+    try:
+        os.makedirs(root, exist_ok=True)
+        manifest = read_manifest(root)
+        since = None
+        if manifest["until"] and not full:
+            since = parse_datetime(manifest["until"]) - SNAPSHOT_OVERLAP
+
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ "
+                        "READ ONLY")
+                    cursor.execute("SELECT now()")
+                    until = cursor.fetchone()[0]
+            else:
+                until = timezone.now()
+            snapshot_id = until.strftime("%Y%m%dT%H%M%S")
+            if full:
+                snapshot_id += "-full"
+            rows = {}
+            try:
+                for model in SNAPSHOT_MODELS:
+                    queryset = model.objects.filter(updated_on__lte=until)
+                    if since:
+                        queryset = queryset.filter(updated_on__gt=since)
+                    table = model._meta.db_table
+                    rows[table] = write_table(
+                        queryset, os.path.join(
+                            get_partition(root, table, snapshot_id),
+                            "part-0.parquet"),
+                        batch_size)
+            except Exception:
+                for model in SNAPSHOT_MODELS:
+                    shutil.rmtree(get_partition(
+                        root, model._meta.db_table, snapshot_id),
+                        ignore_errors=True)
+                raise
+
+        snapshot = {
+            "id": snapshot_id,
+            "full": full,
+            "since": since.isoformat() if since else None,
+            "until": until.isoformat(),
+            "rows": rows,
+        }
+        manifest["until"] = until.isoformat()
+        manifest["snapshots"].append(snapshot)
+        write_manifest(root, manifest)
+        return snapshot
+    finally:
+        cache.delete(SNAPSHOT_LOCK)
@@ -0,0 +1,109 @@
+"""Celery tasks of the app leadtracker."""
+
+from celery import shared_task
+
+from django.core.files.storage import default_storage
+
+from common import jobs
+from common import cache as cache_lib
+
+from v1.leadtracker import constants as lead_consts
+from v1.leadtracker import functions as lead_functions
+from v1.leadtracker import scoring
+from v1.leadtracker import imports as lead_imports
+from v1.leadtracker import snapshots
+from v1.leadtracker import dedupe
+
+
+@shared_task(name="refresh_lead_rollups")
+def refresh_lead_rollups(days=lead_consts.ROLLUP_REFRESH_DAYS):
+    """
+    Task to refresh the daily lead rollups of the recent changes.
+
+    Input Params:
+        days(int): number of days of changes to process.
+    """
+    changed_days = lead_functions.refresh_lead_rollups(days)
+    return [day.isoformat() for day in changed_days]
+
+
+@shared_task(name="compute_dashboard")
+def compute_dashboard(job_id, params):
+    """
+    Task to compute the dashboard of an async dashboard request.
+
+    The result is stored in the job, to be polled by the client.
+
+    Input Params:
+        job_id(str): id of the job.
+        params(dict): params from get_dashboard_params.
+    """
+    jobs.run_job(job_id, lambda: lead_functions.get_dashboard(params))
+
+
+@shared_task(name="rescore_answers")
+def rescore_answers(question_ids=None, option_ids=None):
+    """
+    Task to rescore the answers after question credits or option points
+    are changed. The dashboard counters are moved by rescore_answers.
+
+    Input Params:
+        question_ids(list): ids of the questions with a changed credit.
+        option_ids(list): ids of the options with changed points.
+    """
+    result = scoring.rescore_answers(question_ids, option_ids)
+    for namespace in lead_consts.LEAD_CACHES:
+        cache_lib.invalidate(namespace)
+    return result
+
+
+@shared_task(name="import_leads")
+def import_leads(job_id, params):
+    """
+    Task to import the leads of an uploaded workbook.
+
+    The processed, created, updated and failed rows are stored in the job
+    after each chunk, to be polled by the client. The workbook is deleted
+    once imported.
+
+    Input Params:
+        job_id(str): id of the job.
+        params(dict): storage path of the workbook and id of the user.
+    """
+    def progress(result):
+        jobs.set_job(job_id, jobs.JOB_RUNNING, result=result)
+
+    def compute():
+        with default_storage.open(params["path"]) as file:
+            return lead_imports.import_leads(
+                file, params.get("user_id"), progress=progress)
+
+    try:
+        jobs.run_job(job_id, compute)
+    finally:
+        default_storage.delete(params["path"])
+
+
+@shared_task(name="write_snapshot")
+def write_snapshot(full=False):
+    """
+    Task to write a snapshot of the leadtracker tables for analytics.
+
+    Input Params:
+        full(bool): write all the rows instead of the updated ones.
+    """
+    return snapshots.write_snapshot(full=full)
+
+
+@shared_task(name="find_duplicates")
+def find_duplicates(job_id, params):
+    """
+    Task to find the clusters of duplicate organizations or contacts.
+
+    The clusters are stored in the job, to be polled by the client.
+
+    Input Params:
+        job_id(str): id of the job.
+        params(dict): kind of the records, organization or contact.
+    """
+    jobs.run_job(job_id, lambda: dedupe.find_duplicates(params["kind"]))
@@ -1,3 +1,553 @@
+from datetime import timedelta
+
+import os
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.db import connection
+from django.db import transaction
 from django.test import TestCase
+from django.utils import timezone
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from common import jobs
+from common.exceptions import BadRequest
+
+from v1.leadtracker import models as lead_models
+from v1.leadtracker import constants as lead_consts
+from v1.leadtracker import dedupe
+from v1.leadtracker import functions as lead_functions
+from v1.leadtracker import pipedrive
+from v1.leadtracker import scoring
+from v1.leadtracker import search as lead_search
+from v1.leadtracker import tasks
+from v1.leadtracker.filters import LeadFilter
+from v1.leadtracker.serializers import lead as lead_serializers
+from v1.leadtracker.views.lead import LeadViewSet
+
+
+class DashboardCounterTest(TestCase):
+    """Tests of the materialized dashboard counters."""
+
+    def test_unique_without_preset_and_stage(self):
+        dimensions = {
+            "preset_id": None, "current_stage": None,
+            "lead_source": lead_consts.LeadSourceChoice.LINKEDIN,
+            "status": lead_consts.StatusChoice.ACTIVE}
+        lead_models.DashboardCounter.objects.create(**dimensions)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            lead_models.DashboardCounter.objects.create(**dimensions)
+
+    def test_add_uses_one_counter(self):
+        dimensions = lead_models.DashboardCounter.dimensions({
+            "preset_id_id": None, "current_stage_id": "",
+            "lead_source": lead_consts.LeadSourceChoice.LINKEDIN,
+            "status": lead_consts.StatusChoice.ACTIVE})
+        lead_models.DashboardCounter.add(dimensions, leads=1)
+        lead_models.DashboardCounter.add(dimensions, leads=2)
+        counters = lead_models.DashboardCounter.objects.filter(
+            preset_id=None, current_stage=None)
+        self.assertEqual(list(counters.values_list("leads", flat=True)), [3])
+
+
+class DashboardTest(TestCase):
+    """Tests of the dashboard sections."""
+
+    def setUp(self):
+        for index, possibility in enumerate((0.05, 0.55, 0.58, 1.0)):
+            lead_models.Lead.objects.create(
+                name="Lead %d" % index, possibility=possibility,
+                credit_registered=10)
+
+    def test_possibility_histogram(self):
+        data = lead_functions.get_dashboard({"sections": ["possibility"]})
+        self.assertEqual(
+            [bucket["count"] for bucket in data["possibility"]],
+            [1, 0, 0, 0, 0, 2, 0, 0, 0, 1])
+        self.assertEqual(
+            (data["possibility"][5]["from"], data["possibility"][5]["to"]),
+            (0.5, 0.6))
+
+    def test_top_leads_are_not_default(self):
+        params = lead_functions.get_dashboard_params({})
+        self.assertNotIn("top_leads", params["sections"])
+        data = lead_functions.get_dashboard({"sections": ["top_leads"]})
+        self.assertEqual(
+            [lead["name"] for lead in data["top_leads"]],
+            ["Lead 3", "Lead 2", "Lead 1", "Lead 0"])
+
+
+class ScoredLeadMixin:
+    """Creates a lead with a general answer scored 3 points * 2 credit."""
+
+    def setUp(self):
+        self.lead = lead_models.Lead.objects.create(name="Scored lead")
+        question = lead_models.Question.objects.create(
+            question="Budget?", credit=2)
+        self.option = lead_models.Option.objects.create(
+            question_id=question, option="Yes", points=3)
+        lead_models.GeneralAnswer.objects.create(
+            lead_id=self.lead, question_id=question, option_id=self.option)
+
+
+class LeadScoreTest(ScoredLeadMixin, TestCase):
+    """Tests of the stored lead scores."""
+
+    def test_unchanged_scores_are_not_written(self):
+        updated_on = lead_models.Lead.objects.get(id=self.lead.id).updated_on
+        self.assertEqual(lead_functions.update_lead_scores([self.lead.id]), 0)
+        lead = lead_models.Lead.objects.get(id=self.lead.id)
+        self.assertEqual(lead.updated_on, updated_on)
+        self.assertEqual(lead.points_secured, 6)
+        self.assertEqual(lead.credit_registered, 10)
+        self.assertEqual(lead.possibility, 0.6)
+
+    def test_changed_scores_are_written(self):
+        lead_models.GeneralAnswer.objects.filter(
+            lead_id=self.lead).update(score=10)
+        self.assertEqual(lead_functions.update_lead_scores([self.lead.id]), 1)
+        lead = lead_models.Lead.objects.get(id=self.lead.id)
+        self.assertEqual(lead.points_secured, 10)
+
+
+class AnswerConflictTest(ScoredLeadMixin, TestCase):
+    """Tests of answers selected by concurrent requests."""
+
+    def setUp(self):
+        super().setUp()
+        self.other = lead_models.Option.objects.create(
+            question_id=self.option.question_id, option="No", points=1)
+
+    def test_submission_conflict_is_bad_request(self):
+        bulk_create = lead_models.GeneralAnswer.objects.bulk_create
+
+        def racing_bulk_create(objs, *args, **kwargs):
+            lead_models.GeneralAnswer.objects.create(
+                lead_id=self.lead, question_id=self.option.question_id,
+                option_id=self.other)
+            return bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(
+                lead_models.GeneralAnswer.objects, "bulk_create",
+                side_effect=racing_bulk_create):
+            with self.assertRaises(BadRequest):
+                lead_functions.save_answers(
+                    self.lead, None,
+                    [(self.option.question_id, [self.option, self.other])])
+        self.assertEqual(
+            lead_models.GeneralAnswer.objects.filter(
+                lead_id=self.lead).count(), 1)
+
+    def test_single_answer_conflict_is_validation_error(self):
+        answer = {
+            "lead_id": self.lead,
+            "stage_id": lead_models.Stage.objects.create(name="Demo"),
+            "question_id": self.option.question_id,
+            "option_id": self.option}
+        lead_models.StageAnswer.objects.create(**answer)
+        serializer = lead_serializers.StageAnswerSerializer()
+        # The answer is selected after the serializer checked it was not.
+        with mock.patch.object(
+                lead_models.StageAnswer.objects, "filter",
+                return_value=lead_models.StageAnswer.objects.none()):
+            with self.assertRaisesMessage(
+                    ValidationError, "Already selected."):
+                serializer.create(answer)
+
+    def test_answers_without_stage_are_unique(self):
+        answer = {
+            "lead_id": self.lead, "question_id": self.option.question_id,
+            "option_id": self.option}
+        lead_models.StageAnswer.objects.create(**answer)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            lead_models.StageAnswer.objects.create(**answer)
+
+
+class RescoringTest(ScoredLeadMixin, TestCase):
+    """Tests of the vectorized rescoring of the answers."""
+
+    def test_unchanged_leads_are_not_written(self):
+        updated_on = lead_models.Lead.objects.get(id=self.lead.id).updated_on
+        self.assertEqual(scoring.rescore_lead_chunk([self.lead.id]), 0)
+        lead = lead_models.Lead.objects.get(id=self.lead.id)
+        self.assertEqual(lead.updated_on, updated_on)
+
+    def test_changed_points_are_written(self):
+        lead_models.Option.objects.filter(id=self.option.id).update(points=4)
+        self.assertEqual(scoring.rescore_lead_chunk([self.lead.id]), 1)
+        lead = lead_models.Lead.objects.get(id=self.lead.id)
+        self.assertEqual(lead.points_secured, 8)
+        self.assertEqual(lead.possibility, 0.8)
+
+    def test_counters_move_by_the_change(self):
+        lead_models.StageAnswer.objects.create(
+            lead_id=self.lead, question_id=self.option.question_id,
+            stage_id=lead_models.Stage.objects.create(name="Demo"),
+            option_id=self.option)
+        dimensions = lead_models.DashboardCounter.dimensions(
+            lead_models.Lead.objects.get(id=self.lead.id))
+        counter = lead_models.DashboardCounter.objects.filter(**dimensions)
+        self.assertEqual(counter.get().points_secured, 6)
+        # Added by a concurrent write, kept by the rescoring.
+        lead_models.DashboardCounter.add(dimensions, leads=5)
+
+        lead_models.Option.objects.filter(id=self.option.id).update(points=4)
+        tasks.rescore_answers(option_ids=[self.option.id])
+        self.assertEqual(
+            (counter.get().leads, counter.get().points_secured), (6, 8))
+
+    def test_possibility_is_at_most_one(self):
+        lead_models.Option.objects.filter(id=self.option.id).update(points=8)
+        scoring.rescore_lead_chunk([self.lead.id])
+        lead = lead_models.Lead.objects.get(id=self.lead.id)
+        self.assertEqual(lead.points_secured, 16)
+        self.assertEqual(lead.possibility, 1)
+        lead_models.Lead.objects.filter(id=self.lead.id).update(revenue=100)
+        forecast = lead_functions.get_forecast()
+        self.assertEqual(forecast["by_stage"][0]["expected_revenue"], 100)
+
+
+class LeadRollupTest(TestCase):
+    """Tests of the daily lead rollups."""
+
+    def test_refresh_removes_deleted_lead(self):
+        lead = lead_models.Lead.objects.create(name="Old lead")
+        created_on = timezone.now() - timedelta(days=60)
+        lead_models.Lead.objects.filter(id=lead.id).update(
+            created_on=created_on)
+        day = timezone.localdate(created_on)
+        lead_functions.rebuild_lead_rollups(day, day + timedelta(days=1))
+        rollups = lead_models.LeadDailyRollup.objects.filter(day=day)
+        self.assertEqual(rollups.count(), 1)
+
+        lead_models.Lead.objects.get(id=lead.id).delete()
+        self.assertIn(day, lead_functions.refresh_lead_rollups(days=1))
+        self.assertFalse(rollups.exists())
+        self.assertFalse(lead_models.RollupRefreshDay.objects.exists())
+
+
+class JobTest(TestCase):
+    """Tests of the background jobs."""
+
+    def test_dead_running_job_is_started_again(self):
+        task = mock.Mock()
+        job = jobs.start_job("test_jobs", {"n": 1}, task)
+        jobs.set_job(job["id"], jobs.JOB_RUNNING, started_on=1)
+        self.assertEqual(
+            jobs.start_job("test_jobs", {"n": 1}, task)["status"],
+            jobs.JOB_PENDING)
+        self.assertEqual(task.delay.call_count, 2)
+
+    def test_running_job_is_shared(self):
+        task = mock.Mock()
+        job = jobs.start_job("test_jobs", {"n": 2}, task)
+        jobs.set_job(job["id"], jobs.JOB_RUNNING, started_on=time.time())
+        jobs.set_job(job["id"], jobs.JOB_RUNNING, result={"processed": 1})
+        self.assertIsNotNone(jobs.get_job(job["id"])["started_on"])
+        self.assertEqual(
+            jobs.start_job("test_jobs", {"n": 2}, task)["status"],
+            jobs.JOB_RUNNING)
+        self.assertEqual(task.delay.call_count, 1)
+
+
+class LeadDetailTest(TestCase):
+    """Tests of the full lead page."""
+
+    def setUp(self):
+        organization = lead_models.Organization.objects.create(
+            name="Initech", email="info@initech.example")
+        stage = lead_models.Stage.objects.create(name="Discovery")
+        self.lead = lead_models.Lead.objects.create(
+            name="Upgrade", organization=organization, current_stage=stage)
+        contact = lead_models.Contact.objects.create(
+            name="Peter", email="peter@initech.example",
+            role=lead_consts.RoleChoice.CEO,
+            organization=organization)
+        lead_models.LeadContact.objects.create(
+            contact_id=contact, lead_id=self.lead, stage_id=stage)
+        lead_models.LeadTag.objects.create(
+            lead_id=self.lead,
+            tag_id=lead_models.Tag.objects.create(name="Renewal"))
+        question = lead_models.Question.objects.create(question="Budget?")
+        option = lead_models.Option.objects.create(
+            question_id=question, option="Yes", points=3)
+        lead_models.StageAnswer.objects.create(
+            lead_id=self.lead, stage_id=stage, question_id=question,
+            option_id=option)
+        lead_models.StageAnswer.objects.create(
+            lead_id=self.lead, question_id=question, option_id=option)
+        lead_models.GeneralAnswer.objects.create(
+            lead_id=self.lead, question_id=question)
+        lead_models.GeneralAnswer.objects.create(
+            lead_id=self.lead, option_id=option)
+
+    def test_full_lead_in_five_queries(self):
+        client = APIClient()
+        with mock.patch.object(LeadViewSet, "permission_classes", ()):
+            with self.assertNumQueries(5):
+                response = client.get(
+                    "/v1/leadtracker/lead/%s/full/" % self.lead.idencode)
+        self.assertEqual(response.status_code, 200)
+        stages = response.data["stage_answers"]
+        self.assertEqual(stages[0]["stage"]["name"], "Discovery")
+        self.assertIsNone(stages[1]["stage"])
+        self.assertEqual(len(stages[1]["questions"]), 1)
+        self.assertEqual(response.data["general_answers"], [])
+
+
+class LeadSearchTest(TestCase):
+    """Tests of the full text search of leads."""
+
+    def test_lead_found_by_organization(self):
+        organization = lead_models.Organization.objects.create(
+            name="Globex", email="info@globex.example")
+        lead = lead_models.Lead.objects.create(
+            name="Renewal", organization=organization)
+        self.assertEqual(
+            list(lead_search.search_leads("glob")), [lead])
+
+
+class PipedriveImportTest(TestCase):
+    """Tests of the import of the Pipedrive exports of fixtures/pipedrive."""
+
+    def import_exports(self, extension):
+        path = os.path.join(
+            os.path.dirname(__file__), "fixtures", "pipedrive",
+            "%s." + extension)
+        return pipedrive.import_pipedrive(
+            "acme", organizations=path % "organizations",
+            persons=path % "persons", deals=path % "deals")
+
+    def test_upsert_keys(self):
+        organization = lead_models.Organization.objects.create(
+            name="Acme", email="sales@acme.example")
+        contact = lead_models.Contact.objects.create(
+            name="Ann", email="ann@acme.example",
+            role=lead_consts.RoleChoice.CEO)
+        result = self.import_exports("json")
+        self.assertEqual(
+            (result["organizations"]["created"],
+             result["organizations"]["updated"]), (1, 1))
+        self.assertEqual(
+            (result["persons"]["created"], result["persons"]["updated"]),
+            (1, 1))
+        self.assertEqual(result["deals"]["created"], 2)
+
+        organization.refresh_from_db()
+        self.assertEqual(
+            (organization.email, organization.country),
+            ("sales@acme.example", "India"))
+        contact.refresh_from_db()
+        self.assertEqual(contact.name, "Ann Smith")
+        self.assertEqual(contact.organization_id, organization.id)
+        lead = lead_models.Lead.objects.get(
+            pipedrive="https://acme.pipedrive.com/deal/31")
+        self.assertEqual(lead.organization_id, organization.id)
+        self.assertEqual(
+            list(lead.lead_contacts.values_list("contact_id", flat=True)),
+            [contact.id])
+        self.assertEqual(
+            lead_models.Lead.objects.get(
+                pipedrive="https://acme.pipedrive.com/deal/32").status,
+            lead_consts.StatusChoice.WON)
+
+    def test_reimport_skips_unchanged_records(self):
+        self.import_exports("csv")
+        updated_on = dict(
+            lead_models.Lead.objects.values_list("id", "updated_on"))
+        result = self.import_exports("json")
+        for name, skipped in (
+                ("organizations", 2), ("persons", 2), ("deals", 3)):
+            self.assertEqual(result[name]["skipped"], skipped)
+            self.assertEqual(result[name]["created"], 0)
+            self.assertEqual(result[name]["updated"], 0)
+        self.assertEqual(
+            dict(lead_models.Lead.objects.values_list("id", "updated_on")),
+            updated_on)
+
+    def test_reimport_keeps_missing_references(self):
+        self.import_exports("json")
+        result = {"deals": {
+            "processed": 0, "created": 0, "updated": 0, "skipped": 0,
+            "failed": 0}, "errors": []}
+        pipedrive.import_deals([{
+            "id": 31, "title": "Acme renewal", "status": "open",
+            "org_id": {"value": 19, "name": "Initech"},
+            "expected_close_date": None,
+            "update_time": "2026-02-01 10:00:00"}], "acme", result)
+        self.assertEqual(result["deals"]["updated"], 1)
+        lead = lead_models.Lead.objects.get(
+            pipedrive="https://acme.pipedrive.com/deal/31")
+        self.assertEqual(lead.organization.name, "Acme")
+        self.assertEqual(str(lead.expected_close_on), "2026-03-01")
+        self.assertEqual(lead.revenue, 1000)
+
+    def test_deleted_deal_is_skipped(self):
+        result = self.import_exports("csv")
+        self.assertEqual(result["deals"]["skipped"], 1)
+        self.assertEqual(result["deals"]["failed"], 0)
+        self.assertFalse(lead_models.Lead.objects.filter(
+            pipedrive="https://acme.pipedrive.com/deal/33").exists())
+        self.assertFalse(lead_models.PipedriveSync.objects.filter(
+            kind=lead_consts.PipedriveKindChoice.DEAL,
+            pipedrive_id=33).exists())
+
+
+class MergeTest(TestCase):
+    """Tests of the merge of duplicate organizations and contacts."""
+
+    def setUp(self):
+        path = os.path.join(
+            os.path.dirname(__file__), "fixtures", "pipedrive", "%s.json")
+        pipedrive.import_pipedrive(
+            "acme", organizations=path % "organizations",
+            persons=path % "persons", deals=path % "deals")
+
+    def get_synced_object(self, kind, pipedrive_id):
+        return lead_models.PipedriveSync.objects.get(
+            kind=kind, pipedrive_id=pipedrive_id).object_id
+
+    def test_merge_organizations_moves_pipedrive_records(self):
+        source = lead_models.Organization.objects.get(name="Acme")
+        target = lead_models.Organization.objects.create(
+            name="Acme Inc", email="info@acme.example")
+        result = dedupe.merge_organizations(target, [source])
+        self.assertEqual(result["leads"], 1)
+        self.assertFalse(lead_models.Organization.objects.filter(
+            id=source.id).exists())
+        self.assertEqual(
+            self.get_synced_object(
+                lead_consts.PipedriveKindChoice.ORGANIZATION, 11),
+            target.id)
+
+    def test_merge_contacts_moves_pipedrive_records(self):
+        source = lead_models.Contact.objects.get(email="ann@acme.example")
+        target = lead_models.Contact.objects.create(
+            name="Ann Smith", email="ann.smith@acme.example",
+            role=lead_consts.RoleChoice.CEO)
+        result = dedupe.merge_contacts(target, [source])
+        self.assertEqual(result["lead_contacts"], 1)
+        self.assertEqual(
+            self.get_synced_object(
+                lead_consts.PipedriveKindChoice.PERSON, 21),
+            target.id)
+
+
+class DuplicateJobTest(TestCase):
+    """Tests that the duplicate jobs are not shared after writes."""
+
+    def setUp(self):
+        cache.clear()
+        self.task = mock.Mock()
+        # The test transaction is never committed.
+        patcher = mock.patch.object(
+            transaction, "on_commit", side_effect=lambda func: func())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def start_job(self):
+        return jobs.start_job(
+            lead_consts.DEDUPE_CACHE, {"kind": "organization"}, self.task)
+
+    def test_saved_organization_starts_new_job(self):
+        job = self.start_job()
+        self.assertEqual(self.start_job()["id"], job["id"])
+        lead_models.Organization.objects.create(
+            name="Acme", email="info@acme.example")
+        self.assertNotEqual(self.start_job()["id"], job["id"])
+        self.assertEqual(self.task.delay.call_count, 2)
+
+    def test_pipedrive_import_starts_new_job(self):
+        job = self.start_job()
+        pipedrive.import_pipedrive(
+            "acme", organizations=os.path.join(
+                os.path.dirname(__file__), "fixtures", "pipedrive",
+                "organizations.json"))
+        self.assertNotEqual(self.start_job()["id"], job["id"])
+
+
+class LeadFilterIndexTest(TestCase):
+    """Tests that the paginated lead filters are planned on their indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        stages = [
+            lead_models.Stage.objects.create(name="Stage %d" % index)
+            for index in range(50)]
+        presets = [
+            lead_models.StagePreset.objects.create(name="Preset %d" % index)
+            for index in range(50)]
+        organizations = [
+            lead_models.Organization.objects.create(
+                name="Organization %d" % index,
+                email="org%d@example.com" % index)
+            for index in range(50)]
+        lead_models.Lead.objects.bulk_create([
+            lead_models.Lead(
+                name="Lead %d" % index, status=index % 3 + 1,
+                lead_source=index % 5 + 1, possibility=index % 100 / 100,
+                current_stage=stages[index % 50],
+                preset_id=presets[index // 50 % 50],
+                organization=organizations[index // 7 % 50])
+            for index in range(5000)])
+        tags = [
+            lead_models.Tag.objects.create(name="Tag %d" % index)
+            for index in range(50)]
+        lead_models.LeadTag.objects.bulk_create([
+            lead_models.LeadTag(lead_id=lead, tag_id=tags[index % 50])
+            for index, lead in enumerate(lead_models.Lead.objects.all())])
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE leadtracker_lead")
+            cursor.execute("ANALYZE leadtracker_leadtag")
+        cls.stage, cls.preset = stages[0], presets[0]
+        cls.organization, cls.tag = organizations[0], tags[0]
+
+    def assertUsesIndex(self, params, index):
+        queryset = LeadFilter(
+            params, queryset=lead_models.Lead.objects.all()).qs
+        self.assertIn(index, queryset[:20].explain())
+
+    def test_status_by_possibility(self):
+        self.assertUsesIndex(
+            {"status": "1", "ordering": "-possibility"},
+            "lead_status_possibility_idx")
+
+    def test_status_by_created_on(self):
+        self.assertUsesIndex(
+            {"status": "2", "ordering": "-created_on"},
+            "lead_status_created_idx")
+
+    def test_source_by_created_on(self):
+        self.assertUsesIndex(
+            {"lead_source": "1", "ordering": "-created_on"},
+            "lead_source_created_idx")
+
+    def test_stage_and_status(self):
+        self.assertUsesIndex(
+            {"current_stage": self.stage.idencode, "status": "1"},
+            "lead_stage_status_idx")
+
+    def test_preset_and_status(self):
+        self.assertUsesIndex(
+            {"preset": self.preset.idencode, "status": "1"},
+            "lead_preset_status_idx")
+
+    def test_organization_by_created_on(self):
+        self.assertUsesIndex(
+            {"organization": self.organization.idencode,
+             "ordering": "-created_on"},
+            "lead_org_created_idx")
+
+    def test_ranges(self):
+        later = str(int(time.time()) + 3600)
+        self.assertUsesIndex({"updated_from": later}, "lead_updated_idx")
+        self.assertUsesIndex({"revenue_min": "100"}, "lead_revenue_idx")
+        self.assertUsesIndex({"team_size_min": "100"}, "lead_team_size_idx")
 
-# Create your tests here.
+    def test_tag(self):
+        self.assertUsesIndex(
+            {"tag": self.tag.idencode}, "leadtag_tag_lead_idx")
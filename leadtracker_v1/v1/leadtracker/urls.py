@@ -26,7 +26,15 @@ router.register("generalanswer", lead_view.GeneralAnswerView,
 urlpatterns = [
     path("", include(router.urls)),
     
+    path("answers/submit/", lead_view.AnswerSubmissionView.as_view()),
+    path("search/", lead_view.LeadSearchView.as_view()),
+    path("typeahead/<str:kind>/", lead_view.TypeaheadView.as_view()),
     path("dashboard/", lead_view.DashboardView.as_view()),
+    path("dashboard/cache/", lead_view.DashboardCacheView.as_view()),
+    path("dashboard/jobs/<str:job_id>/", lead_view.DashboardJobView.as_view()),
+    path("analytics/stages/", lead_view.StageAnalyticsView.as_view()),
+    path("analytics/cohorts/", lead_view.CohortView.as_view()),
+    path("analytics/forecast/", lead_view.ForecastView.as_view()),
     
     # path("makewon/", lead_view.MakeLeadWon.as_view()),
 
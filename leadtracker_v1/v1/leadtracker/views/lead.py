@@ -1,25 +1,123 @@
+import uuid
+
+from django.core.files.storage import default_storage
+
 from rest_framework import viewsets
 from rest_framework import generics
 from rest_framework import status
 from rest_framework.response import Response
+from rest_framework.decorators import action
+
+from django.contrib.postgres.aggregates import StringAgg
 
 from v1.leadtracker import models as lead_model
 from v1.accounts import permissions as user_permission
 from v1.leadtracker.serializers import lead as lead_serializer
 from v1.leadtracker.functions import get_dashboard
+from v1.leadtracker.functions import get_dashboard_params
+from v1.leadtracker.functions import get_stage_analytics
+from v1.leadtracker.functions import get_cohorts
+from v1.leadtracker.functions import get_forecast
+from v1.leadtracker import constants as lead_consts
+from v1.leadtracker.filters import LeadFilter
+from v1.leadtracker import tasks as lead_tasks
+from v1.leadtracker import signals as lead_signals
+from v1.leadtracker import functions as lead_functions
+from v1.leadtracker import search as lead_search
+from v1.leadtracker import dedupe
 
 from common import library as comm_lib
+from common import cache as cache_lib
+from common import jobs
+from common.exceptions import NotFound
+from common.exceptions import BadRequest
+from common.drf_custom.paginators import OptionalCursorPagination
+from common.views import SparseQuerysetMixin
+from common.views import IncludeQuerysetMixin
+from common.views import BulkModelMixin
+from common.views import ConditionalGetMixin
+from common.views import ExportMixin
+
 
+# Labels of the choices in the exports.
+STATUS_LABELS = dict(lead_consts.StatusChoice.choices())
+LEAD_SOURCE_LABELS = dict(lead_consts.LeadSourceChoice.choices())
+ROLE_LABELS = dict(lead_consts.RoleChoice.choices())
 
-class IddecodeModelViewSet(viewsets.ModelViewSet):
+
+class IddecodeModelViewSet(
+        ConditionalGetMixin, IncludeQuerysetMixin, SparseQuerysetMixin,
+        viewsets.ModelViewSet):
+
+    pagination_class = OptionalCursorPagination
 
     def get_object(self):
         print(self.basename)
-        return self.basename.objects.get(
+        return self.get_queryset().get(
             pk=comm_lib.decode(self.kwargs['pk']))
 
 
-class LeadViewSet(IddecodeModelViewSet):
+class DedupeMixin:
+    """
+    Adds the detection and merge of duplicate records to a viewset.
+
+    duplicates/ finds the clusters of duplicates in the background and
+    returns the job to poll from duplicates/<id>/. merge/ merges the
+    sources of the request body into its target, by encoded ids.
+
+    The bulk writes of the BulkModelMixin send no signals, they mark the
+    duplicate jobs stale here.
+    """
+
+    dedupe_kind = None
+
+    def perform_bulk_create(self, objects):
+        """Create the objects, then mark the duplicate jobs stale."""
+        super().perform_bulk_create(objects)
+        lead_functions.invalidate_duplicates()
+
+    def perform_bulk_update(self, objects, fields):
+        """Update the objects, then mark the duplicate jobs stale."""
+        super().perform_bulk_update(objects, fields)
+        lead_functions.invalidate_duplicates()
+
+    def perform_bulk_destroy(self, queryset):
+        """Delete the objects, then mark the duplicate jobs stale."""
+        super().perform_bulk_destroy(queryset)
+        lead_functions.invalidate_duplicates()
+
+    @action(detail=False, methods=["post"], url_path="duplicates")
+    def duplicates(self, request, *args, **kwargs):
+        """Start finding the clusters of duplicates."""
+        job = jobs.start_job(
+            lead_consts.DEDUPE_CACHE, {"kind": self.dedupe_kind},
+            lead_tasks.find_duplicates)
+        return Response(job, status=status.HTTP_202_ACCEPTED,)
+
+    @action(
+        detail=False, methods=["get"],
+        url_path=r"duplicates/(?P<job_id>[^/.]+)")
+    def duplicates_job(self, request, job_id=None, *args, **kwargs):
+        """Return the status of a job, with the clusters in its result."""
+        job = jobs.get_job(job_id)
+        if not job:
+            raise NotFound("Job not found or expired.")
+        return Response(job, status=status.HTTP_200_OK,)
+
+    @action(detail=False, methods=["post"], url_path="merge")
+    def merge(self, request, *args, **kwargs):
+        """Merge the sources into the target, return the target."""
+        serializer = lead_serializer.MergeSerializer(
+            data=request.data, context={"model": self.queryset.model})
+        serializer.is_valid(raise_exception=True)
+        target = serializer.validated_data["target"]
+        data = dedupe.MERGES[self.dedupe_kind](
+            target, serializer.validated_data["sources"], request.user)
+        data["target"] = self.get_serializer(target).data
+        return Response(data, status=status.HTTP_200_OK,)
+
+
+class LeadViewSet(ExportMixin, BulkModelMixin, IddecodeModelViewSet):
     """
     ViewSet to perform crud operations on lead.
     *authetication permission required.
@@ -29,9 +127,110 @@ class LeadViewSet(IddecodeModelViewSet):
     serializer_class = lead_serializer.LeadSerializer
     permission_classes = (user_permission.IsAuthenticated,)
     authentication_classes = []
+    filterset_class = LeadFilter
+    export_filename = "leads"
+    export_columns = (
+        ("id", "id", comm_lib.encode),
+        ("name", "name", None),
+        ("organization", "organization__name", None),
+        ("preset", "preset_id__name", None),
+        ("current_stage", "current_stage__name", None),
+        ("status", "status", STATUS_LABELS.get),
+        ("lead_source", "lead_source", LEAD_SOURCE_LABELS.get),
+        ("tags", "tag_names", None),
+        ("pipedrive", "pipedrive", None),
+        ("team_size", "team_size", None),
+        ("revenue", "revenue", None),
+        ("points_secured", "points_secured", None),
+        ("possibility", "possibility", None),
+        ("expected_close_on", "expected_close_on", None),
+        ("created_on", "created_on", None),
+        ("updated_on", "updated_on", None),
+    )
+
+    def get_export_queryset(self):
+        """Leads with the names of their tags, aggregated in the query."""
+        return super().get_export_queryset().annotate(
+            tag_names=StringAgg(
+                "tags__tag_id__name", delimiter=", ", distinct=True))
+
+    @action(detail=True, methods=["get"], url_path="full")
+    def full(self, request, *args, **kwargs):
+        """
+        Return everything shown on the lead page in one response.
+
+        The lead with its organization, stage preset, current stage,
+        contacts with their roles, tags, and answers grouped by stage
+        and question with their scores.
+        """
+        serializer_class = lead_serializer.LeadDetailSerializer
+        lead = serializer_class.plan_queryset(
+            lead_model.Lead.objects.all()).filter(
+                pk=comm_lib.decode(kwargs["pk"])).first()
+        if not lead:
+            raise NotFound("Lead not found.")
+        serializer = serializer_class(
+            lead, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_200_OK,)
+
+    @action(detail=False, methods=["post"], url_path="import")
+    def import_leads(self, request, *args, **kwargs):
+        """
+        Import the leads of an Excel workbook in the background.
+
+        The first row names the columns, a row with the id or pipedrive
+        url of a lead updates it. Returns the job to poll from
+        lead/import/<id>/.
+        """
+        serializer = lead_serializer.LeadImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        path = default_storage.save(
+            "%s/%s.xlsx" % (lead_consts.LEAD_IMPORT_FOLDER, uuid.uuid4().hex),
+            serializer.validated_data["file"])
+        job = jobs.start_job(
+            lead_consts.LEAD_IMPORT_CACHE,
+            {"path": path, "user_id": request.user.id},
+            lead_tasks.import_leads)
+        return Response(job, status=status.HTTP_202_ACCEPTED,)
+
+    @action(
+        detail=False, methods=["get"],
+        url_path=r"import/(?P<job_id>[^/.]+)")
+    def import_job(self, request, job_id=None, *args, **kwargs):
+        """
+        Return the status of an import, with the processed, created,
+        updated and failed rows in its result.
+        """
+        job = jobs.get_job(job_id)
+        if not job:
+            raise NotFound("Job not found or expired.")
+        return Response(job, status=status.HTTP_200_OK,)
+
+    def perform_bulk_create(self, objects):
+        """Create the leads and add them to the lead aggregates."""
+        super().perform_bulk_create(objects)
+        lead_functions.record_bulk_lead_writes(
+            [lead.id for lead in objects], creator=self.get_bulk_user())
+
+    def perform_bulk_update(self, objects, fields):
+        """Update the leads and move them in the lead aggregates."""
+        lead_ids = [lead.id for lead in objects]
+        snapshot = lead_functions.get_bulk_lead_snapshot(lead_ids)
+        super().perform_bulk_update(objects, fields)
+        lead_functions.record_bulk_lead_writes(
+            lead_ids, snapshot, creator=self.get_bulk_user())
+
+    def perform_bulk_destroy(self, queryset):
+        """Delete the leads and remove them from the lead aggregates."""
+        lead_ids = list(queryset.values_list("id", flat=True))
+        snapshot = lead_functions.get_bulk_lead_snapshot(lead_ids)
+        lead_functions.record_deleted_lead_days(lead_ids)
+        with lead_signals.muted():
+            super().perform_bulk_destroy(queryset)
+        lead_functions.record_bulk_lead_writes(lead_ids, snapshot)
     
 
-class OrganizationView(IddecodeModelViewSet):
+class OrganizationView(DedupeMixin, IddecodeModelViewSet):
     """
     View to perform operations on Organization.
     """
@@ -40,6 +239,7 @@ class OrganizationView(IddecodeModelViewSet):
     serializer_class = lead_serializer.OrganizationSerializer
     permission_classes = (user_permission.IsAuthenticated,)
     authentication_classes = []
+    dedupe_kind = "organization"
 
 
 class QuestionView(IddecodeModelViewSet):
@@ -51,9 +251,11 @@ class QuestionView(IddecodeModelViewSet):
     serializer_class = lead_serializer.QuestionSerializer
     http_method_names = ['get']
     authentication_classes = []
+    # The nested options are not covered by the updated_on of questions.
+    conditional_field = None
 
 
-class StageAnswerView(IddecodeModelViewSet):
+class StageAnswerView(ExportMixin, IddecodeModelViewSet):
     """
     View for create and list Stage Answers.
     """
@@ -62,6 +264,17 @@ class StageAnswerView(IddecodeModelViewSet):
     serializer_class = lead_serializer.StageAnswerSerializer
     permission_classes = (user_permission.IsAuthenticated,)
     authentication_classes = []
+    export_filename = "stage_answers"
+    export_columns = (
+        ("id", "id", comm_lib.encode),
+        ("lead_id", "lead_id", comm_lib.encode),
+        ("lead", "lead_id__name", None),
+        ("stage", "stage_id__name", None),
+        ("question", "question_id__question", None),
+        ("option", "option_id__option", None),
+        ("score", "score", None),
+        ("created_on", "created_on", None),
+    )
 
 
 class GeneralAnswerView(IddecodeModelViewSet):
@@ -75,7 +288,43 @@ class GeneralAnswerView(IddecodeModelViewSet):
     authentication_classes = []
 
 
-class ContactViewSet(IddecodeModelViewSet):
+class AnswerSubmissionView(generics.GenericAPIView):
+    """
+    View to submit the answers of a lead to a whole questionnaire.
+
+    Request Body Params:
+        lead(idencode): lead of the answers.
+        stage(idencode): stage of the answers, general answers if not
+            given.
+        answers(list): the questions with their selected options, (
+            [{"question": idencode, "options": [idencode]}]), the
+            selected options replace the previous answers of the question.
+    Answers added meanwhile by another request fail the submission with
+    400, to be submitted again.
+
+    *autheticated user can submit.
+    """
+    serializer_class = lead_serializer.AnswerSubmissionSerializer
+    permission_classes = (user_permission.IsAuthenticated,)
+    authentication_classes = []
+
+    def post(self, request, *args, **kwargs):
+        """Validate and save the answers, return the lead score."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lead = serializer.validated_data["lead"]
+        stage = serializer.validated_data.get("stage")
+        data = lead_functions.save_answers(
+            lead, stage, serializer.validated_data["answers"], request.user)
+        data.update(lead_model.Lead.objects.filter(id=lead.id).values(
+            *lead_consts.LEAD_SCORE_FIELDS).get())
+        data["lead"] = lead.idencode
+        data["stage"] = stage.idencode if stage else None
+        return Response(data, status=status.HTTP_200_OK,)
+
+
+class ContactViewSet(
+        DedupeMixin, ExportMixin, BulkModelMixin, IddecodeModelViewSet):
     """
     ViewSet for manage Contact details.
     """
@@ -84,9 +333,35 @@ class ContactViewSet(IddecodeModelViewSet):
     serializer_class = lead_serializer.ContactSerializer
     permission_classes = (user_permission.IsAuthenticated,)
     authentication_classes = []
+    dedupe_kind = "contact"
+    export_filename = "contacts"
+    export_columns = (
+        ("id", "id", comm_lib.encode),
+        ("name", "name", None),
+        ("email", "email", None),
+        ("organization", "organization__name", None),
+        ("role", "role", ROLE_LABELS.get),
+        ("linkedin", "linkedin", None),
+        ("created_on", "created_on", None),
+    )
+
+    def perform_bulk_update(self, objects, fields):
+        """Update the contacts and the search vectors of their leads."""
+        super().perform_bulk_update(objects, fields)
+        lead_search.update_search_vectors(lead_model.Lead.objects.filter(
+            lead_contacts__contact_id__in=objects))
 
+    def perform_bulk_destroy(self, queryset):
+        """Delete the contacts and rebuild the search of their leads."""
+        lead_ids = list(lead_model.LeadContact.objects.filter(
+            contact_id__in=queryset).values_list("lead_id", flat=True))
+        with lead_signals.muted():
+            super().perform_bulk_destroy(queryset)
+        lead_search.update_search_vectors(
+            lead_model.Lead.objects.filter(id__in=lead_ids))
 
-class LeadContactViewSet(IddecodeModelViewSet):
+
+class LeadContactViewSet(BulkModelMixin, IddecodeModelViewSet):
     """
     ViewSet for lead contact details.
     """
@@ -97,10 +372,100 @@ class LeadContactViewSet(IddecodeModelViewSet):
     # http_method_names = ['get','post']
     authentication_classes = []
 
-    
+    def perform_bulk_create(self, objects):
+        """Create the lead contacts and rebuild the search of the leads."""
+        super().perform_bulk_create(objects)
+        lead_search.update_search_vectors(lead_model.Lead.objects.filter(
+            id__in={lead_contact.lead_id_id for lead_contact in objects}))
+
+    def perform_bulk_update(self, objects, fields):
+        """Update the lead contacts and rebuild the search of the leads."""
+        lead_ids = set(lead_model.LeadContact.objects.filter(
+            id__in=[lead_contact.id for lead_contact in objects]
+        ).values_list("lead_id", flat=True))
+        lead_ids.update(lead_contact.lead_id_id for lead_contact in objects)
+        super().perform_bulk_update(objects, fields)
+        lead_search.update_search_vectors(
+            lead_model.Lead.objects.filter(id__in=lead_ids))
+
+    def perform_bulk_destroy(self, queryset):
+        """Delete the lead contacts and rebuild the search of the leads."""
+        lead_ids = list(queryset.values_list("lead_id", flat=True))
+        with lead_signals.muted():
+            super().perform_bulk_destroy(queryset)
+        lead_search.update_search_vectors(
+            lead_model.Lead.objects.filter(id__in=lead_ids))
+
+
+class LeadSearchView(generics.ListAPIView):
+    """
+    View to search leads by the words of the lead, its organization,
+    contacts and tags.
+
+    Query Params:
+        q(str): search text, every word should match the start of a word.
+        Also accepts the lead filters.
+
+    *autheticated user can view.
+    """
+    serializer_class = lead_serializer.LeadSearchSerializer
+    permission_classes = (user_permission.IsAuthenticated,)
+    authentication_classes = []
+    filterset_class = LeadFilter
+
+    def get_queryset(self):
+        """Matching leads, by rank."""
+        return lead_search.search_leads(
+            self.request.query_params.get("q", ""))
+
+
+class TypeaheadView(generics.ListAPIView):
+    """
+    View to get the organizations or contacts matching a typed text, for
+    the pickers.
+
+    Matches are ranked by trigram similarity, contacts match by name or
+    email. The matches of a text are cached for a few seconds.
+
+    Query Params:
+        q(str): typed text.
+        limit(int): number of matches, 10 by default and 50 at most.
+
+    *autheticated user can view.
+    """
+    permission_classes = (user_permission.IsAuthenticated,)
+    authentication_classes = []
+
+    def list(self, request, *args, **kwargs):
+        """Return the best matches of the text."""
+        kind = kwargs["kind"]
+        if kind not in lead_search.TYPEAHEADS:
+            raise NotFound("Invalid typeahead %s." % kind)
+        try:
+            limit = int(request.query_params.get(
+                "limit", lead_consts.TYPEAHEAD_LIMIT))
+        except ValueError:
+            raise BadRequest("limit should be an integer.")
+        limit = max(1, min(limit, lead_consts.TYPEAHEAD_MAX_LIMIT))
+        data = lead_search.typeahead(
+            kind, request.query_params.get("q", ""), limit)
+        return Response(data, status=status.HTTP_200_OK,)
+
+
 class DashboardView(generics.ListAPIView):
     """
     View to list data in dashboard.
+
+    Query Params:
+        from(unix): leads created on or after.
+        to(unix): leads created on or before.
+        preset_id(idencode): leads of the stage preset.
+        lead_source(int): leads of the source.
+        sections(str): comma separated sections to compute, (
+            totals, lead_stage, stages, possibility, top_leads, trend)
+            defaults to all but top_leads.
+        async(bool): compute in the background and return the job to
+            poll from dashboard/jobs/<id>/.
     
     *autheticated user can view.
     """
@@ -110,7 +475,114 @@ class DashboardView(generics.ListAPIView):
         """
         call get_dashboard function to get data.
         """
-        return Response(get_dashboard(),status=status.HTTP_200_OK,)
+        params = get_dashboard_params(request.query_params)
+        if request.query_params.get("async") in ("1", "true"):
+            job = jobs.start_job(
+                lead_consts.DASHBOARD_CACHE, params,
+                lead_tasks.compute_dashboard)
+            return Response(job, status=status.HTTP_202_ACCEPTED,)
+        data = cache_lib.get_or_compute(
+            lead_consts.DASHBOARD_CACHE, params,
+            lambda: get_dashboard(params))
+        return Response(data,status=status.HTTP_200_OK,)
+
+
+class DashboardJobView(generics.RetrieveAPIView):
+    """
+    View to poll an async dashboard job.
+
+    The result is set once the status is done, jobs expire an hour after
+    their last update.
+
+    *autheticated user can view.
+    """
+    permission_classes = (user_permission.IsAuthenticated,)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Return the status and result of the job."""
+        job = jobs.get_job(kwargs["job_id"])
+        if not job:
+            raise NotFound("Job not found or expired.")
+        return Response(job, status=status.HTTP_200_OK,)
+
+
+class DashboardCacheView(generics.RetrieveAPIView):
+    """
+    View to get the hit/miss/recompute counters of the dashboard cache.
+
+    *autheticated user can view.
+    """
+    permission_classes = (user_permission.IsAuthenticated,)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Return the counters of the dashboard cache."""
+        return Response(
+            cache_lib.get_stats(lead_consts.DASHBOARD_CACHE),
+            status=status.HTTP_200_OK,)
+
+
+class StageAnalyticsView(generics.ListAPIView):
+    """
+    View to list the time spent by leads in each stage.
+
+    Returns the median and p90 dwell time in seconds, and the exit, won
+    and lost rates of the leads that entered each stage. Accepts the
+    from, to, preset_id and lead_source params of the dashboard.
+
+    *autheticated user can view.
+    """
+    permission_classes = (user_permission.IsAuthenticated,)
+
+    def list(self, request, *args, **kwargs):
+        """call get_stage_analytics function to get data."""
+        params = get_dashboard_params(request.query_params)
+        params.pop("sections")
+        data = cache_lib.get_or_compute(
+            lead_consts.STAGE_ANALYTICS_CACHE, params,
+            lambda: get_stage_analytics(params))
+        return Response(data, status=status.HTTP_200_OK,)
+
+
+class CohortView(generics.RetrieveAPIView):
+    """
+    View to get the lead cohorts by creation month.
+
+    Returns the month by status and month by stage counts of the leads.
+    Accepts the from, to, preset_id and lead_source params of the
+    dashboard.
+
+    *autheticated user can view.
+    """
+    permission_classes = (user_permission.IsAuthenticated,)
+
+    def retrieve(self, request, *args, **kwargs):
+        """call get_cohorts function to get data."""
+        params = get_dashboard_params(request.query_params)
+        params.pop("sections")
+        data = cache_lib.get_or_compute(
+            lead_consts.COHORT_CACHE, params, lambda: get_cohorts(params))
+        return Response(data, status=status.HTTP_200_OK,)
+
+
+class ForecastView(generics.RetrieveAPIView):
+    """
+    View to get the revenue forecast of the active leads.
+
+    Returns the revenue and the possibility weighted expected revenue per
+    stage, per preset and per month of expected close. Accepts the from,
+    to, preset_id and lead_source params of the dashboard.
+
+    *autheticated user can view.
+    """
+    permission_classes = (user_permission.IsAuthenticated,)
+
+    def retrieve(self, request, *args, **kwargs):
+        """call get_forecast function to get data."""
+        params = get_dashboard_params(request.query_params)
+        params.pop("sections")
+        data = cache_lib.get_or_compute(
+            lead_consts.FORECAST_CACHE, params, lambda: get_forecast(params))
+        return Response(data, status=status.HTTP_200_OK,)
         
         
 # class MakeLeadWon(viewsets.ModelViewSet):